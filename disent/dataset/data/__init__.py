@@ -26,14 +26,19 @@
 from disent.dataset.data._episodes import BaseEpisodesData
 from disent.dataset.data._episodes__custom import EpisodesPickledData
 from disent.dataset.data._episodes__custom import EpisodesDownloadZippedPickledData
+from disent.dataset.data._episodes__custom import EpisodesPackedData
+from disent.dataset.data._episodes__custom import save_pickled_episodes_packed
 
 # raw -- groundtruth
 from disent.dataset.data._groundtruth import ArrayGroundTruthData
 from disent.dataset.data._groundtruth import SelfContainedHdf5GroundTruthData
+from disent.dataset.data._groundtruth import MmapGroundTruthData
 
 # raw
 from disent.dataset.data._raw import ArrayDataset
 from disent.dataset.data._raw import Hdf5Dataset
+from disent.dataset.data._raw import Hdf5CacheInfo
+from disent.dataset.data._raw import SharedArray
 
 # groundtruth -- base
 from disent.dataset.data._groundtruth import GroundTruthData
@@ -41,6 +46,11 @@ from disent.dataset.data._groundtruth import DiskGroundTruthData
 from disent.dataset.data._groundtruth import NumpyFileGroundTruthData
 from disent.dataset.data._groundtruth import Hdf5GroundTruthData
 
+# groundtruth -- wrappers
+from disent.dataset.data._groundtruth__cached import CachedGroundTruthData
+from disent.dataset.data._groundtruth__cached import ObsCacheInfo
+from disent.dataset.data._groundtruth__indices import IndicesGroundTruthData
+
 # groundtruth -- impl
 from disent.dataset.data._groundtruth__cars3d import Cars3dData
 from disent.dataset.data._groundtruth__cars3d import Cars3d64Data  # optimized version of cars3d for 64x64 images
@@ -47,13 +47,14 @@ class BaseEpisodesData(Dataset, LengthIter):
         self._lengths = np.array([len(episode) for episode in self._episodes])
         self._length = np.sum(self._lengths)
         self._weights = self._lengths / self._length
+        # the index of the first observation of each episode, with the
+        # total length appended, used to look up episodes with a binary search
+        self._offsets = np.concatenate([[0], np.cumsum(self._lengths)])
 
     def __len__(self):
         return self._length
 
     def __getitem__(self, idx):
-        # this can be slow!
-        # linear search is conducted!
         episode, idx, _ = self.get_episode_and_idx(idx)
         obs = episode[idx]
         if self._transform is not None:
@@ -61,20 +62,32 @@ class BaseEpisodesData(Dataset, LengthIter):
         return obs
 
     def get_episode_and_idx(self, idx) -> Tuple[np.ndarray, int, int]:
+        """
+        Get the episode that an index belongs to, the index of the
+        observation within that episode, and the offset of the episode.
+        """
         assert idx >= 0, 'Negative indices are not supported.'
-        # linear search for episode & shift idx accordingly
-        # TODO: This could be better...
-        # TODO: add caching?
-        episode, offset = None, 0
-        for episode in self._episodes:
-            length = len(episode)
-            if idx < length:
-                break
-            else:
-                offset += length
-                idx -= length
-        # return found
-        return episode, idx, offset
+        if idx >= self._length:
+            raise IndexError(f'index {idx} is out of bounds for episodes with total length: {self._length}')
+        # binary search for episode & shift idx accordingly
+        i = np.searchsorted(self._offsets, idx, side='right') - 1
+        offset = int(self._offsets[i])
+        return self._episodes[i], int(idx - offset), offset
+
+    def get_episode_and_idx_batch(self, idxs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vectorized version of `get_episode_and_idx`, returns arrays of the same
+        shape as `idxs` containing the indices of the episodes instead of the
+        episodes themselves, the indices within the episodes, and the offsets.
+        """
+        idxs = np.asarray(idxs)
+        assert np.all(idxs >= 0), 'Negative indices are not supported.'
+        if np.any(idxs >= self._length):
+            raise IndexError(f'indices are out of bounds for episodes with total length: {self._length}')
+        # binary search for episodes & shift idxs accordingly
+        episode_idxs = np.searchsorted(self._offsets, idxs, side='right') - 1
+        offsets = self._offsets[episode_idxs]
+        return episode_idxs, idxs - offsets, offsets
 
     def _load_episode_observations(self) -> List[np.ndarray]:
         raise NotImplementedError
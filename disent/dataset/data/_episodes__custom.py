@@ -24,12 +24,15 @@
 
 import logging
 import os
+from typing import Iterator
 from typing import List
 from typing import Tuple
 
 import numpy as np
 
 from disent.dataset.data import BaseEpisodesData
+from disent.dataset.util.mmap import mmap_open
+from disent.dataset.util.mmap import mmap_save_batches
 from disent.util.inout.files import download_file
 from disent.util.inout.paths import filename_from_url
 
@@ -55,68 +58,74 @@ class EpisodesPickledData(BaseEpisodesData):
     # TODO: convert this to data files?
 
     def _load_episode_observations(self) -> List[np.ndarray]:
-        import pickle
-        # load the raw data!
-        with open(self._required_file, 'rb') as f:
-            # ~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
-            # - Each element in the root list represents an episode
-            # - An episode is a list containing many executed options
-            # - Each option is a tuple containing:
-            #     1. The option name
-            #     2. The option id
-            #     3. A list of ground truth states covering the option execution. Each ground truth state is a dictionary
-            #     4. A list of environment images covering the option execution
-            # ~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
-            # Episode = List[Options]
-            #   Options = List[Option]
-            #     Option  = Tuple[OptionName, OptionId, GroundTruthStates, ObservedStates]
-            #       OptionName        = str
-            #       OptionId          = int
-            #       GroundTruthStates = List[dict]
-            #       ObservedStates    = List[np.ndarray]
-            # ~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
-            raw_episodes = pickle.load(f)
-        # check variables
-        option_ids_to_names = {}
-        ground_truth_keys = None
-        img_shape = None
-        # load data
-        episodes = []
-        for i, raw_episode in enumerate(raw_episodes):
-            rollout = []
-            for j, raw_option in enumerate(raw_episode):
-                # GET: option info
-                raw_option: Tuple[str, int, List[dict], List[np.ndarray]]
-                option_name, option_id, ground_truth_states, observed_states = raw_option
-                # CHECK: number of observations
-                assert len(ground_truth_states) == len(observed_states)
-                # CHECK: option ids and names
-                if option_id not in option_ids_to_names:
-                    option_ids_to_names[option_id] = option_name
-                else:
-                    assert option_ids_to_names[option_id] == option_name
-                # CHECK: ground truth keys
-                if ground_truth_keys is None:
-                    ground_truth_keys = set(ground_truth_states[0].keys())
-                else:
-                    for gt_state in ground_truth_states:
-                        assert ground_truth_keys == gt_state.keys()
-                # CHECK: observation shapes
-                if img_shape is None:
-                    img_shape = observed_states[0].shape
-                else:
-                    for observation in observed_states:
-                        assert observation.shape == img_shape
-                # APPEND: all observations into one long episode
-                rollout.extend(observed_states)
-                # cleanup unused memory! This is not ideal, but works well.
-                raw_episode[j] = None
-            # make the long episode!
-            episodes.append(np.array(rollout))
+        raw_episodes = _load_raw_pickled_episodes(self._required_file)
+        # make the long episodes!
+        return [np.array(rollout) for rollout in _iter_raw_pickled_episodes(raw_episodes)]
+
+
+def _load_raw_pickled_episodes(file: str) -> list:
+    import pickle
+    # load the raw data!
+    with open(file, 'rb') as f:
+        # ~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+        # - Each element in the root list represents an episode
+        # - An episode is a list containing many executed options
+        # - Each option is a tuple containing:
+        #     1. The option name
+        #     2. The option id
+        #     3. A list of ground truth states covering the option execution. Each ground truth state is a dictionary
+        #     4. A list of environment images covering the option execution
+        # ~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+        # Episode = List[Options]
+        #   Options = List[Option]
+        #     Option  = Tuple[OptionName, OptionId, GroundTruthStates, ObservedStates]
+        #       OptionName        = str
+        #       OptionId          = int
+        #       GroundTruthStates = List[dict]
+        #       ObservedStates    = List[np.ndarray]
+        # ~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
+        return pickle.load(f)
+
+
+def _iter_raw_pickled_episodes(raw_episodes: list) -> Iterator[List[np.ndarray]]:
+    # check variables
+    option_ids_to_names = {}
+    ground_truth_keys = None
+    img_shape = None
+    # load data
+    for i, raw_episode in enumerate(raw_episodes):
+        rollout = []
+        for j, raw_option in enumerate(raw_episode):
+            # GET: option info
+            raw_option: Tuple[str, int, List[dict], List[np.ndarray]]
+            option_name, option_id, ground_truth_states, observed_states = raw_option
+            # CHECK: number of observations
+            assert len(ground_truth_states) == len(observed_states)
+            # CHECK: option ids and names
+            if option_id not in option_ids_to_names:
+                option_ids_to_names[option_id] = option_name
+            else:
+                assert option_ids_to_names[option_id] == option_name
+            # CHECK: ground truth keys
+            if ground_truth_keys is None:
+                ground_truth_keys = set(ground_truth_states[0].keys())
+            else:
+                for gt_state in ground_truth_states:
+                    assert ground_truth_keys == gt_state.keys()
+            # CHECK: observation shapes
+            if img_shape is None:
+                img_shape = observed_states[0].shape
+            else:
+                for observation in observed_states:
+                    assert observation.shape == img_shape
+            # APPEND: all observations into one long episode
+            rollout.extend(observed_states)
             # cleanup unused memory! This is not ideal, but works well.
-            raw_episodes[i] = None
-        # done!
-        return episodes
+            raw_episode[j] = None
+        # yield the long episode!
+        yield rollout
+        # cleanup unused memory! This is not ideal, but works well.
+        raw_episodes[i] = None
 
 
 class EpisodesDownloadZippedPickledData(EpisodesPickledData):
@@ -178,6 +187,91 @@ class EpisodesDownloadZippedPickledData(EpisodesPickledData):
         # ~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~-~
 
 
+# ========================================================================= #
+# custom episodes -- packed                                                 #
+# ========================================================================= #
+
+
+def save_pickled_episodes_packed(
+    inp_file: str,
+    out_file: str,
+    batch_size: int = 1024,
+    overwrite: bool = False,
+    show_progress: bool = True,
+):
+    """
+    Convert the episodes of a file loaded by `EpisodesPickledData` into a single
+    packed memory-mappable file that can be loaded with `EpisodesPackedData`.
+    - the observations of all the episodes are stored contiguously in order,
+      and the length of each episode is stored in the header of the file.
+    """
+    raw_episodes = _load_raw_pickled_episodes(inp_file)
+    # get the length of each episode & the observation shape without copying
+    lengths = [sum(len(raw_option[3]) for raw_option in raw_episode) for raw_episode in raw_episodes]
+    assert sum(lengths) > 0, f'There must be at least one observation in: {repr(inp_file)}'
+    example = np.asarray(next(obs for raw_episode in raw_episodes for raw_option in raw_episode for obs in raw_option[3]))
+    # the observations are written in order, with the batches spanning episodes
+    observations = (obs for rollout in _iter_raw_pickled_episodes(raw_episodes) for obs in rollout)
+    mmap_save_batches(
+        out_path=out_file,
+        get_batch_fn=lambda i, j: np.stack([next(observations) for _ in range(j - i)]),
+        shape=(sum(lengths), *example.shape),
+        dtype=example.dtype,
+        # THESE ATTRIBUTES SHOULD MATCH: EpisodesPackedData
+        attrs=dict(
+            dataset_cls_name=EpisodesPackedData.__name__,
+            episode_lengths=[int(length) for length in lengths],
+        ),
+        batch_size=batch_size,
+        overwrite=overwrite,
+        show_progress=show_progress,
+    )
+    log.debug(f'saved packed episodes from: {repr(inp_file)} to: {repr(out_file)}')
+
+
+class EpisodesPackedData(BaseEpisodesData):
+    """
+    Dataset that memory maps the episodes saved with `save_pickled_episodes_packed`
+    - instead of unpickling and copying the episodes every run, the file is opened
+      and the episodes are read-only zero-copy views into the packed observations.
+    - all processes that open the same file share the same data in the OS page cache.
+    """
+
+    def __init__(self, path: str, transform=None):
+        self._path = path
+        self._data, header = mmap_open(self._path, mode='r')
+        self._data = self._data.view(np.ndarray)
+        self._episode_lengths = np.array(header['attrs']['episode_lengths'], dtype='int64')
+        assert np.sum(self._episode_lengths) == len(self._data), f'the sum of the episode lengths: {np.sum(self._episode_lengths)} does not match the number of observations: {len(self._data)} in file: {repr(self._path)}'
+        # load data
+        super().__init__(transform=transform)
+
+    def __getitem__(self, idx):
+        # the packed observations are in the same order as the indices
+        obs = self._data[idx]
+        if self._transform is not None:
+            obs = self._transform(obs)
+        return obs
+
+    def _load_episode_observations(self) -> List[np.ndarray]:
+        offsets = np.concatenate([[0], np.cumsum(self._episode_lengths)])
+        return [self._data[i:j] for i, j in zip(offsets[:-1], offsets[1:])]
+
+    # CUSTOM PICKLE HANDLING -- otherwise the entire memory mapped array is pickled!
+    # workers re-open the file instead, still sharing the same pages in memory.
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_data', None)
+        state.pop('_episodes', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = mmap_open(self._path, mode='r')[0].view(np.ndarray)
+        self._episodes = self._load_episode_observations()
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -33,13 +33,20 @@ from typing import Tuple
 from typing import Union
 
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 
+import disent.dataset.transform.functional as F_d
 from disent.dataset.util.datafile import DataFile
 from disent.dataset.util.datafile import DataFileHashedDlH5
+from disent.dataset.util.mmap import mmap_open
+from disent.dataset.util.prepare import prepare_datafiles
+from disent.dataset.data._raw import Hdf5CacheInfo
 from disent.dataset.data._raw import Hdf5Dataset
+from disent.dataset.data._raw import SharedArray
 from disent.dataset.util.state_space import StateSpace
 from disent.util.inout.paths import ensure_dir_exists
+from disent.util.seeds import RngLike
 
 
 log = logging.getLogger(__name__)
@@ -130,16 +137,50 @@ class GroundTruthData(Dataset, StateSpace):
     def _get_observation(self, idx):
         raise NotImplementedError
 
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Batches                                                               #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    def __getitems__(self, idxs: Sequence[int]) -> List[Any]:
+        """
+        Batch-level version of `__getitem__`, used by the `torch.utils.data.DataLoader`
+        when automatic batching is enabled. Observations are read with `get_observations`,
+        and the transform is only applied once to each unique observation.
+        - returns a list of observations in the same order as the indices
+        """
+        if self._transform is None:
+            return list(self.get_observations(idxs))
+        # transform unique observations only
+        uniq, inverse = np.unique(np.asarray(idxs), return_inverse=True)
+        obs = F_d.transform_observations(self._transform, list(self._get_observations(uniq)))
+        return [obs[i] for i in inverse]
+
+    def get_observations(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Get a batch of untransformed observations. The indices are sorted and de-duplicated
+        so that the underlying storage is read only once using a single fancy-indexed read,
+        the observations are then scattered back into the original order.
+        - the output can be written into a preallocated array by specifying `out`
+        """
+        idxs = np.asarray(idxs)
+        assert idxs.ndim == 1, f'indices must be a 1D array, got shape: {idxs.shape}'
+        uniq, inverse = np.unique(idxs, return_inverse=True)
+        return np.take(self._get_observations(uniq), inverse.reshape(-1), axis=0, out=out)
+
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        # override this for faster batch reads, the indices are always sorted and unique
+        return np.stack([self._get_observation(idx) for idx in idxs], axis=0)
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # EXTRAS                                                                #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 
-    def sample_random_obs_traversal(self, f_idx: int = None, base_factors=None, num: int = None, mode='interval', obs_collect_fn=None) -> Tuple[np.ndarray, np.ndarray, Union[List[Any], Any]]:
+    def sample_random_obs_traversal(self, f_idx: int = None, base_factors=None, num: int = None, mode='interval', obs_collect_fn=None, rng: RngLike = None) -> Tuple[np.ndarray, np.ndarray, Union[List[Any], Any]]:
         """
         Same API as sample_random_factor_traversal, but also
         returns the corresponding indices and uncollated list of observations
         """
-        factors = self.sample_random_factor_traversal(f_idx=f_idx, base_factors=base_factors, num=num, mode=mode)
+        factors = self.sample_random_factor_traversal(f_idx=f_idx, base_factors=base_factors, num=num, mode=mode, rng=rng)
         indices = self.pos_to_idx(factors)
         obs = [self[i] for i in indices]
         if obs_collect_fn is not None:
@@ -193,6 +234,9 @@ class ArrayGroundTruthData(GroundTruthData):
         #       hindering multi-threaded environments?
         return self._array[idx]
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self._array[idxs]
+
     @classmethod
     def new_like(cls, array, gt_data: GroundTruthData, array_chn_is_last: bool = True):
         # TODO: should this not copy the x_shape and transform?
@@ -229,9 +273,8 @@ class _DiskDataMixin(object):
         log.info(f'{self.name}: data_dir_share={repr(self._data_dir)}')
         # prepare everything
         if prepare:
-            for datafile in self.datafiles:
-                log.debug(f'[preparing]: {datafile} into data dir: {self._data_dir}')
-                datafile.prepare(self.data_dir)
+            log.debug(f'[preparing]: {list(self.datafiles)} into data dir: {self._data_dir}')
+            prepare_datafiles(self.datafiles, self.data_dir)
 
     @property
     def data_dir(self) -> str:
@@ -286,6 +329,9 @@ class NumpyFileGroundTruthData(DiskGroundTruthData, metaclass=ABCMeta):
     def _get_observation(self, idx):
         return self._data[idx]
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self._data[idxs]
+
     @property
     def datafiles(self) -> Sequence[DataFile]:
         return [self.datafile]
@@ -300,25 +346,62 @@ class NumpyFileGroundTruthData(DiskGroundTruthData, metaclass=ABCMeta):
         return None
 
 
+def _h5_copy_batch_size(data: Hdf5Dataset, target_nbytes: int = 64 * 1024**2) -> int:
+    # copy whole chunks at a time, approximately `target_nbytes` per batch
+    chunk_len = 1 if (data.chunks is None) else data.chunks[0]
+    obs_nbytes = max(int(np.prod(data.shape[1:], dtype='int64')) * data.dtype.itemsize, 1)
+    return max(target_nbytes // (obs_nbytes * chunk_len), 1) * chunk_len
+
+
 class _Hdf5DataMixin(object):
 
     # attrs this class defines in _mixin_hdf5_init
-    _in_memory: bool
+    _in_memory: Union[bool, str]
     _attrs: dict
-    _data: Union[Hdf5Dataset, np.ndarray]
-
-    def _mixin_hdf5_init(self, h5_path: str, h5_dataset_name: str = 'data', in_memory: bool = False):
+    _data: Union[Hdf5Dataset, SharedArray, np.ndarray]
+
+    def _mixin_hdf5_init(
+        self,
+        h5_path: str,
+        h5_dataset_name: str = 'data',
+        in_memory: Union[bool, str] = False,
+        rdcc_nbytes: Optional[int] = None,
+        rdcc_nslots: Optional[int] = None,
+        rdcc_w0: Optional[float] = None,
+        chunk_cache_nbytes: int = 0,
+    ):
+        """
+        Modes for `in_memory`:
+        - False: read observations from the hdf5 file on disk
+        - True: load the entire dataset into memory, each process that
+                unpickles this dataset (eg. spawned workers) gets its own copy
+        - 'shared': load the entire dataset into shared memory, only the name
+                    of the memory block is pickled, so all processes share one copy
+
+        The cache settings only apply when reading from disk, see `Hdf5Dataset`.
+        """
+        if in_memory not in (True, False, 'shared'):
+            raise KeyError(f'invalid in_memory mode: {repr(in_memory)}, must be one of: True, False, {repr("shared")}')
         # variables
         self._in_memory = in_memory
         # load the h5py dataset
         data = Hdf5Dataset(
             h5_path=h5_path,
             h5_dataset_name=h5_dataset_name,
+            rdcc_nbytes=rdcc_nbytes,
+            rdcc_nslots=rdcc_nslots,
+            rdcc_w0=rdcc_w0,
+            chunk_cache_nbytes=chunk_cache_nbytes if (not in_memory) else 0,
         )
         # load attributes
         self._attrs = data.get_attrs()
         # handle different memory modes
-        if self._in_memory:
+        if self._in_memory == 'shared':
+            # Load the entire dataset into shared memory in batches, avoiding
+            # a second full copy of the dataset during loading.
+            self._data = SharedArray.from_array(data, batch_size=_h5_copy_batch_size(data))
+            data.close()
+        elif self._in_memory:
             # Load the entire dataset into memory if required
             # indexing dataset objects returns numpy array
             # instantiating np.array from the dataset requires double memory.
@@ -332,6 +415,12 @@ class _Hdf5DataMixin(object):
     def __len__(self):
         return len(self._data)
 
+    def cache_info(self) -> Optional[Hdf5CacheInfo]:
+        # only datasets that are read from disk have a chunk cache
+        if isinstance(self._data, Hdf5Dataset):
+            return self._data.cache_info()
+        return None
+
     @property
     def img_shape(self):
         shape = self._data.shape[1:]
@@ -342,6 +431,11 @@ class _Hdf5DataMixin(object):
     def _get_observation(self, idx):
         return self._data[idx]
 
+    # override from GroundTruthData
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        # h5py requires that fancy indices are increasing, which is guaranteed by the caller
+        return self._data[idxs]
+
 
 class Hdf5GroundTruthData(_Hdf5DataMixin, DiskGroundTruthData, metaclass=ABCMeta):
     """
@@ -350,13 +444,27 @@ class Hdf5GroundTruthData(_Hdf5DataMixin, DiskGroundTruthData, metaclass=ABCMeta
       that points to the hdf5 dataset in the file to load.
     """
 
-    def __init__(self, data_root: Optional[str] = None, prepare: bool = False, in_memory=False, transform=None):
+    def __init__(
+        self,
+        data_root: Optional[str] = None,
+        prepare: bool = False,
+        in_memory: Union[bool, str] = False,
+        transform=None,
+        rdcc_nbytes: Optional[int] = None,
+        rdcc_nslots: Optional[int] = None,
+        rdcc_w0: Optional[float] = None,
+        chunk_cache_nbytes: int = 0,
+    ):
         super().__init__(data_root=data_root, prepare=prepare, transform=transform)
         # initialize mixin
         self._mixin_hdf5_init(
             h5_path=os.path.join(self.data_dir, self.datafile.out_name),
             h5_dataset_name=self.datafile.dataset_name,
             in_memory=in_memory,
+            rdcc_nbytes=rdcc_nbytes,
+            rdcc_nslots=rdcc_nslots,
+            rdcc_w0=rdcc_w0,
+            chunk_cache_nbytes=chunk_cache_nbytes,
         )
 
     @property
@@ -370,12 +478,25 @@ class Hdf5GroundTruthData(_Hdf5DataMixin, DiskGroundTruthData, metaclass=ABCMeta
 
 class SelfContainedHdf5GroundTruthData(_Hdf5DataMixin, GroundTruthData):
 
-    def __init__(self, h5_path: str, in_memory=False, transform=None):
+    def __init__(
+        self,
+        h5_path: str,
+        in_memory: Union[bool, str] = False,
+        transform=None,
+        rdcc_nbytes: Optional[int] = None,
+        rdcc_nslots: Optional[int] = None,
+        rdcc_w0: Optional[float] = None,
+        chunk_cache_nbytes: int = 0,
+    ):
         # initialize mixin
         self._mixin_hdf5_init(
             h5_path=h5_path,
             h5_dataset_name='data',
             in_memory=in_memory,
+            rdcc_nbytes=rdcc_nbytes,
+            rdcc_nslots=rdcc_nslots,
+            rdcc_w0=rdcc_w0,
+            chunk_cache_nbytes=chunk_cache_nbytes,
         )
         # load attrs
         self._attr_name = self._attrs['dataset_name'].decode("utf-8")
@@ -404,6 +525,88 @@ class SelfContainedHdf5GroundTruthData(_Hdf5DataMixin, GroundTruthData):
         return self._img_shape
 
 
+# ========================================================================= #
+# memory mapped ground truth data                                           #
+# ========================================================================= #
+
+
+class MmapGroundTruthData(GroundTruthData):
+    """
+    Dataset that memory maps a file saved with `disent.dataset.util.mmap.mmap_save_gt_data`
+    - the data is never decompressed or copied into each process, instead all processes
+      that open the same file share the same data in the OS page cache.
+    - reading single observations is zero-copy, the returned arrays are read-only.
+
+    Files saved with `disent.dataset.util.materialize.materialize_transformed` contain
+    observations that have already been transformed, for example (C, H, W) float32
+    tensors, in which case the observations are returned as tensors.
+    """
+
+    def __init__(self, path: str, transform=None):
+        self._path = path
+        self._data, header = mmap_open(self._path, mode='r')
+        # load attrs
+        attrs = header['attrs']
+        self._attr_name = attrs['dataset_name']
+        self._attr_factor_names = tuple(attrs['factor_names'])
+        self._attr_factor_sizes = tuple(int(size) for size in attrs['factor_sizes'])
+        self._obs_type = attrs.get('obs_type', 'numpy')
+        assert self._obs_type in ('numpy', 'torch'), f'invalid obs_type: {repr(self._obs_type)} in file: {repr(self._path)}'
+        # set size
+        if 'img_shape' in attrs:
+            self._img_shape = tuple(int(s) for s in attrs['img_shape'])
+        else:
+            (B, H, W, C) = self._data.shape
+            self._img_shape = (H, W, C)
+        # initialize!
+        super().__init__(transform=transform)
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def name(self) -> str:
+        return self._attr_name
+
+    @property
+    def factor_names(self) -> Tuple[str, ...]:
+        return self._attr_factor_names
+
+    @property
+    def factor_sizes(self) -> Tuple[int, ...]:
+        return self._attr_factor_sizes
+
+    @property
+    def img_shape(self) -> Tuple[int, ...]:
+        return self._img_shape
+
+    def _get_observation(self, idx):
+        if self._obs_type == 'torch':
+            return torch.from_numpy(np.array(self._data[idx]))
+        return self._data[idx].view(np.ndarray)
+
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self._data[idxs].view(np.ndarray)
+
+    def __getitems__(self, idxs: Sequence[int]) -> List[Any]:
+        if self._obs_type == 'torch':
+            obs = list(torch.from_numpy(self.get_observations(idxs)))
+            return obs if (self._transform is None) else [self._transform(o) for o in obs]
+        return super().__getitems__(idxs)
+
+    # CUSTOM PICKLE HANDLING -- otherwise the entire memory mapped array is pickled!
+    # workers re-open the file instead, still sharing the same pages in memory.
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_data', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data, _ = mmap_open(self._path, mode='r')
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
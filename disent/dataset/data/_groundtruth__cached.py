@@ -0,0 +1,367 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+import logging
+import os
+import sys
+import tempfile
+import weakref
+from collections import OrderedDict
+from typing import Any
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from disent.dataset.data._groundtruth import GroundTruthData
+from disent.dataset.data._raw import SharedArray
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# helper                                                                    #
+# ========================================================================= #
+
+
+class ObsCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    num_items: int
+    nbytes: int
+    max_nbytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return (self.hits / total) if (total > 0) else 0.
+
+
+def _obs_nbytes(obs: Any) -> int:
+    if isinstance(obs, torch.Tensor):
+        return obs.element_size() * obs.nelement()
+    elif isinstance(obs, np.ndarray):
+        return obs.nbytes
+    elif isinstance(obs, (tuple, list)):
+        return sum(_obs_nbytes(o) for o in obs)
+    elif isinstance(obs, dict):
+        return sum(_obs_nbytes(o) for o in obs.values())
+    return sys.getsizeof(obs)
+
+
+# ========================================================================= #
+# caches                                                                    #
+# ========================================================================= #
+
+
+class _LocalObsCache(object):
+    """
+    LRU cache of observations bounded by the number of bytes,
+    local to each process. The contents are not pickled.
+    """
+
+    def __init__(self, max_nbytes: int):
+        self._max_nbytes = max_nbytes
+        self._init()
+
+    def _init(self):
+        self._cache: 'OrderedDict[int, Tuple[Any, int]]' = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, idx: int) -> Optional[Any]:
+        item = self._cache.get(idx, None)
+        if item is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._cache.move_to_end(idx)
+        return item[0]
+
+    def put(self, idx: int, obs: Any):
+        nbytes = _obs_nbytes(obs)
+        if (nbytes > self._max_nbytes) or (idx in self._cache):
+            return
+        # evict the least recently used observations
+        while self._cache and (self._nbytes + nbytes > self._max_nbytes):
+            _, (_, evicted_nbytes) = self._cache.popitem(last=False)
+            self._nbytes -= evicted_nbytes
+        self._cache[idx] = (obs, nbytes)
+        self._nbytes += nbytes
+
+    def info(self) -> ObsCacheInfo:
+        return ObsCacheInfo(hits=self._hits, misses=self._misses, num_items=len(self._cache), nbytes=self._nbytes, max_nbytes=self._max_nbytes)
+
+    def clear(self):
+        self._init()
+
+    def __getstate__(self):
+        return dict(max_nbytes=self._max_nbytes)
+
+    def __setstate__(self, state):
+        self._max_nbytes = state['max_nbytes']
+        self._init()
+
+
+def _remove_file(path: str, owner_pid: int):
+    if owner_pid == os.getpid():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _SharedObsCache(object):
+    """
+    Direct-mapped cache of fixed-size observations stored in shared memory,
+    shared between all the processes that unpickle it (eg. DataLoader workers).
+    - each index can only be stored in a single slot: `idx % num_slots`, consecutive
+      indices never evict each other, which suits samplers that return nearby observations.
+    - access to each slot is synchronised across processes with
+      POSIX record locks on a temporary lock file.
+    - hit & miss counters are local to each process.
+    """
+
+    def __init__(self, max_nbytes: int, example_obs: Any, max_items: int):
+        try:
+            import fcntl
+        except ImportError:  # pragma: no cover
+            raise NotImplementedError('shared observation caches are only supported on platforms with `fcntl`')
+        # get the observation type
+        if isinstance(example_obs, torch.Tensor):
+            self._is_tensor = True
+            example_obs = example_obs.detach().cpu().numpy()
+        elif isinstance(example_obs, np.ndarray):
+            self._is_tensor = False
+        else:
+            raise TypeError(f'shared observation caches only support observations that are numpy arrays or torch tensors, got: {type(example_obs)}')
+        # allocate the slots
+        self._max_nbytes = max_nbytes
+        self._obs_shape, self._obs_dtype = example_obs.shape, example_obs.dtype
+        self._num_slots = int(np.clip(max_nbytes // max(example_obs.nbytes, 1), 1, max(max_items, 1)))
+        self._values = SharedArray((self._num_slots, *self._obs_shape), dtype=self._obs_dtype, readonly=False)
+        self._keys = SharedArray((self._num_slots,), dtype='int64', readonly=False)  # zero is empty, otherwise: idx + 1
+        # make the lock file, this is removed by the owner
+        fd, self._lock_path = tempfile.mkstemp(prefix='disent_obs_cache_', suffix='.lock')
+        os.close(fd)
+        self._finalizer = weakref.finalize(self, _remove_file, self._lock_path, os.getpid())
+        self._init()
+
+    def _init(self):
+        self._lock_fd = None
+        self._lock_pid = None
+        self._hits = 0
+        self._misses = 0
+
+    def _lock(self, slot: int, exclusive: bool):
+        import fcntl
+        # file descriptors are opened lazily in each process
+        if self._lock_pid != os.getpid():
+            self._lock_fd = os.open(self._lock_path, os.O_RDWR)
+            self._lock_pid = os.getpid()
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, 1, slot)
+
+    def _unlock(self, slot: int):
+        import fcntl
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, slot)
+
+    def get(self, idx: int) -> Optional[Any]:
+        slot = idx % self._num_slots
+        self._lock(slot, exclusive=False)
+        try:
+            obs = self._values.array[slot].copy() if (self._keys.array[slot] == idx + 1) else None
+        finally:
+            self._unlock(slot)
+        if obs is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return torch.from_numpy(obs) if self._is_tensor else obs
+
+    def put(self, idx: int, obs: Any):
+        if isinstance(obs, torch.Tensor):
+            obs = obs.detach().cpu().numpy()
+        if (obs.shape != self._obs_shape) or (obs.dtype != self._obs_dtype):
+            log.debug(f'observation with shape: {obs.shape} and dtype: {obs.dtype} is not cached, expected shape: {self._obs_shape} and dtype: {self._obs_dtype}')
+            return
+        slot = idx % self._num_slots
+        self._lock(slot, exclusive=True)
+        try:
+            self._values.array[slot] = obs
+            self._keys.array[slot] = idx + 1
+        finally:
+            self._unlock(slot)
+
+    def info(self) -> ObsCacheInfo:
+        num_items = int(np.count_nonzero(self._keys.array))
+        return ObsCacheInfo(hits=self._hits, misses=self._misses, num_items=num_items, nbytes=num_items * self._values.array[0].nbytes, max_nbytes=self._max_nbytes)
+
+    def clear(self):
+        self._keys.array[:] = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ['_lock_fd', '_lock_pid', '_hits', '_misses', '_finalizer']:
+            state.pop(k)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init()
+
+
+# ========================================================================= #
+# cached ground truth data                                                  #
+# ========================================================================= #
+
+
+class CachedGroundTruthData(GroundTruthData):
+    """
+    Wraps a ground truth dataset, caching the transformed observations
+    in memory so that the observations do not need to be re-read, re-rendered
+    or re-transformed when the same indices are sampled again.
+
+    - the cache is bounded by `max_nbytes`, if `shared=False` then each process
+      (eg. DataLoader worker) has its own LRU cache, otherwise the cache is allocated
+      in shared memory and used by all the processes. Shared caches require all
+      the transformed observations to be arrays or tensors with the same shape.
+    - the transform must be deterministic, and observations returned from the
+      cache must not be modified in-place.
+    - `get_observations` still returns untransformed observations and is never cached.
+    """
+
+    def __init__(self, gt_data: GroundTruthData, max_nbytes: int = 256 * 1024**2, shared: bool = False):
+        assert isinstance(gt_data, GroundTruthData), f'gt_data must be an instance of {GroundTruthData.__name__}, got: {repr(gt_data)}'
+        assert max_nbytes > 0, f'max_nbytes must be > 0, got: {repr(max_nbytes)}'
+        self._gt_data = gt_data
+        # make the cache
+        if shared:
+            self._cache = _SharedObsCache(max_nbytes=max_nbytes, example_obs=gt_data[0], max_items=len(gt_data))
+        else:
+            self._cache = _LocalObsCache(max_nbytes=max_nbytes)
+        # the transform is applied by the wrapped dataset
+        super().__init__(transform=None)
+
+    @property
+    def gt_data(self) -> GroundTruthData:
+        return self._gt_data
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Delegate                                                              #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    @property
+    def name(self):
+        return self._gt_data.name
+
+    @property
+    def factor_names(self) -> Tuple[str, ...]:
+        return self._gt_data.factor_names
+
+    @property
+    def factor_sizes(self) -> Tuple[int, ...]:
+        return self._gt_data.factor_sizes
+
+    @property
+    def img_shape(self) -> Tuple[int, ...]:
+        return self._gt_data.img_shape
+
+    def __len__(self):
+        return len(self._gt_data)
+
+    def _get_observation(self, idx):
+        return self._gt_data._get_observation(idx)
+
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self._gt_data._get_observations(idxs)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Cache                                                                 #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        obs = self._cache.get(idx)
+        if obs is None:
+            obs = self._gt_data[idx]
+            self._cache.put(idx, obs)
+        return obs
+
+    def __getitems__(self, idxs: Sequence[int]) -> List[Any]:
+        idxs = [int(idx) for idx in idxs]
+        obs = [self._cache.get(idx) for idx in idxs]
+        # fetch all the missing observations at once
+        missing = sorted({idx for idx, o in zip(idxs, obs) if o is None})
+        if missing:
+            fetched = dict(zip(missing, self._gt_data.__getitems__(missing)))
+            for idx, o in fetched.items():
+                self._cache.put(idx, o)
+            obs = [fetched[idx] if (o is None) else o for idx, o in zip(idxs, obs)]
+        return obs
+
+    def cache_info(self) -> ObsCacheInfo:
+        return self._cache.info()
+
+    def cache_clear(self):
+        self._cache.clear()
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
+
+
+if __name__ == '__main__':
+
+    def main():
+        import time
+        from disent.dataset.data import XYObjectShadedData
+        from disent.dataset.transform import ToImgTensorF32
+
+        def bench(data, n: int = 10000):
+            idxs = np.random.default_rng(42).integers(0, 256, size=n)  # repeatedly sample a small subset
+            t = time.perf_counter()
+            for i in idxs:
+                data[i]
+            return (time.perf_counter() - t) / n * 1_000_000
+
+        data = XYObjectShadedData(transform=ToImgTensorF32(size=32))
+        print(f'uncached:       {bench(data):.2f}us')
+        print(f'cached (local): {bench(CachedGroundTruthData(data, shared=False)):.2f}us')
+        print(f'cached (shared):{bench(CachedGroundTruthData(data, shared=True)):.2f}us')
+
+    main()
+
+    # RESULTS:
+    # uncached:       155.70us
+    # cached (local): 6.94us
+    # cached (shared):16.68us
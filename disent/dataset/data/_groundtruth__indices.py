@@ -0,0 +1,101 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from disent.dataset.data._groundtruth import GroundTruthData
+
+
+# ========================================================================= #
+# indices ground truth data                                                 #
+# ========================================================================= #
+
+
+class IndicesGroundTruthData(GroundTruthData):
+    """
+    Wraps a synthetic ground truth dataset, replacing each observation with its
+    index. Dataloaders then only need to sample, collate and transfer indices,
+    and observations are rendered in batches on the training device from these
+    indices using `render_batch_torch` of the wrapped dataset.
+
+    - usually the `x_targ` of batches from a `DisentDataset` wrapping this
+      data are rendered with `DisentDatasetTransform(normalize=RenderImgTensorF32(...))`
+    - the factor names, sizes and image shape are the same as the wrapped
+      dataset, so samplers work as usual.
+    """
+
+    def __init__(self, gt_data: GroundTruthData):
+        assert isinstance(gt_data, GroundTruthData), f'gt_data must be an instance of {GroundTruthData.__name__}, got: {repr(gt_data)}'
+        assert callable(getattr(gt_data, 'render_batch_torch', None)), f'gt_data does not support rendering on the device, missing method `render_batch_torch`, got: {repr(gt_data)}'
+        self._gt_data = gt_data
+        # observations are indices, the transform of the wrapped dataset is never applied
+        super().__init__(transform=None)
+
+    @property
+    def gt_data(self) -> GroundTruthData:
+        return self._gt_data
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Delegate                                                              #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    @property
+    def name(self):
+        return self._gt_data.name
+
+    @property
+    def factor_names(self) -> Tuple[str, ...]:
+        return self._gt_data.factor_names
+
+    @property
+    def factor_sizes(self) -> Tuple[int, ...]:
+        return self._gt_data.factor_sizes
+
+    @property
+    def img_shape(self) -> Tuple[int, ...]:
+        return self._gt_data.img_shape
+
+    def __len__(self):
+        return len(self._gt_data)
+
+    def render_batch_torch(self, idxs: torch.Tensor) -> torch.Tensor:
+        return self._gt_data.render_batch_torch(idxs)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Indices                                                               #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    def _get_observation(self, idx):
+        return np.int64(idx)
+
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return np.asarray(idxs, dtype=np.int64)
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
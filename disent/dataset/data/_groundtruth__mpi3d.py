@@ -24,9 +24,10 @@
 
 import logging
 from typing import Optional
+from typing import Union
 
-from disent.dataset.util.datafile import DataFileHashedDl
-from disent.dataset.data._groundtruth import NumpyFileGroundTruthData
+from disent.dataset.util.datafile import DataFileHashedDlNpzH5
+from disent.dataset.data._groundtruth import Hdf5GroundTruthData
 
 
 log = logging.getLogger(__name__)
@@ -36,41 +37,76 @@ log = logging.getLogger(__name__)
 # ========================================================================= #
 
 
-class Mpi3dData(NumpyFileGroundTruthData):
+def _make_mpi3d_datafile(subset: str, uri_hash: dict) -> DataFileHashedDlNpzH5:
+    return DataFileHashedDlNpzH5(
+        # download file/link
+        uri=f'https://storage.googleapis.com/disentanglement_dataset/Final_Dataset/mpi3d_{subset}.npz',
+        uri_hash=uri_hash,
+        # processed dataset file -- derived from the verified download, only its existence is
+        # checked until the hashes printed by running this module are pinned here
+        file_hash=None,
+        file_name=f'mpi3d_{subset}.h5',
+        # h5 re-save settings -- the .npz files are streamed, they are never fully loaded into memory
+        npz_key='images',
+        hdf5_dataset_name='images',
+        hdf5_chunk_size=(1, 64, 64, 3),
+        hdf5_obs_shape=(64, 64, 3),
+    )
+
+
+class Mpi3dData(Hdf5GroundTruthData):
     """
     MPI3D Dataset
     - https://github.com/rr-learning/disentanglement_dataset
 
+    The downloaded `.npz` files are converted to hdf5 files that are chunked per
+    observation, allowing the dataset to be read from disk instead of memory.
+
     reference implementation: https://github.com/google-research/disentanglement_lib/blob/master/disentanglement_lib/data/ground_truth/mpi3d.py
     """
 
     MPI3D_DATASETS = {
-        'toy':        DataFileHashedDl(uri='https://storage.googleapis.com/disentanglement_dataset/Final_Dataset/mpi3d_toy.npz',       uri_hash={'fast': '146138e36ff495e77ceacdc8cf14c37e', 'full': '55889cb7c7dfc655d6e0277beee88868'}),
-        'realistic':  DataFileHashedDl(uri='https://storage.googleapis.com/disentanglement_dataset/Final_Dataset/mpi3d_realistic.npz', uri_hash={'fast': '96c8ff1155dd61f79d3493edef9f19e9', 'full': '59a6225b88b635365f70c91b3e52f70f'}),
-        'real':       DataFileHashedDl(uri='https://storage.googleapis.com/disentanglement_dataset/Final_Dataset/mpi3d_real.npz',      uri_hash={'fast': 'e2941bba6f4a2b130edc5f364637b39e', 'full': '0f33f609918fb5c97996692f91129802'}),
+        'toy':        _make_mpi3d_datafile(subset='toy',       uri_hash={'fast': '146138e36ff495e77ceacdc8cf14c37e', 'full': '55889cb7c7dfc655d6e0277beee88868'}),
+        'realistic':  _make_mpi3d_datafile(subset='realistic', uri_hash={'fast': '96c8ff1155dd61f79d3493edef9f19e9', 'full': '59a6225b88b635365f70c91b3e52f70f'}),
+        'real':       _make_mpi3d_datafile(subset='real',      uri_hash={'fast': 'e2941bba6f4a2b130edc5f364637b39e', 'full': '0f33f609918fb5c97996692f91129802'}),
     }
 
     factor_names = ('object_color', 'object_shape', 'object_size', 'camera_height', 'background_color', 'first_dof', 'second_dof')
     factor_sizes = (4, 4, 2, 3, 3, 40, 40)  # TOTAL: 460800
     img_shape = (64, 64, 3)
 
-    # override
-    data_key = 'images'
-
-    def __init__(self, data_root: Optional[str] = None, prepare: bool = False, subset='realistic', in_memory=False, transform=None):
+    def __init__(
+        self,
+        data_root: Optional[str] = None,
+        prepare: bool = False,
+        subset='realistic',
+        in_memory: Union[bool, str] = False,
+        transform=None,
+        rdcc_nbytes: Optional[int] = None,
+        rdcc_nslots: Optional[int] = None,
+        rdcc_w0: Optional[float] = None,
+        chunk_cache_nbytes: int = 0,
+    ):
         # check subset is correct
         assert subset in self.MPI3D_DATASETS, f'Invalid MPI3D subset: {repr(subset)} must be one of: {set(self.MPI3D_DATASETS.keys())}'
         self._subset = subset
         # handle different cases
         if in_memory:
             log.warning('[WARNING]: mpi3d files are extremely large (over 11GB), you are trying to load these into memory.')
-        else:
-            raise NotImplementedError('TODO: add support for converting to h5py for fast disk access')  # TODO!
         # initialise
-        super().__init__(data_root=data_root, prepare=prepare, transform=transform)
+        super().__init__(
+            data_root=data_root,
+            prepare=prepare,
+            in_memory=in_memory,
+            transform=transform,
+            rdcc_nbytes=rdcc_nbytes,
+            rdcc_nslots=rdcc_nslots,
+            rdcc_w0=rdcc_w0,
+            chunk_cache_nbytes=chunk_cache_nbytes,
+        )
 
     @property
-    def datafile(self) -> DataFileHashedDl:
+    def datafile(self) -> DataFileHashedDlNpzH5:
         return self.MPI3D_DATASETS[self._subset]
 
     @property
@@ -84,5 +120,19 @@ class Mpi3dData(NumpyFileGroundTruthData):
 
 
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    Mpi3dData(prepare=True, in_memory=False)
+
+    def main():
+        import os
+        from disent.dataset.util.hdf5 import hdf5_test_speed
+        from disent.util.inout.hashing import hash_file
+
+        logging.basicConfig(level=logging.DEBUG)
+
+        for subset in ['toy', 'realistic', 'real']:
+            data = Mpi3dData(prepare=True, subset=subset, in_memory=False)
+            h5_path = os.path.join(data.data_dir, data.datafile.out_name)
+            hdf5_test_speed(h5_path, dataset_name=data.datafile.dataset_name, access_method='random')
+            # hashes of the generated file, to be pinned as the `file_hash` above
+            print(f"{subset}: file_hash={{'fast': '{hash_file(h5_path, hash_mode='fast')}', 'full': '{hash_file(h5_path, hash_mode='full')}'}}")
+
+    main()
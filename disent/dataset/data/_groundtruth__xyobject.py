@@ -24,9 +24,12 @@
 
 import warnings
 from typing import Optional
+from typing import Sequence
 from typing import Tuple
+from typing import Union
 
 import numpy as np
+import torch
 
 from disent.dataset.data._groundtruth import GroundTruthData
 
@@ -49,6 +52,115 @@ def _shades(num: int, shades):
     return all_shades
 
 
+def _range_masks(starts: np.ndarray, sizes: np.ndarray, length: int) -> np.ndarray:
+    # (B,) starts and sizes to (B, length) boolean masks, True over [start, start + size)
+    r = np.arange(length)
+    starts = np.asarray(starts).reshape(-1, 1)
+    return (starts <= r) & (r < starts + np.asarray(sizes).reshape(-1, 1))
+
+
+def _get_batch_out(out: Optional[np.ndarray], num: int, img_shape: Tuple[int, ...], dtype) -> np.ndarray:
+    if out is None:
+        return np.empty((num, *img_shape), dtype=dtype)
+    assert out.shape == (num, *img_shape), f'output array has shape: {out.shape}, required: {(num, *img_shape)}'
+    assert out.dtype == dtype, f'output array has dtype: {out.dtype}, required: {np.dtype(dtype)}'
+    assert out.flags.c_contiguous, 'output array must be C-contiguous'
+    return out
+
+
+def _render_boxes(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    ws: Union[np.ndarray, int],
+    hs: Union[np.ndarray, int],
+    colors: np.ndarray,
+    img_shape: Tuple[int, int, int],
+    dtype,
+    channel_masks: Optional[np.ndarray] = None,
+    bg: Union[int, float] = 0,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Render a batch of images (B, H, W, C) each containing N axis-aligned boxes
+    with shapes (B, N), drawn in order with `colors` of shape (B, N, C).
+    - `channel_masks` of shape (N, C) can limit the channels each box is drawn in.
+
+    Each row of an image only depends on which of the N boxes cover that row, so
+    there are at most 2**N unique rows per image. These rows are generated for the
+    whole batch using broadcast masks, then the images are assembled with one gather.
+    """
+    (B, N), (H, W, C) = np.shape(xs), img_shape
+    K = 2 ** N
+    # generate the unique rows, flattened so that the inner dimension is W*C
+    # - avoid broadcasting over the small channel dimension, numpy is slow if the inner loop is short
+    mx = np.repeat(_range_masks(xs, np.broadcast_to(ws, (B, N)), W).reshape(B, N, W), C, axis=-1)
+    if channel_masks is not None:
+        mx &= np.tile(np.asarray(channel_masks, dtype=bool), W)[None, :, :]
+    mx = mx.reshape(B, N, 1, W*C)
+    fills = np.tile(np.asarray(colors, dtype=dtype), (1, 1, W)).reshape(B, N, 1, W*C)
+    rows = np.full((B, K, W*C), bg, dtype=dtype)
+    for i in range(N):
+        # view of the kinds of rows that are covered by box i, ie. where bit i is set
+        covered = rows.reshape(B, K >> (i+1), 2, 1 << i, W*C)[:, :, 1]
+        np.copyto(covered, fills[:, i, None], where=mx[:, i, None])
+    # get the kind of each row in each image, bit i is set if box i covers the row
+    my = _range_masks(ys, np.broadcast_to(hs, (B, N)), H).reshape(B, N, H)
+    row_kinds = np.sum(my.astype(np.intp) << np.arange(N)[None, :, None], axis=1)
+    # assemble the images
+    out = _get_batch_out(out, num=B, img_shape=img_shape, dtype=dtype)
+    np.take(rows.reshape(B*K, W*C), (np.arange(B)[:, None] * K + row_kinds).reshape(-1), axis=0, out=out.reshape(B*H, W*C), mode='clip')
+    return out
+
+
+def _torch_idx_to_pos(idxs: torch.Tensor, factor_sizes: Sequence[int]) -> torch.Tensor:
+    # (B,) indices to (B, F) factors on the same device, C-order like `StateSpace.idx_to_pos`
+    sizes = torch.as_tensor(factor_sizes, dtype=torch.long, device=idxs.device)
+    strides = torch.as_tensor(np.cumprod((*factor_sizes[1:], 1)[::-1])[::-1].copy(), dtype=torch.long, device=idxs.device)
+    return (idxs.reshape(-1, 1).long() // strides) % sizes
+
+
+def _torch_range_masks(starts: torch.Tensor, sizes: torch.Tensor, length: int) -> torch.Tensor:
+    r = torch.arange(length, device=starts.device)
+    starts = starts.reshape(-1, 1)
+    return (starts <= r) & (r < starts + sizes.reshape(-1, 1))
+
+
+def _render_boxes_torch(
+    xs: torch.Tensor,
+    ys: torch.Tensor,
+    ws: Union[torch.Tensor, int],
+    hs: Union[torch.Tensor, int],
+    colors: torch.Tensor,
+    img_shape: Tuple[int, int, int],
+    channel_masks: Optional[np.ndarray] = None,
+    bg: Union[int, float] = 0,
+) -> torch.Tensor:
+    """
+    Torch version of `_render_boxes`, the images are rendered on the
+    same device as the inputs with the same dtype as the `colors`.
+    """
+    (B, N), (H, W, C) = xs.shape, img_shape
+    K, device = 2 ** N, xs.device
+    ws = torch.broadcast_to(torch.as_tensor(ws, device=device), (B, N))
+    hs = torch.broadcast_to(torch.as_tensor(hs, device=device), (B, N))
+    # generate the unique rows, flattened so that the inner dimension is W*C
+    mx = _torch_range_masks(xs, ws, W).reshape(B, N, W).repeat_interleave(C, dim=-1)
+    if channel_masks is not None:
+        mx &= torch.as_tensor(np.tile(np.asarray(channel_masks, dtype=bool), W), device=device)[None, :, :]
+    fills = colors.repeat(1, 1, W)
+    rows = torch.full((B, K, W*C), bg, dtype=colors.dtype, device=device)
+    for i in range(N):
+        # view of the kinds of rows that are covered by box i, ie. where bit i is set
+        covered = rows.view(B, K >> (i+1), 2, 1 << i, W*C)[:, :, 1]
+        covered.copy_(torch.where(mx[:, i, None, None], fills[:, i, None, None], covered))
+    # get the kind of each row in each image, bit i is set if box i covers the row
+    my = _torch_range_masks(ys, hs, H).reshape(B, N, H)
+    row_kinds = torch.sum(my.long() << torch.arange(N, device=device)[None, :, None], dim=1)
+    # assemble the images
+    idxs = (torch.arange(B, device=device)[:, None] * K + row_kinds).reshape(-1)
+    return rows.reshape(B*K, W*C).index_select(0, idxs).reshape(B, H, W, C)
+
+
 # ========================================================================= #
 # xy object data                                                            #
 # ========================================================================= #
@@ -149,6 +261,44 @@ class XYObjectData(GroundTruthData):
         obs[y:y+s, x:x+s] = self._colors[c]
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self.render_batch(idxs)
+
+    def render_batch(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Render a batch of observations with shape (B, H, W, C). The factors of
+        all the observations are computed at once, and squares are painted using
+        broadcast masks instead of generating each observation individually.
+        - the output can be written into a preallocated array by specifying `out`
+        """
+        x, y, s, c = self.idx_to_pos(np.asarray(idxs).reshape(-1)).T
+        return self._render_squares(x, y, s, colors=self._colors[c], out=out)
+
+    def _render_squares(self, x: np.ndarray, y: np.ndarray, s: np.ndarray, colors: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        s = self._square_scales[s]
+        r = (self._max_square_size - s) // 2
+        x, y = self._spacing*x + r, self._spacing*y + r
+        # GENERATE
+        return _render_boxes(x[:, None], y[:, None], s[:, None], s[:, None], colors=colors[:, None, :], img_shape=self.img_shape, dtype=np.uint8, out=out)
+
+    def render_batch_torch(self, idxs: torch.Tensor) -> torch.Tensor:
+        """
+        Render a batch of uint8 observations with shape (B, H, W, C) on the same
+        device as the indices. Because observations are a pure function of their
+        factors, dataloaders only need to yield indices for the training device
+        to render, see: `disent.dataset.data.IndicesGroundTruthData`
+        """
+        x, y, s, c = _torch_idx_to_pos(idxs, self.factor_sizes).T
+        colors = torch.as_tensor(self._colors, device=idxs.device)[c]
+        return self._render_squares_torch(x, y, s, colors=colors)
+
+    def _render_squares_torch(self, x: torch.Tensor, y: torch.Tensor, s: torch.Tensor, colors: torch.Tensor) -> torch.Tensor:
+        s = torch.as_tensor(self._square_scales, device=s.device)[s]
+        r = (self._max_square_size - s) // 2
+        x, y = self._spacing*x + r, self._spacing*y + r
+        # GENERATE
+        return _render_boxes_torch(x[:, None], y[:, None], s[:, None], s[:, None], colors=colors[:, None, :].to(torch.uint8), img_shape=self.img_shape)
+
 
 class XYOldObjectData(XYObjectData):
 
@@ -238,6 +388,15 @@ class XYObjectShadedData(XYObjectData):
         obs[y:y+s, x:x+s] = self._colors[c] * (b + 1) // self._brightness_levels
         return obs
 
+    def render_batch(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        x, y, s, b, c = self.idx_to_pos(np.asarray(idxs).reshape(-1)).T
+        return self._render_squares(x, y, s, colors=self._colors[c] * (b + 1)[:, None] // self._brightness_levels, out=out)
+
+    def render_batch_torch(self, idxs: torch.Tensor) -> torch.Tensor:
+        x, y, s, b, c = _torch_idx_to_pos(idxs, self.factor_sizes).T
+        colors = torch.as_tensor(self._colors, device=idxs.device)[c]
+        return self._render_squares_torch(x, y, s, colors=colors * (b + 1)[:, None] // self._brightness_levels)
+
 
 # ========================================================================= #
 # END                                                                       #
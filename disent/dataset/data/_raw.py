@@ -23,7 +23,16 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 
+import os
+import weakref
+from collections import OrderedDict
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
 import h5py
+import numpy as np
 from torch.utils.data import Dataset
 from disent.util.iters import LengthIter
 
@@ -59,39 +68,151 @@ class ArrayDataset(Dataset, LengthIter):
 # ========================================================================= #
 
 
+class Hdf5CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    num_chunks: int
+    nbytes: int
+    max_nbytes: int
+
+
 class Hdf5Dataset(Dataset, LengthIter):
     """
     This class supports pickling and unpickling of a read-only
     SWMR h5py file and corresponding dataset.
 
+    Caching:
+    - `rdcc_nbytes`, `rdcc_nslots` & `rdcc_w0` configure the raw data chunk
+      cache of hdf5 itself, by default this is only 1MB per dataset.
+    - `chunk_cache_nbytes` enables an additional LRU cache of decompressed
+      blocks of observations, keyed by the index of the chunk along the first
+      dimension. Nearby observations (eg. sampled by pair or triplet samplers)
+      are then read from memory instead of being re-decompressed.
+      The cache is local to each process and is not pickled.
+
     WARNING: this should probably not be used across multiple hosts...
     """
 
-    def __init__(self, h5_path: str, h5_dataset_name: str = 'data', transform=None):
+    def __init__(
+        self,
+        h5_path: str,
+        h5_dataset_name: str = 'data',
+        transform=None,
+        rdcc_nbytes: Optional[int] = None,
+        rdcc_nslots: Optional[int] = None,
+        rdcc_w0: Optional[float] = None,
+        chunk_cache_nbytes: int = 0,
+    ):
+        assert chunk_cache_nbytes >= 0, f'chunk_cache_nbytes must be >= 0, got: {repr(chunk_cache_nbytes)}'
         self._h5_path = h5_path
         self._h5_dataset_name = h5_dataset_name
+        self._rdcc_kwargs = {k: v for k, v in dict(rdcc_nbytes=rdcc_nbytes, rdcc_nslots=rdcc_nslots, rdcc_w0=rdcc_w0).items() if (v is not None)}
+        self._chunk_cache_nbytes = chunk_cache_nbytes
         self._hdf5_file, self._hdf5_data = self._make_hdf5()
         self._transform = transform
+        self._init_chunk_cache()
 
     def _make_hdf5(self):
         # TODO: can this cause a memory leak if it is never closed?
-        hdf5_file = h5py.File(self._h5_path, 'r', swmr=True)
+        hdf5_file = h5py.File(self._h5_path, 'r', swmr=True, **self._rdcc_kwargs)
         hdf5_data = hdf5_file[self._h5_dataset_name]
         return hdf5_file, hdf5_data
 
+    def _init_chunk_cache(self):
+        chunks = self._hdf5_data.chunks
+        self._chunk_len = 1 if (chunks is None) else chunks[0]
+        self._chunk_cache: 'OrderedDict[int, np.ndarray]' = OrderedDict()
+        self._chunk_cache_cur_nbytes = 0
+        self._chunk_cache_hits = 0
+        self._chunk_cache_misses = 0
+
     def __len__(self):
         return self._hdf5_data.shape[0]
 
     def __getitem__(self, item):
-        elem = self._hdf5_data[item]
+        if self._chunk_cache_nbytes <= 0:
+            elem = self._hdf5_data[item]
+        elif isinstance(item, (int, np.integer)):
+            elem = self._get_cached(int(item))
+        elif isinstance(item, (np.ndarray, list)) and (np.ndim(item) == 1):
+            elem = self._get_cached_batch(np.asarray(item))
+        else:
+            elem = self._hdf5_data[item]
         if self._transform is not None:
             elem = self._transform(elem)
         return elem
 
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # chunk cache                                                           #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    def _get_chunk(self, chunk_idx: int) -> np.ndarray:
+        chunk = self._chunk_cache.get(chunk_idx, None)
+        # cache hit, mark as most recently used
+        if chunk is not None:
+            self._chunk_cache_hits += 1
+            self._chunk_cache.move_to_end(chunk_idx)
+            return chunk
+        # cache miss, read all the observations in the chunk
+        self._chunk_cache_misses += 1
+        chunk = self._hdf5_data[chunk_idx * self._chunk_len:(chunk_idx + 1) * self._chunk_len]
+        # evict the least recently used chunks
+        if chunk.nbytes <= self._chunk_cache_nbytes:
+            while self._chunk_cache and (self._chunk_cache_cur_nbytes + chunk.nbytes > self._chunk_cache_nbytes):
+                _, evicted = self._chunk_cache.popitem(last=False)
+                self._chunk_cache_cur_nbytes -= evicted.nbytes
+            self._chunk_cache[chunk_idx] = chunk
+            self._chunk_cache_cur_nbytes += chunk.nbytes
+        return chunk
+
+    def _get_cached(self, idx: int) -> np.ndarray:
+        if idx < 0:
+            idx += len(self)
+        if not (0 <= idx < len(self)):
+            raise IndexError(f'index {idx} is out of bounds for dataset of length {len(self)}')
+        chunk_idx, offset = divmod(idx, self._chunk_len)
+        return self._get_chunk(chunk_idx)[offset].copy()
+
+    def _get_cached_batch(self, idxs: np.ndarray) -> np.ndarray:
+        idxs = np.where(idxs < 0, idxs + len(self), idxs)
+        if np.any(idxs < 0) or np.any(idxs >= len(self)):
+            raise IndexError(f'indices are out of bounds for dataset of length {len(self)}')
+        chunk_idxs, offsets = np.divmod(idxs, self._chunk_len)
+        uniq_chunk_idxs, inverse = np.unique(chunk_idxs, return_inverse=True)
+        # concatenate the chunks & gather the observations
+        chunks = [self._get_chunk(int(c)) for c in uniq_chunk_idxs]
+        starts = np.cumsum([0] + [len(c) for c in chunks[:-1]])
+        return np.concatenate(chunks, axis=0)[starts[inverse] + offsets]
+
+    def cache_info(self) -> Hdf5CacheInfo:
+        return Hdf5CacheInfo(
+            hits=self._chunk_cache_hits,
+            misses=self._chunk_cache_misses,
+            num_chunks=len(self._chunk_cache),
+            nbytes=self._chunk_cache_cur_nbytes,
+            max_nbytes=self._chunk_cache_nbytes,
+        )
+
+    def cache_clear(self):
+        self._chunk_cache.clear()
+        self._chunk_cache_cur_nbytes = 0
+        self._chunk_cache_hits = 0
+        self._chunk_cache_misses = 0
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
     @property
     def shape(self):
         return self._hdf5_data.shape
 
+    @property
+    def dtype(self):
+        return self._hdf5_data.dtype
+
+    @property
+    def chunks(self):
+        return self._hdf5_data.chunks
+
     def numpy_dataset(self) -> ArrayDataset:
         # TODO: make this function global
         return ArrayDataset(array=self._hdf5_data[:], transform=self._transform)
@@ -112,21 +233,150 @@ class Hdf5Dataset(Dataset, LengthIter):
         state = self.__dict__.copy()
         state.pop('_hdf5_file', None)
         state.pop('_hdf5_data', None)
+        state.pop('_chunk_cache', None)
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self._hdf5_file, self._hdf5_data = self._make_hdf5()
+        self._init_chunk_cache()
 
     def close(self):
         self._hdf5_file.close()
         del self._hdf5_file
         del self._hdf5_data
+        self._chunk_cache.clear()
 
     def get_attrs(self) -> dict:
         return dict(self._hdf5_data.attrs)
 
 
+# ========================================================================= #
+# shared memory array                                                       #
+# ========================================================================= #
+
+
+def _shm_attach(name: str) -> SharedMemory:
+    # python >= 3.13 supports disabling tracking of attached blocks directly
+    try:
+        return SharedMemory(name=name, create=False, track=False)
+    except TypeError:
+        pass
+    # older versions register attached blocks with the resource tracker, this
+    # is safe for child processes (eg. DataLoader workers) because they share
+    # the resource tracker of the parent, which de-duplicates names. We must
+    # not unregister the block here, otherwise the owner's entry is removed!
+    return SharedMemory(name=name, create=False)
+
+
+def _shm_release(shm: SharedMemory, owner_pid: Optional[int]):
+    # numpy views of the buffer may still exist, in which case the
+    # mapping is only freed once they are garbage collected.
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    # only the process that created the block may unlink it, forked
+    # children (eg. DataLoader workers) inherit the object but not ownership.
+    if owner_pid == os.getpid():
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedArray(object):
+    """
+    Numpy array backed by a `multiprocessing.shared_memory` block.
+    - By default the array is read-only in all processes other than the process
+      that created it. If `readonly=False` then all processes can write to it,
+      in which case it is up to the user to synchronise access.
+
+    Pickling only stores the name of the block along with the shape and dtype,
+    unpickling then attaches to the existing block instead of copying the data.
+    This means that DataLoader workers (using either the `fork` or `spawn`
+    start methods) all share the same copy of a dataset in memory.
+
+    The block is unlinked when the instance in the process that created it is
+    closed or garbage collected, after which no new processes can attach to it.
+
+    WARNING: this cannot be used across multiple hosts...
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype: np.dtype, name: Optional[str] = None, readonly: bool = True):
+        self._shape = tuple(int(s) for s in shape)
+        self._dtype = np.dtype(dtype)
+        self._readonly = readonly
+        self._attach(name=name)
+
+    def _attach(self, name: Optional[str]):
+        nbytes = int(np.prod(self._shape, dtype='int64')) * self._dtype.itemsize
+        if name is None:
+            self._shm = SharedMemory(create=True, size=max(nbytes, 1))
+            owner_pid = os.getpid()
+        else:
+            self._shm = _shm_attach(name)
+            owner_pid = None
+        # make the view over the block, only the owner can write to it if readonly
+        self._array = np.ndarray(self._shape, dtype=self._dtype, buffer=self._shm.buf)
+        self._array.flags.writeable = (owner_pid is not None) or (not self._readonly)
+        self._finalizer = weakref.finalize(self, _shm_release, self._shm, owner_pid)
+
+    @classmethod
+    def from_array(cls, array, batch_size: int = 1024) -> 'SharedArray':
+        """
+        Copy an array-like object (eg. a numpy array or h5py dataset) into shared memory
+        - the data is copied in batches so that array-likes that are stored on disk
+          never need to be loaded into memory twice.
+        """
+        assert batch_size > 0, f'batch_size must be > 0, got: {repr(batch_size)}'
+        shared = cls(shape=array.shape, dtype=array.dtype)
+        for i in range(0, len(shared), batch_size):
+            shared._array[i:i+batch_size] = array[i:i+batch_size]
+        shared._array.flags.writeable = False
+        return shared
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def array(self) -> np.ndarray:
+        return self._array
+
+    def __len__(self):
+        return self._shape[0]
+
+    def __getitem__(self, item):
+        return self._array[item]
+
+    def __array__(self, dtype=None, copy=None):
+        return self._array if (dtype is None) else self._array.astype(dtype)
+
+    # CUSTOM PICKLE HANDLING -- only the name of the block is pickled!
+
+    def __getstate__(self):
+        return dict(name=self.name, shape=self._shape, dtype=self._dtype.str, readonly=self._readonly)
+
+    def __setstate__(self, state):
+        self._shape = tuple(state['shape'])
+        self._dtype = np.dtype(state['dtype'])
+        self._readonly = state['readonly']
+        self._attach(name=state['name'])
+
+    def close(self):
+        self._array = None
+        self._finalizer()
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
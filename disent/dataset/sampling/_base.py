@@ -25,6 +25,11 @@
 from typing import final
 from typing import Tuple
 
+import numpy as np
+
+from disent.util.seeds import as_rng
+from disent.util.seeds import RngLike
+
 
 # ========================================================================= #
 # Base Sampler                                                              #
@@ -64,6 +69,29 @@ class BaseDisentSampler(object):
     def is_init(self) -> bool:
         return self.__initialized
 
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Random Number Generator                                               #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    __rng = None
+
+    @property
+    def rng(self) -> np.random.Generator:
+        """
+        The generator that should be used for all sampling, if no generator was
+        set then this is the generator that shares the global `np.random` state.
+        """
+        return as_rng(self.__rng)
+
+    def set_rng(self, rng: RngLike) -> 'BaseDisentSampler':
+        """
+        Set the generator used for sampling, usually called for each
+        `DataLoader` worker by `disent.util.seeds.worker_init_fn`
+        - rng can be a seed, a `np.random.Generator` or None to use the global `np.random` state
+        """
+        self.__rng = None if (rng is None) else as_rng(rng)
+        return self
+
     def _sample_idx(self, idx: int) -> Tuple[int, ...]:
         raise NotImplementedError
 
@@ -82,6 +110,38 @@ class BaseDisentSampler(object):
     def __call__(self, idx: int) -> Tuple[int, ...]:
         return self.sample(idx)
 
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    # Batches                                                               #
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+    def _sample_batch(self, idxs: np.ndarray) -> np.ndarray:
+        """
+        you can override this method to provide a vectorized version of `_sample_idx`
+        - the default implementation simply loops over all the indices
+        """
+        return np.array([self._sample_idx(idx) for idx in idxs], dtype='int64').reshape(len(idxs), self.num_samples)
+
+    def sample_batch(self, idxs: np.ndarray) -> np.ndarray:
+        """
+        Sample the indices for an entire batch at once.
+        :param idxs: integer array of shape (B,) where each value is an anchor index
+        :return: integer array of shape (B, num_samples)
+        """
+        # check that we have been initialized!
+        if not self.is_init:
+            raise RuntimeError(f'{self.__class__.__name__} has not been initialized! call `sampler.init(gt_data)`')
+        # normalise the indices
+        idxs = np.asarray(idxs, dtype='int64')
+        if idxs.ndim != 1:
+            raise ValueError(f'{self.__class__.__name__} can only sample batches from a 1D array of indices, got shape: {idxs.shape}')
+        # sample values
+        batch = self._sample_batch(idxs)
+        # check values
+        if batch.shape != (len(idxs), self.num_samples):
+            raise RuntimeError(f'{self.__class__.__name__} returned incorrect batch shape, required: {(len(idxs), self.num_samples)}, got: {batch.shape}')
+        # return values
+        return batch
+
 
 # ========================================================================= #
 # END                                                                       #
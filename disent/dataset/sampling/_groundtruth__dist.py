@@ -22,7 +22,9 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import math
 from fractions import Fraction
+from functools import reduce
 from typing import List
 from typing import Optional
 from typing import Union
@@ -86,18 +88,55 @@ class GroundTruthDistSampler(BaseDisentSampler):
 
     def _sample_idx(self, idx):
         # sample indices
-        indices = (idx, *np.random.randint(0, len(self._state_space), size=self._num_samples-1))
+        indices = (idx, *self.rng.integers(0, len(self._state_space), size=self._num_samples-1))
         # sort based on mode
         if self._num_samples == 3:
             a_i, p_i, n_i = self._swap_triple(indices)
             # randomly swap positive and negative
-            if np.random.random() < self._swap_chance:
+            if self.rng.random() < self._swap_chance:
                 indices = (a_i, n_i, p_i)
             else:
                 indices = (a_i, p_i, n_i)
         # get data
         return indices
 
+    def _sample_batch(self, idxs: np.ndarray) -> np.ndarray:
+        # sample indices
+        indices = np.concatenate([idxs[:, None], self.rng.integers(0, len(self._state_space), size=(len(idxs), self._num_samples-1))], axis=1)
+        # sort based on mode
+        if self._num_samples == 3:
+            swap_mask = self._swap_triple_mask(indices)
+            # randomly swap positive and negative
+            swap_mask ^= (self.rng.random(len(idxs)) < self._swap_chance)
+            indices[swap_mask, 1:] = indices[swap_mask, :0:-1]
+        # get data
+        return indices
+
+    def _swap_triple_mask(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of `_swap_triple`, returns a boolean mask
+        over the batch, indicating if the positive and negative need to be swapped.
+        """
+        a_f, p_f, n_f = np.moveaxis(self._state_space.idx_to_pos(indices), 1, 0)
+        # exact integer weights for the scaled distances, see `factor_dist_batch`
+        weights = _scale_to_integer_weights(np.maximum(1, self._state_space.factor_sizes - 1)) if (self._scaled) else None
+        # SWAP: manhattan
+        if self._sample_mode == 'manhattan':
+            return factor_dist_batch(a_f, p_f, weights=weights) > factor_dist_batch(a_f, n_f, weights=weights)
+        # SWAP: factors
+        elif self._sample_mode == 'factors':
+            return factor_diff_batch(a_f, p_f) > factor_diff_batch(a_f, n_f)
+        # SWAP: combined
+        elif self._sample_mode == 'combined':
+            p_diff, n_diff = factor_diff_batch(a_f, p_f), factor_diff_batch(a_f, n_f)
+            p_dist, n_dist = factor_dist_batch(a_f, p_f, weights=weights), factor_dist_batch(a_f, n_f, weights=weights)
+            return (p_diff > n_diff) | ((p_diff == n_diff) & (p_dist > n_dist))
+        # SWAP: random
+        elif self._sample_mode != 'random':
+            raise KeyError('invalid mode')
+        # done!
+        return np.zeros(len(indices), dtype='bool')
+
     def _swap_triple(self, indices):
         a_i, p_i, n_i = indices
         a_f, p_f, n_f = self._state_space.idx_to_pos(indices)
@@ -162,6 +201,34 @@ def factor_dist(f0: np.ndarray, f1: np.ndarray, scale: np.ndarray = None) -> Uni
         return total
 
 
+def factor_diff_batch(f0: np.ndarray, f1: np.ndarray) -> np.ndarray:
+    # compute distances over the last axis!
+    return np.sum(f0 != f1, axis=-1)
+
+
+def factor_dist_batch(f0: np.ndarray, f1: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    # compute distances over the last axis!
+    if weights is None:
+        return np.sum(np.abs(f0 - f1), axis=-1)
+    # weights are integers, so the result is exact and the same ordering as `factor_dist` with fractions
+    return np.sum(np.abs(f0 - f1).astype(weights.dtype) * weights, axis=-1)
+
+
+def _scale_to_integer_weights(scale: np.ndarray) -> np.ndarray:
+    """
+    Multiplying each term of the sum in `factor_dist` by the lowest common multiple of the
+    scale gives the same ordering, but only needs integer arithmetic. This is the vectorized
+    alternative to summing arbitrary precision fractions.
+    - falls back to python integers if the values could overflow
+    """
+    lcm = reduce(lambda a, b: a * b // math.gcd(a, b), scale.tolist(), 1)
+    weights = [lcm // s for s in scale.tolist()]
+    # check that the maximum possible sum fits into an int64
+    if lcm * len(weights) < np.iinfo('int64').max:
+        return np.array(weights, dtype='int64')
+    return np.array(weights, dtype='object')
+
+
 # ========================================================================= #
 # Investigation:                                                            #
 # ========================================================================= #
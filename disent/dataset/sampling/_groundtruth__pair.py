@@ -29,6 +29,7 @@ from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling._base import BaseDisentSampler
 from disent.dataset.sampling._groundtruth__triplet import normalise_range_pair, FactorSizeError
 from disent.dataset.util.state_space import StateSpace
+from disent.util.math.random import random_permutations
 from disent.util.math.random import sample_radius
 
 
@@ -84,6 +85,13 @@ class GroundTruthPairSampler(BaseDisentSampler):
             self._state_space.pos_to_idx(f1),
         )
 
+    def _sample_batch(self, idxs: np.ndarray) -> np.ndarray:
+        f0, f1 = self.batch_sample_factors_pair(idxs)
+        return np.stack([
+            self._state_space.pos_to_idx(f0),
+            self._state_space.pos_to_idx(f1),
+        ], axis=1)
+
     def datapoint_sample_factors_pair(self, idx):
         """
         Excerpt from Weakly-Supervised Disentanglement Without Compromises:
@@ -110,6 +118,20 @@ class GroundTruthPairSampler(BaseDisentSampler):
         positive_factors[p_shared_indices] = anchor_factors[p_shared_indices]
         return anchor_factors, positive_factors
 
+    def batch_sample_factors_pair(self, idxs: np.ndarray):
+        """
+        Vectorized version of `datapoint_sample_factors_pair`, sampling
+        the factors for an entire batch of anchor indices at once.
+        """
+        # SAMPLE FACTOR INDICES
+        p_k = self.rng.integers(self.p_k_min, self.p_k_max + 1, size=len(idxs))
+        p_shared_mask = random_permutations(len(idxs), self._state_space.num_factors, rng=self.rng) < (self._state_space.num_factors - p_k)[:, None]
+        # SAMPLE FACTORS - sample, resample and replace shared factors with originals
+        anchor_factors = self._state_space.idx_to_pos(idxs)
+        positive_factors = self._resample_factors(anchor_factors)
+        positive_factors[p_shared_mask] = anchor_factors[p_shared_mask]
+        return anchor_factors, positive_factors
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # HELPER                                                                #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -124,15 +146,15 @@ class GroundTruthPairSampler(BaseDisentSampler):
         return p_min, p_max
 
     def _sample_num_factors(self):
-        p_k = np.random.randint(self.p_k_min, self.p_k_max + 1)
+        p_k = self.rng.integers(self.p_k_min, self.p_k_max + 1)
         return p_k
 
     def _sample_shared_indices(self, p_k):
-        p_shared_indices = np.random.choice(self._state_space.num_factors, size=self._state_space.num_factors-p_k, replace=False)
+        p_shared_indices = self.rng.choice(self._state_space.num_factors, size=self._state_space.num_factors-p_k, replace=False)
         return p_shared_indices
 
     def _resample_factors(self, anchor_factors):
-        positive_factors = sample_radius(anchor_factors, low=0, high=self._state_space.factor_sizes, r_low=self.p_radius_min, r_high=self.p_radius_max + 1)
+        positive_factors = sample_radius(anchor_factors, low=0, high=self._state_space.factor_sizes, r_low=self.p_radius_min, r_high=self.p_radius_max + 1, rng=self.rng)
         return positive_factors
 
 
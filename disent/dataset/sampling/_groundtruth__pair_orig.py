@@ -28,6 +28,8 @@ import numpy as np
 from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling._base import BaseDisentSampler
 from disent.dataset.util.state_space import StateSpace
+from disent.util.seeds import as_rng
+from disent.util.seeds import RngLike
 
 
 class GroundTruthPairOrigSampler(BaseDisentSampler):
@@ -75,46 +77,47 @@ class GroundTruthPairOrigSampler(BaseDisentSampler):
         # randomly sample the first observation -- In our case we just use the idx
         sampled_factors = self._state_space.idx_to_pos(idx)
         # sample the next observation with k differing factors
-        next_factors, k = _sample_k_differing(sampled_factors, self._state_space, k=self.p_k)
+        next_factors, k = _sample_k_differing(sampled_factors, self._state_space, k=self.p_k, rng=self.rng)
         # return the samples
         return sampled_factors, next_factors
 
 
-def _sample_k_differing(factors, state_space: StateSpace, k=1):
+def _sample_k_differing(factors, state_space: StateSpace, k=1, rng: RngLike = None):
     """
     Resample the factors used for the corresponding item in a pair.
       - Based on simple_dynamics() from:
         https://github.com/google-research/disentanglement_lib/blob/master/disentanglement_lib/methods/weak/train_weak_lib.py
     """
+    rng = as_rng(rng)
     # checks for factors
     factors = np.array(factors)
     assert factors.ndim == 1
     # sample k
     if k <= 0:
-        k = np.random.randint(1, state_space.num_factors)
+        k = rng.integers(1, state_space.num_factors)
     # randomly choose 1 or k
     # TODO: This is in disentanglement lib, HOWEVER is this not a mistake?
     #       A bug report has been submitted to disentanglement_lib for clarity:
     #       https://github.com/google-research/disentanglement_lib/issues/31
-    k = np.random.choice([1, k])
+    k = rng.choice([1, k])
     # generate list of differing indices
-    index_list = np.random.choice(len(factors), k, replace=False)
+    index_list = rng.choice(len(factors), k, replace=False)
     # randomly update factors
     for index in index_list:
-        factors[index] = np.random.choice(state_space.factor_sizes[index])
+        factors[index] = rng.choice(state_space.factor_sizes[index])
     # return!
     return factors, k
 
 
-def _sample_weak_pair_factors(state_space: StateSpace):  # pragma: no cover
+def _sample_weak_pair_factors(state_space: StateSpace, rng: RngLike = None):  # pragma: no cover
     """
     Sample a weakly supervised pair from the given GroundTruthData.
       - Based on weak_dataset_generator() from:
         https://github.com/google-research/disentanglement_lib/blob/master/disentanglement_lib/methods/weak/train_weak_lib.py
     """
     # randomly sample the first observation
-    sampled_factors = state_space.sample_factors(1)
+    sampled_factors = state_space.sample_factors(1, rng=rng)
     # sample the next observation with k differing factors
-    next_factors, k = _sample_k_differing(sampled_factors, state_space, k=1)
+    next_factors, k = _sample_k_differing(sampled_factors, state_space, k=1, rng=rng)
     # return the samples
     return sampled_factors, next_factors
@@ -31,6 +31,7 @@ import numpy as np
 from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling._base import BaseDisentSampler
 from disent.dataset.util.state_space import StateSpace
+from disent.util.math.random import random_permutations
 from disent.util.math.random import sample_radius
 
 
@@ -126,6 +127,14 @@ class GroundTruthTripleSampler(BaseDisentSampler):
             self._state_space.pos_to_idx(f2),
         )
 
+    def _sample_batch(self, idxs: np.ndarray) -> np.ndarray:
+        f0, f1, f2 = self.batch_sample_factors_triplet(idxs)
+        return np.stack([
+            self._state_space.pos_to_idx(f0),
+            self._state_space.pos_to_idx(f1),
+            self._state_space.pos_to_idx(f2),
+        ], axis=1)
+
     def datapoint_sample_factors_triplet(self, idx):
         # SAMPLE FACTOR INDICES
         p_k, n_k = self._sample_num_factors()
@@ -140,11 +149,34 @@ class GroundTruthTripleSampler(BaseDisentSampler):
             positive_factors, negative_factors = self._swap_factors(anchor_factors, positive_factors, negative_factors)
         # RANDOMLY SWAP +ve AND -ve IF CHANCE:
         if self._swap_chance is not None:
-            if np.random.random() < self._swap_chance:
+            if self.rng.random() < self._swap_chance:
                 positive_factors, negative_factors = negative_factors, positive_factors
         # return factors!
         return anchor_factors, positive_factors, negative_factors
 
+    def batch_sample_factors_triplet(self, idxs: np.ndarray):
+        """
+        Vectorized version of `datapoint_sample_factors_triplet`, sampling
+        the factors for an entire batch of anchor indices at once.
+        """
+        # SAMPLE FACTOR INDICES
+        p_k, n_k = self._sample_num_factors(size=len(idxs))
+        p_shared_mask, n_shared_mask = self._sample_shared_masks(p_k, n_k)
+        # SAMPLE FACTORS - sample, resample and replace shared factors with originals
+        anchor_factors = self._state_space.idx_to_pos(idxs)
+        positive_factors, negative_factors = self._resample_factors(anchor_factors)
+        positive_factors[p_shared_mask] = anchor_factors[p_shared_mask]
+        negative_factors[n_shared_mask] = anchor_factors[n_shared_mask]
+        # SWAP IF +VE FURTHER THAN -VE
+        if self._swap_metric is not None:
+            positive_factors, negative_factors = self._swap_factors(anchor_factors, positive_factors, negative_factors)
+        # RANDOMLY SWAP +ve AND -ve IF CHANCE:
+        if self._swap_chance is not None:
+            swap_mask = self.rng.random(len(idxs)) < self._swap_chance
+            positive_factors, negative_factors = _swap_rows(positive_factors, negative_factors, swap_mask)
+        # return factors!
+        return anchor_factors, positive_factors, negative_factors
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # HELPER                                                                #
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -187,33 +219,46 @@ class GroundTruthTripleSampler(BaseDisentSampler):
         # we're done!
         return p_min, p_max, n_min, n_max
 
-    def _sample_num_factors(self):
-        p_k = np.random.randint(self.p_k_min, self.p_k_max + 1)
+    def _sample_num_factors(self, size=None):
+        p_k = self.rng.integers(self.p_k_min, self.p_k_max + 1, size=size)
         # sample for negative
         if self.n_k_sample_mode == 'offset':
-            n_k = np.random.randint(p_k + self.n_k_min, min(p_k + self.n_k_max, self._state_space.num_factors) + 1)
+            n_k = self.rng.integers(p_k + self.n_k_min, np.minimum(p_k + self.n_k_max, self._state_space.num_factors) + 1, size=size)
         elif self.n_k_sample_mode == 'bounded_below':
-            n_k = np.random.randint(max(p_k, self.n_k_min), self.n_k_max + 1)
+            n_k = self.rng.integers(np.maximum(p_k, self.n_k_min), self.n_k_max + 1, size=size)
         elif self.n_k_sample_mode == 'random':
-            n_k = np.random.randint(self.n_k_min, self.n_k_max + 1)
+            n_k = self.rng.integers(self.n_k_min, self.n_k_max + 1, size=size)
         else:
             raise KeyError(f'Unknown mode: {self.n_k_sample_mode=}')
         # we're done!
         return p_k, n_k
 
     def _sample_shared_indices(self, p_k, n_k):
-        p_shared_indices = np.random.choice(self._state_space.num_factors, size=self._state_space.num_factors-p_k, replace=False)
+        p_shared_indices = self.rng.choice(self._state_space.num_factors, size=self._state_space.num_factors-p_k, replace=False)
         # sample for negative
         if self.n_k_is_shared:
             n_shared_indices = p_shared_indices[:self._state_space.num_factors-n_k]
         else:
-            n_shared_indices = np.random.choice(self._state_space.num_factors, size=self._state_space.num_factors-n_k, replace=False)
+            n_shared_indices = self.rng.choice(self._state_space.num_factors, size=self._state_space.num_factors-n_k, replace=False)
         # we're done!
         return p_shared_indices, n_shared_indices
 
+    def _sample_shared_masks(self, p_k: np.ndarray, n_k: np.ndarray):
+        num_factors = self._state_space.num_factors
+        p_ranks = random_permutations(len(p_k), num_factors, rng=self.rng)
+        p_shared_mask = p_ranks < (num_factors - p_k)[:, None]
+        # sample for negative
+        if self.n_k_is_shared:
+            # equivalent to slicing the first `num_factors - n_k` shared positive indices
+            n_shared_mask = p_ranks < np.minimum(num_factors - n_k, num_factors - p_k)[:, None]
+        else:
+            n_shared_mask = random_permutations(len(n_k), num_factors, rng=self.rng) < (num_factors - n_k)[:, None]
+        # we're done!
+        return p_shared_mask, n_shared_mask
+
     def _resample_factors(self, anchor_factors):
         # sample positive
-        positive_factors = sample_radius(anchor_factors, low=0, high=self._state_space.factor_sizes, r_low=self.p_radius_min, r_high=self.p_radius_max + 1)
+        positive_factors = sample_radius(anchor_factors, low=0, high=self._state_space.factor_sizes, r_low=self.p_radius_min, r_high=self.p_radius_max + 1, rng=self.rng)
         # negative arguments
         if self.n_radius_sample_mode == 'offset':
             sampled_radius = np.abs(anchor_factors - positive_factors)
@@ -229,34 +274,31 @@ class GroundTruthTripleSampler(BaseDisentSampler):
         else:
             raise KeyError(f'Unknown mode: {self.n_radius_sample_mode=}')
         # sample negative
-        negative_factors = sample_radius(anchor_factors, low=0, high=self._state_space.factor_sizes, r_low=n_r_low, r_high=n_r_high)
+        negative_factors = sample_radius(anchor_factors, low=0, high=self._state_space.factor_sizes, r_low=n_r_low, r_high=n_r_high, rng=self.rng)
         # we're done!
         return positive_factors, negative_factors
 
     def _swap_factors(self, anchor_factors, positive_factors, negative_factors):
+        # all distances are computed over the last axis, so that this works for a single datapoint or a batch
         if self._swap_metric == 'k':
-            p_dist = np.sum(anchor_factors == positive_factors)
-            n_dist = np.sum(anchor_factors == negative_factors)
+            p_dist = np.sum(anchor_factors == positive_factors, axis=-1)
+            n_dist = np.sum(anchor_factors == negative_factors, axis=-1)
         elif self._swap_metric == 'manhattan':
-            p_dist = np.sum(np.abs(anchor_factors - positive_factors))
-            n_dist = np.sum(np.abs(anchor_factors - negative_factors))
+            p_dist = np.sum(np.abs(anchor_factors - positive_factors), axis=-1)
+            n_dist = np.sum(np.abs(anchor_factors - negative_factors), axis=-1)
         elif self._swap_metric == 'manhattan_norm':
-            p_dist = np.sum(np.abs((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1)))
-            n_dist = np.sum(np.abs((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1)))
+            p_dist = np.sum(np.abs((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1)), axis=-1)
+            n_dist = np.sum(np.abs((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1)), axis=-1)
         elif self._swap_metric == 'euclidean':
-            p_dist = np.linalg.norm(anchor_factors - positive_factors)
-            n_dist = np.linalg.norm(anchor_factors - negative_factors)
+            p_dist = np.linalg.norm(anchor_factors - positive_factors, axis=-1)
+            n_dist = np.linalg.norm(anchor_factors - negative_factors, axis=-1)
         elif self._swap_metric == 'euclidean_norm':
-            p_dist = np.linalg.norm((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1))
-            n_dist = np.linalg.norm((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1))
+            p_dist = np.linalg.norm((anchor_factors - positive_factors) / np.subtract(self._state_space.factor_sizes, 1), axis=-1)
+            n_dist = np.linalg.norm((anchor_factors - negative_factors) / np.subtract(self._state_space.factor_sizes, 1), axis=-1)
         else:
             raise KeyError
         # perform swap
-        if n_dist < p_dist:
-            positive_factors, negative_factors = negative_factors, positive_factors
-            # log.warning(f'Swapped factors based on metric: {self._swap_metric}')
-        # return factors
-        return positive_factors, negative_factors
+        return _swap_rows(positive_factors, negative_factors, swap_mask=(n_dist < p_dist))
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # END CLASS                                                             #
@@ -272,6 +314,15 @@ class FactorSizeError(Exception):
     pass
 
 
+def _swap_rows(a: np.ndarray, b: np.ndarray, swap_mask: Union[bool, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    # single datapoints, swap the arrays themselves
+    if np.ndim(swap_mask) == 0:
+        return (b, a) if swap_mask else (a, b)
+    # batches, swap the individual rows
+    swap_mask = swap_mask[:, None]
+    return np.where(swap_mask, b, a), np.where(swap_mask, a, b)
+
+
 def normalise_range(mins, maxs, sizes):
     sizes = np.array(sizes)
     # compute the bounds for each factor
@@ -32,7 +32,6 @@ import numpy as np
 from disent.dataset.data import GroundTruthData
 from disent.dataset.sampling import BaseDisentSampler
 from disent.dataset.util.state_space import StateSpace
-from disent.util.jit import try_njit
 
 
 # ========================================================================= #
@@ -77,42 +76,57 @@ class GroundTruthRandomWalkSampler(BaseDisentSampler):
         if self._num_samples == 1:
             return (idx,)
         elif self._num_samples == 2:
-            p_dist = np.random.randint(1, self._p_dist_max + 1)
-            pos = _random_walk(idx, p_dist, self._state_space.factor_sizes)
+            p_dist = self.rng.integers(1, self._p_dist_max + 1)
+            pos = _random_walk(idx, p_dist, self._state_space, self.rng)
             return (idx, pos)
         elif self._num_samples == 3:
-            p_dist = np.random.randint(1, self._p_dist_max + 1)
-            n_dist = np.random.randint(1, self._n_dist_max + 1)
-            pos = _random_walk(idx, p_dist, self._state_space.factor_sizes)
-            neg = _random_walk(pos, n_dist, self._state_space.factor_sizes)
+            p_dist = self.rng.integers(1, self._p_dist_max + 1)
+            n_dist = self.rng.integers(1, self._n_dist_max + 1)
+            pos = _random_walk(idx, p_dist, self._state_space, self.rng)
+            neg = _random_walk(pos, n_dist, self._state_space, self.rng)
             return (idx, pos, neg)
         else:
             raise RuntimeError
 
+    def _sample_batch(self, idxs: np.ndarray) -> np.ndarray:
+        if self._num_samples == 1:
+            return idxs[:, None]
+        elif self._num_samples == 2:
+            p_dist = self.rng.integers(1, self._p_dist_max + 1, size=len(idxs))
+            pos = _random_walk_batch(idxs, p_dist, self._state_space, self.rng)
+            return np.stack([idxs, pos], axis=1)
+        elif self._num_samples == 3:
+            p_dist = self.rng.integers(1, self._p_dist_max + 1, size=len(idxs))
+            n_dist = self.rng.integers(1, self._n_dist_max + 1, size=len(idxs))
+            pos = _random_walk_batch(idxs, p_dist, self._state_space, self.rng)
+            neg = _random_walk_batch(pos, n_dist, self._state_space, self.rng)
+            return np.stack([idxs, pos, neg], axis=1)
+        else:
+            raise RuntimeError
+
 
 # ========================================================================= #
 # Helper                                                                    #
 # ========================================================================= #
 
 
-def _random_walk(idx: int, dist: int, factor_sizes: np.ndarray) -> int:
+def _random_walk(idx: int, dist: int, state_space: StateSpace, rng: np.random.Generator) -> int:
     # random walk
-    pos = np.array(np.unravel_index(idx, factor_sizes), dtype=int)  # much faster than StateSpace.idx_to_pos, we don't need checks!
+    pos = state_space.idx_to_pos(idx)
     for _ in range(dist):
-        _walk_nearby_inplace(pos, factor_sizes)
-    idx = np.ravel_multi_index(pos, factor_sizes)  # much faster than StateSpace.pos_to_idx, we don't need checks!
+        _walk_nearby_inplace(pos, state_space.factor_sizes, rng)
+    idx = state_space.pos_to_idx(pos)
     # done!
     return int(idx)
 
 
-@try_njit()
-def _walk_nearby_inplace(pos: np.ndarray, factor_sizes: Sequence[int]) -> NoReturn:
+def _walk_nearby_inplace(pos: np.ndarray, factor_sizes: Sequence[int], rng: np.random.Generator) -> NoReturn:
     # try to shift any single factor by 1 or -1
     while True:
-        f_idx = np.random.randint(0, len(factor_sizes))
+        f_idx = rng.integers(0, len(factor_sizes))
         cur = pos[f_idx]
         # walk random factor value
-        if np.random.random() < 0.5:
+        if rng.random() < 0.5:
             nxt = max(cur - 1, 0)
         else:
             nxt = min(cur + 1, factor_sizes[f_idx] - 1)
@@ -123,6 +137,27 @@ def _walk_nearby_inplace(pos: np.ndarray, factor_sizes: Sequence[int]) -> NoRetu
     pos[f_idx] = nxt
 
 
+def _random_walk_batch(idxs: np.ndarray, dists: np.ndarray, state_space: StateSpace, rng: np.random.Generator) -> np.ndarray:
+    """
+    Vectorized version of `_random_walk`, each index is walked the corresponding number of steps.
+    - `_walk_nearby_inplace` uses rejection sampling over the (factor, direction) pairs, which
+      is equivalent to choosing uniformly from only the valid moves. We can do this for the
+      entire batch at once by taking the argmax of random values over the valid moves.
+    """
+    factor_sizes = state_space.factor_sizes
+    pos = state_space.idx_to_pos(idxs)  # (B, F)
+    rows = np.arange(len(idxs))
+    for step in range(int(np.max(dists, initial=0))):
+        # only walk the positions that still have steps remaining
+        active = step < dists
+        # valid moves are: (B, F, 2) -> [decrement, increment], flattened to (B, F*2)
+        valid = np.stack([pos > 0, pos < factor_sizes - 1], axis=-1).reshape(len(idxs), -1)
+        moves = np.argmax(rng.random(valid.shape) * valid, axis=-1)
+        f_idx, direction = np.divmod(moves, 2)
+        pos[rows, f_idx] += active * valid[rows, moves] * (2 * direction - 1)
+    return state_space.pos_to_idx(pos)
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
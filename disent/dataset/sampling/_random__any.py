@@ -46,7 +46,11 @@ class RandomSampler(BaseDisentSampler):
 
     def _sample_idx(self, idx: int) -> Tuple[int, ...]:
         # sample indices
-        return (idx, *np.random.randint(0, self._len, size=self._num_samples-1))
+        return (idx, *self.rng.integers(0, self._len, size=self._num_samples-1))
+
+    def _sample_batch(self, idxs: np.ndarray) -> np.ndarray:
+        others = self.rng.integers(0, self._len, size=(len(idxs), self._num_samples-1))
+        return np.concatenate([idxs[:, None], others], axis=1)
 
 
 # ========================================================================= #
@@ -24,7 +24,6 @@
 
 from disent.dataset.data import BaseEpisodesData
 from disent.dataset.sampling._base import BaseDisentSampler
-from disent.util.math.random import sample_radius as sample_radius_fn
 
 
 # ========================================================================= #
@@ -77,14 +76,14 @@ class RandomEpisodeSampler(BaseDisentSampler):
             radius = len(episode) + radius + 1
         assert n <= len(episode)
         assert n <= radius
-        # sample values
-        attempts, indices = 0, {idx}
-        while (len(indices) < n) and (attempts < n * 100):
-            indices.add(sample_radius_fn(idx, low=0, high=len(episode), r_low=0, r_high=radius))
-            attempts += 1
-        # checks
-        if len(indices) != n:
+        # sample the other values uniformly without replacement
+        # from all the values within the radius around the index
+        low, high = max(idx - radius + 1, 0), min(idx + radius, len(episode))
+        if high - low < n:
             raise RuntimeError('consider increasing the radius')
+        others = self.rng.choice(high - low - 1, size=n - 1, replace=False) + low
+        others += (others >= idx)  # skip over the index itself
+        indices = {idx, *(int(i) for i in others)}
         # sort indices from highest to lowest.
         # - anchor is the newest
         # - positive is close in the past
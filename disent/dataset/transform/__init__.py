@@ -27,6 +27,8 @@ from disent.dataset.transform._transforms import CheckTensor
 from disent.dataset.transform._transforms import Noop
 from disent.dataset.transform._transforms import ToImgTensorF32
 from disent.dataset.transform._transforms import ToImgTensorU8
+from disent.dataset.transform._transforms import ImgTensorU8ToF32
+from disent.dataset.transform._transforms import RenderImgTensorF32
 from disent.dataset.transform._transforms import ToStandardisedTensor  # deprecated
 from disent.dataset.transform._transforms import ToUint8Tensor         # deprecated
 
@@ -37,3 +39,4 @@ from disent.dataset.transform._augment import FftKernel
 
 # disent dataset augment
 from disent.dataset.transform._augment_disent import DisentDatasetTransform
+from disent.dataset.transform._augment_disent import is_per_observation_random
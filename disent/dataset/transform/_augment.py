@@ -25,6 +25,7 @@
 import os
 import re
 import warnings
+from collections import OrderedDict
 from numbers import Number
 from typing import List
 from typing import Tuple
@@ -34,8 +35,11 @@ import numpy as np
 import torch
 
 from disent.nn.modules import DisentModule
+from disent.nn.functional import get_kernel_size
 from disent.nn.functional import torch_box_kernel_2d
-from disent.nn.functional import torch_conv2d_channel_wise_fft
+from disent.nn.functional import torch_conv2d_channel_wise_fft_spectrum
+from disent.nn.functional import torch_fft_kernel_spectrum
+from disent.nn.functional import torch_gaussian_kernel
 from disent.nn.functional import torch_gaussian_kernel_2d
 
 import disent.registry as R
@@ -61,8 +65,15 @@ class _BaseFftBlur(DisentModule):
     """
     randomly gaussian blur the input images.
     - similar api to kornia
+
+    Kernels are separable, the spectra of all the possible 1D kernels along the
+    height and width are computed once and cached for each (shape, device, dtype).
+    The spectra of the random 2D kernels for a batch are then gathered and combined,
+    without needing to generate kernels or compute their fft each call.
     """
 
+    _MAX_CACHED_SPECTRA = 8
+
     def __init__(self, p: float = 0.5, random_mode='batch', random_same_xy=True):
         super().__init__()
         # check arguments
@@ -75,34 +86,91 @@ class _BaseFftBlur(DisentModule):
             'all':      (True,  True),
             'channels': (False, True),
         }[random_mode]
+        # batches can be augmented at once by `DisentDatasetTransform`
+        self.per_observation_random = self.ran_batch
         # same random value for x and y
         self.b_idx = 0 if random_same_xy else 1
+        # cached kernel spectra
+        self._spectra = OrderedDict()
 
     def forward(self, obs):
+        # single observations are randomly returned as is
+        if obs.ndim == 3:
+            if np.random.random() < (1 - self.p):
+                return obs
+            return self._apply_kernel(obs[None, ...])[0]
+        # if random values are generated across the batch then each observation in the
+        # batch is randomly selected, so that augmenting the entire batch is equivalent
+        # to augmenting each of the observations individually
+        if self.ran_batch:
+            return self._forward_random_batch(obs)
         # randomly return original
         if np.random.random() < (1 - self.p):
             return obs
-        # add or remove batch dim
-        add_batch_dim = (obs.ndim == 3)
-        if add_batch_dim:
-            obs = obs[None, ...]
-        # apply kernel
-        kernel = self._make_kernel(obs.shape, obs.device)
-        result = torch_conv2d_channel_wise_fft(signal=obs, kernel=kernel)
-        # remove batch dim
-        if add_batch_dim:
-            result = result[0]
-        # done!
+        return self._apply_kernel(obs)
+
+    def _forward_random_batch(self, obs):
+        idxs = torch.nonzero(torch.rand(len(obs), device=obs.device) < self.p)[:, 0]
+        # skip work if possible
+        if len(idxs) == 0:
+            return obs
+        if len(idxs) == len(obs):
+            return self._apply_kernel(obs)
+        # only apply the kernel to the selected observations
+        result = obs.clone()
+        result[idxs] = self._apply_kernel(obs[idxs])
         return result
 
-    def _make_kernel(self, shape, device):
+    def _apply_kernel(self, obs):
+        B, C, H, W = obs.shape
+        spectra_h, spectra_w, size = self._get_spectra(H, W, obs.device, obs.dtype)
+        # randomly choose the kernels
+        shape = ((B if self.ran_batch else 1), (C if self.ran_channels else 1))
+        idx_h = torch.randint(len(spectra_h), size=shape, device=obs.device)
+        idx_w = torch.randint(len(spectra_w), size=shape, device=obs.device) if (self.b_idx == 1) else idx_h
+        # the spectrum of a separable kernel is the outer product of the 1D spectra
+        kernel_spectrum = spectra_h[idx_h][..., :, None] * spectra_w[idx_w][..., None, :]
+        return torch_conv2d_channel_wise_fft_spectrum(signal=obs, kernel_spectrum=kernel_spectrum, kernel_hw=(size, size))
+
+    def _get_spectra(self, H: int, W: int, device, dtype):
+        key = (H, W, str(device), dtype)
+        # get the cached spectra
+        if key in self._spectra:
+            self._spectra.move_to_end(key)
+            return self._spectra[key]
+        # compute the spectra
+        kernels_h, kernels_w = self._make_kernels_1d()
+        assert kernels_h.shape[-1] == kernels_w.shape[-1]
+        size = kernels_h.shape[-1]
+        spectra_h = torch.fft.fft(kernels_h.to(device=device, dtype=dtype), n=H + size - 1)
+        spectra_w = torch.fft.rfft(kernels_w.to(device=device, dtype=dtype), n=W + size - 1)
+        self._spectra[key] = (spectra_h, spectra_w, size)
+        # evict old spectra
+        while len(self._spectra) > self._MAX_CACHED_SPECTRA:
+            self._spectra.popitem(last=False)
+        return self._spectra[key]
+
+    def _make_kernels_1d(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns all the possible 1D kernels along the height and width, with shapes
+        (K_h, size) and (K_w, size). The kernels are sampled uniformly from these.
+        """
         raise NotImplementedError
 
+    def __getstate__(self):
+        # do not pickle the cached spectra, these may be on the GPU
+        state = self.__dict__.copy()
+        state['_spectra'] = OrderedDict()
+        return state
+
 
 class FftGaussianBlur(_BaseFftBlur):
     """
     randomly gaussian blur the input images.
     - similar api to kornia
+
+    Random sigma & truncate values are sampled uniformly from `num_buckets` evenly
+    spaced values over their ranges, so that the kernel spectra can be cached.
     """
 
     def __init__(
@@ -111,32 +179,40 @@ class FftGaussianBlur(_BaseFftBlur):
         truncate: MmTuple = 3.0,
         p: float = 0.5,
         random_mode='batch',
-        random_same_xy=True
+        random_same_xy=True,
+        num_buckets: int = 32,
     ):
         super().__init__(p=p, random_mode=random_mode, random_same_xy=random_same_xy)
         self.sigma = _expand_to_min_max_tuples(sigma)
         self.trunc = _expand_to_min_max_tuples(truncate)
+        assert num_buckets >= 1, f'num_buckets must be >= 1, got: {repr(num_buckets)}'
+        self.num_buckets = num_buckets
         # same random value for x and y
         if random_same_xy:
             assert self.sigma[0] == self.sigma[1]
             assert self.trunc[0] == self.trunc[1]
 
-    def _make_kernel(self, shape, device):
-        B, C, H, W = shape
-        # sigma & truncate
-        sigma_m, sigma_M = torch.as_tensor(self.sigma, device=device).T
-        trunc_m, trunc_M = torch.as_tensor(self.trunc, device=device).T
-        # generate random values
-        sigma = sigma_m + torch.rand((B if self.ran_batch else 1), (C if self.ran_channels else 1), 2, dtype=torch.float32, device=device) * (sigma_M - sigma_m)
-        trunc = trunc_m + torch.rand((B if self.ran_batch else 1), (C if self.ran_channels else 1), 2, dtype=torch.float32, device=device) * (trunc_M - trunc_m)
-        # generate kernel
-        return torch_gaussian_kernel_2d(
-            sigma=sigma[..., 0], truncate=trunc[..., 0],
-            sigma_b=sigma[..., self.b_idx], truncate_b=trunc[..., self.b_idx],  # TODO: we do generate unneeded random values if random_same_xy == True
-            dtype=torch.float32, device=device,
+    def _make_kernels_1d(self):
+        size = get_kernel_size(sigma=max(M for m, M in self.sigma), truncate=max(M for m, M in self.trunc))
+        return (
+            _gaussian_kernels_1d(self.sigma[0], self.trunc[0], num_buckets=self.num_buckets, size=size),
+            _gaussian_kernels_1d(self.sigma[1], self.trunc[1], num_buckets=self.num_buckets, size=size),
         )
 
 
+def _gaussian_kernels_1d(sigma: Tuple[Number, Number], trunc: Tuple[Number, Number], num_buckets: int, size: int) -> torch.Tensor:
+    # get the possible values
+    sigmas = torch.linspace(sigma[0], sigma[1], num_buckets if (sigma[0] != sigma[1]) else 1, dtype=torch.float32)
+    truncs = torch.linspace(trunc[0], trunc[1], num_buckets if (trunc[0] != trunc[1]) else 1, dtype=torch.float32)
+    # all combinations in 'ij' order, `torch.meshgrid(..., indexing='ij')` is only supported by torch>=1.10
+    sigmas, truncs = sigmas.repeat_interleave(len(truncs)), truncs.repeat(len(sigmas))
+    # generate the kernels with the same size, then truncate each kernel individually
+    kernels = torch_gaussian_kernel(sigma=sigmas, truncate=truncs, size=size)
+    radius = (truncs * sigmas + 0.5).to(torch.int32)
+    x = torch.abs(torch.arange(size) - (size - 1) // 2)
+    return torch.where(x[None, :] <= radius[:, None], kernels, torch.zeros_like(kernels))
+
+
 class FftBoxBlur(_BaseFftBlur):
     """
     randomly box blur the input images.
@@ -160,21 +236,21 @@ class FftBoxBlur(_BaseFftBlur):
         assert all(isinstance(x, int) for x in values), 'radius values must be integers'
         assert all((0 <= x) for x in values), 'radius values must be >= 0, resulting in diameter: 2*r+1'
 
-    def _make_kernel(self, shape, device):
-        B, C, H, W = shape
-        # sigma & truncate
+    def _make_kernels_1d(self):
         (rym, ryM), (rxm, rxM) = self.radius
-        # generate random values
-        radius_y = torch.randint(low=rym, high=ryM+1, size=((B if self.ran_batch else 1), (C if self.ran_channels else 1)), device=device)
-        radius_x = torch.randint(low=rxm, high=rxM+1, size=((B if self.ran_batch else 1), (C if self.ran_channels else 1)), device=device)
-        # done computing kernel
-        return torch_box_kernel_2d(
-            radius=radius_y,
-            radius_b=radius_x if (self.b_idx == 1) else radius_y,
-            dtype=torch.float32, device=device
+        size = 2 * max(ryM, rxM) + 1
+        return (
+            _box_kernels_1d(rym, ryM, size=size),
+            _box_kernels_1d(rxm, rxM, size=size),
         )
 
 
+def _box_kernels_1d(radius_min: int, radius_max: int, size: int) -> torch.Tensor:
+    radius = torch.arange(radius_min, radius_max + 1)
+    x = torch.abs(torch.arange(size) - (size - 1) // 2)
+    return (x[None, :] <= radius[:, None]).to(torch.float32) / (radius[:, None] * 2 + 1)
+
+
 # ========================================================================= #
 # FFT Kernel                                                                #
 # ========================================================================= #
@@ -188,6 +264,9 @@ class FftKernel(DisentModule):
     2D Convolve an image
     """
 
+    # deterministic, batches can be augmented at once by `DisentDatasetTransform`
+    per_observation_random = True
+
     def __init__(self, kernel: Union[torch.Tensor, str], normalize_mode: str = _NO_ARG):
         super().__init__()
         # deprecation error
@@ -197,6 +276,8 @@ class FftKernel(DisentModule):
         self._kernel: torch.Tensor
         self.register_buffer('_kernel', get_kernel(kernel, normalize_mode=normalize_mode), persistent=True)
         self._kernel.requires_grad = False
+        # cached kernel spectrum
+        self._spectrum = (None, None)
 
     def forward(self, obs):
         # add or remove batch dim
@@ -204,13 +285,26 @@ class FftKernel(DisentModule):
         if add_batch_dim:
             obs = obs[None, ...]
         # apply kernel
-        result = torch_conv2d_channel_wise_fft(signal=obs, kernel=self._kernel)
+        result = torch_conv2d_channel_wise_fft_spectrum(signal=obs, kernel_spectrum=self._get_spectrum(obs), kernel_hw=self._kernel.shape[-2:])
         # remove batch dim
         if add_batch_dim:
             result = result[0]
         # done!
         return result
 
+    def _get_spectrum(self, obs):
+        # the kernel could be modified in-place or moved, so we check its version & pointer
+        key = (tuple(obs.shape[-2:]), str(obs.device), obs.dtype, self._kernel.data_ptr(), self._kernel._version)
+        if self._spectrum[0] != key:
+            self._spectrum = (key, torch_fft_kernel_spectrum(self._kernel.to(device=obs.device, dtype=obs.dtype), obs.shape))
+        return self._spectrum[1]
+
+    def __getstate__(self):
+        # do not pickle the cached spectrum, this may be on the GPU
+        state = self.__dict__.copy()
+        state['_spectrum'] = (None, None)
+        return state
+
 
 # ========================================================================= #
 # Kernels                                                                   #
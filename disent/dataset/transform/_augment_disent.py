@@ -22,6 +22,7 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+from functools import partial
 from typing import Callable
 from typing import Optional
 import torch
@@ -36,39 +37,126 @@ class DisentDatasetTransform(object):
     """
     Applies transforms to batches generated from dataloaders of
     datasets from: disent.dataset.groundtruth
+
+    Each of the elements in the `x_targ` or `x` tuples of a batch is
+    transformed separately, so random transforms like `ColorJitter` generate
+    one random value per element, unlike the `augment` of a `DisentDataset`
+    which is applied to each observation individually.
+
+    Transforms that generate random values for each observation in a batch
+    can opt in to being applied to all the elements at once by setting
+    `per_observation_random = True`, for example `FftGaussianBlur(random_mode='batch')`.
+    This is faster and equivalent to the `augment` of a `DisentDataset`.
+
+    If `per_observation=True`, transforms that do not opt in are instead applied
+    to each observation individually, which is slower but always equivalent.
+
+    If `normalize` is specified, it is first applied to both the inputs and
+    the targets, before the other transforms. For example `ImgTensorU8ToF32`
+    can be used to convert uint8 batches to float32 on the GPU.
     """
 
     def __init__(
         self,
         transform:      Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
         transform_targ: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+        normalize:      Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+        per_observation: bool = False,
     ):
         self.transform = transform
         self.transform_targ = transform_targ
+        self.normalize = normalize
+        self.per_observation = per_observation
 
     def __call__(self, batch):
+        # normalize inputs & targets
+        if self.normalize is not None:
+            batch['x_targ'] = _apply_transform_to_batch_dict(batch['x_targ'], self.normalize)
+            if 'x' in batch:
+                batch['x'] = _apply_transform_to_batch_dict(batch['x'], self.normalize)
         # transform inputs
         if self.transform is not None:
             if 'x' not in batch:
                 batch['x'] = batch['x_targ']
-            batch['x'] = _apply_transform_to_batch_dict(batch['x'], self.transform)
+            batch['x'] = _apply_transform_to_batch_dict(batch['x'], self.transform, per_observation=self.per_observation)
         # transform targets
         if self.transform_targ is not None:
-            batch['x_targ'] = _apply_transform_to_batch_dict(batch['x_targ'], self.transform_targ)
+            batch['x_targ'] = _apply_transform_to_batch_dict(batch['x_targ'], self.transform_targ, per_observation=self.per_observation)
         # done!
         return batch
 
     def __repr__(self):
-        return f'{self.__class__.__name__}(transform={repr(self.transform)}, transform_targ={repr(self.transform_targ)})'
+        return f'{self.__class__.__name__}(transform={repr(self.transform)}, transform_targ={repr(self.transform_targ)}, normalize={repr(self.normalize)}, per_observation={repr(self.per_observation)})'
 
 
-def _apply_transform_to_batch_dict(batch, transform):
-    if isinstance(batch, tuple):
-        return tuple(transform(obs) for obs in batch)
-    if isinstance(batch, list):
-        return list(transform(obs) for obs in batch)
-    else:
+def is_per_observation_random(transform) -> bool:
+    """
+    Check if a transform generates random values for each observation in a batch,
+    such that applying it to a batch is equivalent to applying it to each observation.
+    """
+    return bool(getattr(transform, 'per_observation_random', False))
+
+
+def _apply_transform_to_each_observation(transform, batch: torch.Tensor) -> torch.Tensor:
+    return torch.stack([transform(obs) for obs in batch], dim=0)
+
+
+def _apply_transform_to_batch_dict(batch, transform, per_observation: bool = False):
+    if per_observation and not is_per_observation_random(transform):
+        transform = partial(_apply_transform_to_each_observation, transform)
+    if not isinstance(batch, (tuple, list)):
         return transform(batch)
+    # transform each element individually if the transform does not generate
+    # random values for each observation, or if they cannot be concatenated
+    if (len(batch) == 1) or (not is_per_observation_random(transform)) or any(x.shape[1:] != batch[0].shape[1:] for x in batch):
+        return type(batch)(transform(obs) for obs in batch)
+    # transform all the elements at once
+    sizes = [len(x) for x in batch]
+    result = transform(torch.cat(list(batch), dim=0))
+    assert len(result) == sum(sizes), f'transform changed the batch size from: {sum(sizes)} to: {len(result)}'
+    return type(batch)(torch.split(result, sizes, dim=0))
+
+
+# ========================================================================= #
+# Benchmark                                                                 #
+# ========================================================================= #
+
+
+if __name__ == '__main__':
+
+    def main(num_batches: int = 20, batch_size: int = 256, num_obs: int = 2):
+        import time
+        from torch.utils.data.dataloader import default_collate
+        from disent.dataset.transform import FftBoxBlur
+        from disent.dataset.transform import FftGaussianBlur
+
+        for device in (['cpu', 'cuda'] if torch.cuda.is_available() else ['cpu']):
+            for augment in [
+                FftGaussianBlur(sigma=(0.1, 2.0), truncate=3.0, p=0.5),
+                FftBoxBlur(radius=(0, 3), p=0.5),
+            ]:
+                x_targ = [torch.rand(batch_size, 3, 64, 64, device=device) for _ in range(num_obs)]
+                # augment each observation individually, like the `DisentDataset`
+                t = time.perf_counter()
+                for _ in range(num_batches):
+                    default_collate([tuple(augment(x[i]) for x in x_targ) for i in range(batch_size)])
+                t_obs = time.perf_counter() - t
+                # augment the entire batch at once
+                transform = DisentDatasetTransform(transform=augment)
+                t = time.perf_counter()
+                for _ in range(num_batches):
+                    transform({'x_targ': tuple(x_targ)})
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+                t_batch = time.perf_counter() - t
+                print(f'[{device}] {augment.__class__.__name__}: per-observation: {num_batches * batch_size / t_obs:.1f} batch_obs/s, batched: {num_batches * batch_size / t_batch:.1f} batch_obs/s')
+
+    main()
+
+
+# RESULTS: (single core CPU, no GPU available)
+# [cpu] FftGaussianBlur: per-observation: 966.5 batch_obs/s, batched: 1531.3 batch_obs/s
+# [cpu] FftBoxBlur: per-observation: 1434.2 batch_obs/s, batched: 3715.5 batch_obs/s
 
 
 # ========================================================================= #
@@ -87,9 +87,19 @@ class ToImgTensorF32(object):
         4. move channels to first dim (H, W, C) -> (C, H, W)
         5. normalize using mean and std, values might thus be outside of the range [0, 1]
 
+    Batches of images of shape (B, H, W, C) are converted all at once
+    to tensors of shape (B, C, H, W). When resizing, batches use bilinear
+    interpolation with antialiasing instead of PIL, so values can differ
+    from single observations by up to about 1/255 (before normalization).
+    Older versions of torch without antialiasing resize each observation
+    in the batch with PIL instead.
+
     See: disent.transform.functional.to_img_tensor_f32
+         disent.transform.functional.to_img_tensor_f32_batch
     """
 
+    supports_batch = True
+
     def __init__(
         self,
         size: Optional[F_d.SizeType] = None,
@@ -100,7 +110,21 @@ class ToImgTensorF32(object):
         self._mean = tuple(mean) if (mean is not None) else None
         self._std = tuple(std) if (std is not None) else None
 
+    @property
+    def size(self) -> Optional[F_d.SizeType]:
+        return self._size
+
+    @property
+    def mean(self) -> Optional[Sequence[float]]:
+        return self._mean
+
+    @property
+    def std(self) -> Optional[Sequence[float]]:
+        return self._std
+
     def __call__(self, obs) -> torch.Tensor:
+        if F_d.is_obs_batch(obs):
+            return F_d.to_img_tensor_f32_batch(obs, size=self._size, mean=self._mean, std=self._std)
         return F_d.to_img_tensor_f32(obs, size=self._size, mean=self._mean, std=self._std)
 
     def __repr__(self):
@@ -118,9 +142,16 @@ class ToImgTensorU8(object):
     2. add missing channel to greyscale image
     3. move channels to first dim (H, W, C) -> (C, H, W)
 
+    Batches of images of shape (B, H, W, C) are converted all at once
+    to tensors of shape (B, C, H, W). When resizing, values can differ
+    from single observations by 1, see `ToImgTensorF32`.
+
     See: disent.transform.functional.to_img_tensor_u8
+         disent.transform.functional.to_img_tensor_u8_batch
     """
 
+    supports_batch = True
+
     def __init__(
         self,
         size: Optional[F_d.SizeType] = None,
@@ -128,6 +159,8 @@ class ToImgTensorU8(object):
         self._size = size
 
     def __call__(self, obs) -> torch.Tensor:
+        if F_d.is_obs_batch(obs):
+            return F_d.to_img_tensor_u8_batch(obs, size=self._size)
         return F_d.to_img_tensor_u8(obs, size=self._size)
 
     def __repr__(self):
@@ -135,6 +168,85 @@ class ToImgTensorU8(object):
         return f'{self.__class__.__name__}({kwargs})'
 
 
+class ImgTensorU8ToF32(object):
+    """
+    Convert uint8 image tensors produced by `ToImgTensorU8` into float32
+    tensors equivalent to those produced by `ToImgTensorF32`. Works with
+    single observations (C, H, W) or batches (B, C, H, W) on any device.
+
+    Datasets can use `ToImgTensorU8` to transfer 4x fewer bytes from the
+    dataloader workers, and then this transform can be applied on the GPU,
+    see: `disent.dataset.transform.DisentDatasetTransform(normalize=...)`
+
+    Steps:
+        1. divide by 255
+        2. normalize using mean and std, values might thus be outside of the range [0, 1]
+
+    See: disent.transform.functional.img_tensor_u8_to_f32
+    """
+
+    supports_batch = True
+
+    def __init__(
+        self,
+        mean: Optional[Sequence[float]] = None,
+        std: Optional[Sequence[float]] = None,
+    ):
+        self._mean = tuple(mean) if (mean is not None) else None
+        self._std = tuple(std) if (std is not None) else None
+
+    def __call__(self, obs) -> torch.Tensor:
+        return F_d.img_tensor_u8_to_f32(obs, mean=self._mean, std=self._std)
+
+    def __repr__(self):
+        kwargs = dict(mean=self._mean, std=self._std)
+        kwargs = ", ".join(f"{k}={repr(v)}" for k, v in kwargs.items() if (v is not None))
+        return f'{self.__class__.__name__}({kwargs})'
+
+
+class RenderImgTensorF32(object):
+    """
+    Render batches of observations from their indices using the `render_batch_torch`
+    method of a synthetic ground truth dataset, for example `XYObjectData`. The
+    outputs are float32 tensors (B, C, H, W) equivalent to those produced by
+    `ToImgTensorF32`, rendered on the same device as the indices.
+
+    Dataloaders can then yield only the indices of observations, see:
+    `disent.dataset.data.IndicesGroundTruthData`, and this transform is applied
+    on the GPU, see: `disent.dataset.transform.DisentDatasetTransform(normalize=...)`
+
+    Steps:
+        1. render uint8 observations (B, H, W, C) and move the channels to (B, C, H, W)
+        2. divide by 255
+        3. normalize using mean and std, values might thus be outside of the range [0, 1]
+    """
+
+    supports_batch = True
+
+    def __init__(
+        self,
+        gt_data,
+        mean: Optional[Sequence[float]] = None,
+        std: Optional[Sequence[float]] = None,
+    ):
+        assert callable(getattr(gt_data, 'render_batch_torch', None)), f'gt_data does not support rendering on the device, missing method `render_batch_torch`, got: {repr(gt_data)}'
+        self._gt_data = gt_data
+        self._mean = tuple(mean) if (mean is not None) else None
+        self._std = tuple(std) if (std is not None) else None
+
+    def __call__(self, idxs) -> torch.Tensor:
+        idxs = torch.as_tensor(idxs)
+        obs = self._gt_data.render_batch_torch(idxs.reshape(-1))
+        assert obs.dtype == torch.uint8, f'rendered observations must be dtype torch.uint8, got: {obs.dtype}'
+        obs = F_d.img_tensor_u8_to_f32(obs.permute(0, 3, 1, 2).contiguous(), mean=self._mean, std=self._std)
+        return obs.reshape(*idxs.shape, *obs.shape[1:])
+
+    def __repr__(self):
+        kwargs = dict(mean=self._mean, std=self._std)
+        kwargs = ", ".join(f"{k}={repr(v)}" for k, v in kwargs.items() if (v is not None))
+        return f'{self.__class__.__name__}({self._gt_data.__class__.__name__}{", " if kwargs else ""}{kwargs})'
+
+
 # ========================================================================= #
 # Deprecated                                                                #
 # ========================================================================= #
@@ -23,15 +23,20 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 from typing import Any
+from typing import Callable
+from typing import List
 from typing import Optional
 from typing import Sequence
 from typing import Tuple
 from typing import TypeVar
 from typing import Union
 
+import inspect
+
 import numpy as np
 from PIL.Image import Image
 import torch
+import torch.nn.functional as F
 import torchvision.transforms.functional as F_tv
 
 
@@ -46,6 +51,8 @@ Obs = Union[np.ndarray, Image]
 
 SizeType = Union[int, Tuple[int, int]]
 
+ObsBatch = Union[np.ndarray, torch.Tensor]
+
 
 # ========================================================================= #
 # Functional Transforms                                                     #
@@ -178,6 +185,197 @@ def to_img_tensor_f32(
     return obs
 
 
+# ========================================================================= #
+# Batched Image Tensors                                                     #
+# ========================================================================= #
+
+
+def is_obs_batch(obs: Any) -> bool:
+    """
+    Check if the input is a batch of images of shape (B, H, W, C).
+    - batches of greyscale images (B, H, W) cannot be
+      distinguished from single images, and are not detected.
+    """
+    return isinstance(obs, (np.ndarray, torch.Tensor)) and (obs.ndim == 4)
+
+
+def _get_resized_hw(H: int, W: int, size: SizeType) -> Tuple[int, int]:
+    # matches `F_tv.resize`, if the size is an int then the smaller edge is resized
+    if not isinstance(size, int):
+        h, w = size
+        return h, w
+    if W <= H:
+        return int(size * H / W), size
+    return size, int(size * W / H)
+
+
+# antialiasing was only added to `F.interpolate` in torch 1.11, without it batches
+# resized with `F.interpolate` differ too much from single observations resized with PIL
+_INTERPOLATE_ANTIALIAS = 'antialias' in inspect.signature(F.interpolate).parameters
+
+
+def _is_pil_resize_required(obs: ObsBatch, size: Optional[SizeType]) -> bool:
+    # check if the batch should rather be resized one observation at a time with PIL
+    if (size is None) or _INTERPOLATE_ANTIALIAS:
+        return False
+    H, W = obs.shape[1:3]
+    return _get_resized_hw(H, W, size) != (H, W)
+
+
+def _stack_obs(transform: Callable[[np.ndarray], torch.Tensor], obs: ObsBatch) -> torch.Tensor:
+    # apply a single observation transform to each observation in a batch, keeping tensors on their device
+    items = obs.cpu().numpy() if torch.is_tensor(obs) else obs
+    batch = torch.stack([transform(o) for o in items])
+    return batch.to(obs.device) if torch.is_tensor(obs) else batch
+
+
+def _batch_to_nchw(obs: ObsBatch) -> torch.Tensor:
+    # convert to tensor, tensors remain on their device
+    if isinstance(obs, np.ndarray):
+        obs = torch.from_numpy(obs if obs.flags.writeable else np.array(obs))
+    assert torch.is_tensor(obs), f'batch must be a numpy.ndarray or torch.Tensor, got: {type(obs)}'
+    # add missing axis
+    if obs.ndim == 3:
+        obs = obs[:, :, :, None]
+    assert obs.ndim == 4, f'batch must have shape (B, H, W, C) or (B, H, W), got: {tuple(obs.shape)}'
+    # move axis (B, H, W, C) -> (B, C, H, W), this is only a view
+    return obs.permute(0, 3, 1, 2)
+
+
+def _resize_nchw(obs: torch.Tensor, size: Optional[SizeType], quantize: bool) -> torch.Tensor:
+    # skip resizing
+    if size is None:
+        return obs
+    h, w = _get_resized_hw(obs.shape[-2], obs.shape[-1], size)
+    if (h, w) == tuple(obs.shape[-2:]):
+        return obs
+    # bilinear with antialiasing approximately matches PIL, which is used by `F_tv.resize`
+    # - see `_is_pil_resize_required` for older versions of pytorch without antialiasing
+    obs = F.interpolate(obs, size=(h, w), mode='bilinear', align_corners=False, antialias=True)
+    # PIL resizes integer images with integer outputs
+    if quantize:
+        obs = obs.round_().clamp_(0, 255)
+    return obs
+
+
+def to_img_tensor_u8_batch(
+    obs: ObsBatch,
+    size: Optional[SizeType] = None,
+) -> torch.Tensor:
+    """
+    Batched version of `to_img_tensor_u8`, for uint8 numpy arrays
+    or tensors of shape (B, H, W, C) or (B, H, W).
+
+    Steps:
+    1. add missing channel to greyscale images
+    2. move channels to the second dim (B, H, W, C) -> (B, C, H, W)
+    3. resize images if size is specified, using `torch.nn.functional.interpolate`,
+       or with PIL for each observation if antialiasing is not supported (torch<1.11)
+    """
+    if _is_pil_resize_required(obs, size):
+        return _stack_obs(lambda o: to_img_tensor_u8(o, size=size), obs)
+    obs = _batch_to_nchw(obs)
+    assert obs.dtype == torch.uint8, f'batch is not dtype torch.uint8, got: {obs.dtype}'
+    # resize images
+    if size is not None:
+        obs = _resize_nchw(obs.to(torch.float32), size=size, quantize=True).to(torch.uint8)
+    # checks
+    assert obs.ndim == 4
+    assert obs.dtype == torch.uint8
+    # done!
+    return obs.contiguous()
+
+
+def to_img_tensor_f32_batch(
+    obs: ObsBatch,
+    size: Optional[SizeType] = None,
+    mean: Optional[Sequence[float]] = None,
+    std: Optional[Sequence[float]] = None,
+) -> torch.Tensor:
+    """
+    Batched version of `to_img_tensor_f32`, for numpy arrays
+    or tensors of shape (B, H, W, C) or (B, H, W).
+
+    Steps:
+        1. add missing channel to greyscale images
+        2. move channels to the second dim (B, H, W, C) -> (B, C, H, W)
+        3. resize images if size is specified, using `torch.nn.functional.interpolate`,
+           or with PIL for each observation if antialiasing is not supported (torch<1.11)
+        4. if we have uint8 inputs, divide by 255
+        5. normalize using mean and std, values might thus be outside of the range [0, 1]
+
+    The conversion to float32 and moving of the channels is performed
+    in a single copy, all other operations are performed in-place.
+    """
+    if _is_pil_resize_required(obs, size):
+        return _stack_obs(lambda o: to_img_tensor_f32(o, size=size, mean=mean, std=std), obs)
+    obs = _batch_to_nchw(obs)
+    is_uint8 = (obs.dtype == torch.uint8)
+    # convert to float32 & make contiguous, this always creates a copy
+    obs = obs.to(dtype=torch.float32, memory_format=torch.contiguous_format, copy=True)
+    obs = _resize_nchw(obs, size=size, quantize=is_uint8)
+    # scale
+    if is_uint8:
+        obs.div_(255)
+    # apply mean and std, obs is of the shape (B, C, H, W)
+    if (mean is not None) or (std is not None):
+        mean = torch.as_tensor(0. if (mean is None) else mean, dtype=torch.float32, device=obs.device).reshape(-1, 1, 1)
+        std = torch.as_tensor(1. if (std is None) else std, dtype=torch.float32, device=obs.device).reshape(-1, 1, 1)
+        obs.sub_(mean).div_(std)
+    # checks
+    assert obs.ndim == 4, f'batch does not have 4 dimensions, got: {obs.ndim} for shape: {obs.shape}'
+    assert obs.dtype == torch.float32, f'batch is not dtype torch.float32, got: {obs.dtype}'
+    # done!
+    return obs
+
+
+def img_tensor_u8_to_f32(
+    obs: torch.Tensor,
+    mean: Optional[Sequence[float]] = None,
+    std: Optional[Sequence[float]] = None,
+) -> torch.Tensor:
+    """
+    Convert uint8 image tensors of shape (..., C, H, W), usually the
+    outputs of `to_img_tensor_u8`, into float32 tensors equivalent to
+    the outputs of `to_img_tensor_f32`. The tensors are kept on their device.
+
+    This allows datasets to transfer uint8 observations from workers, which
+    are 4x smaller than float32 observations, and normalize them on the GPU.
+
+    Steps:
+        1. divide by 255
+        2. normalize using mean and std, values might thus be outside of the range [0, 1]
+    """
+    assert torch.is_tensor(obs), f'obs must be a torch.Tensor, got: {type(obs)}'
+    assert obs.dtype == torch.uint8, f'obs is not dtype torch.uint8, got: {obs.dtype}'
+    assert obs.ndim >= 3, f'obs must have shape (..., C, H, W), got: {tuple(obs.shape)}'
+    # convert to float32, this always creates a copy
+    obs = obs.to(dtype=torch.float32).div_(255)
+    # apply mean and std, obs is of the shape (..., C, H, W)
+    if (mean is not None) or (std is not None):
+        mean = torch.as_tensor(0. if (mean is None) else mean, dtype=torch.float32, device=obs.device).reshape(-1, 1, 1)
+        std = torch.as_tensor(1. if (std is None) else std, dtype=torch.float32, device=obs.device).reshape(-1, 1, 1)
+        obs.sub_(mean).div_(std)
+    # done!
+    return obs
+
+
+def transform_observations(transform: Optional[Callable[[Any], Any]], obs: Sequence[Any]) -> List[Any]:
+    """
+    Apply a transform to each observation in a sequence. If the transform has
+    the attribute `supports_batch=True` and all the observations are arrays with
+    the same shape, the transform is called once on the stacked observations.
+    """
+    if transform is None:
+        return list(obs)
+    if getattr(transform, 'supports_batch', False) and (len(obs) > 0) and all(isinstance(o, np.ndarray) for o in obs):
+        shape = obs[0].shape
+        if (len(shape) in (2, 3)) and all(o.shape == shape for o in obs):
+            batch = np.stack(obs)
+            return list(transform(batch if (batch.ndim == 4) else batch[..., None]))
+    return [transform(o) for o in obs]
+
+
 # ========================================================================= #
 # Custom Normalized Image - Faster Than Above                               #
 # ========================================================================= #
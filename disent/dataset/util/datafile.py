@@ -36,13 +36,39 @@ from typing import Union
 import numpy as np
 
 from disent.dataset.util.hdf5 import hdf5_resave_file
+from disent.dataset.util.npz import NpzArrayReader
 from disent.util.inout.cache import stalefile
 from disent.util.function import wrapped_partial
+from disent.util.inout.files import FileLock
 from disent.util.inout.files import retrieve_file
+from disent.util.inout.hashing import cache_file_hash
 from disent.util.inout.paths import filename_from_url
 from disent.util.inout.paths import modify_file_name
 
 
+# ========================================================================= #
+# settings                                                                  #
+# ========================================================================= #
+
+
+# setting this environment variable overrides the default number of processes
+# used to compress the chunks of generated hdf5 files, `0` disables this.
+_ENV_HDF5_NUM_WORKERS = 'DISENT_HDF5_NUM_WORKERS'
+
+
+def get_hdf5_num_workers(num_workers: Optional[int] = None) -> int:
+    """
+    Get the number of processes used to compress the chunks of generated hdf5 files.
+    - if `num_workers` is `None`, then the `DISENT_HDF5_NUM_WORKERS` environment
+      variable is used, otherwise the number of cpus up to a maximum of 16.
+    """
+    if num_workers is not None:
+        return num_workers
+    if os.environ.get(_ENV_HDF5_NUM_WORKERS, ''):
+        return int(os.environ[_ENV_HDF5_NUM_WORKERS])
+    return min(os.cpu_count() or 1, 16)
+
+
 # ========================================================================= #
 # data objects                                                              #
 # ========================================================================= #
@@ -91,10 +117,14 @@ class DataFileHashed(DataFile, metaclass=ABCMeta):
         self._hash_mode = hash_mode
 
     def prepare(self, out_dir: str) -> str:
-        @stalefile(file=os.path.join(out_dir, self._file_name), hash=self._file_hash, hash_type=self._hash_type, hash_mode=self._hash_mode)
-        def wrapped(out_file):
-            self._prepare(out_dir=out_dir, out_file=out_file)
-        return wrapped()
+        out_file = os.path.join(out_dir, self._file_name)
+        # other threads, processes or nodes sharing the same
+        # directory should not prepare the same file at the same time
+        with FileLock(out_file):
+            @stalefile(file=out_file, hash=self._file_hash, hash_type=self._hash_type, hash_mode=self._hash_mode)
+            def wrapped(out_file):
+                self._prepare(out_dir=out_dir, out_file=out_file)
+            return wrapped()
 
     def _prepare(self, out_dir: str, out_file: str) -> NoReturn:
         # TODO: maybe raise a FileNotFoundError or a HashError instead?
@@ -125,7 +155,11 @@ class DataFileHashedDl(DataFileHashed):
         self._uri = uri
 
     def _prepare(self, out_dir: str, out_file: str):
-        retrieve_file(src_uri=self._uri, dst_path=out_file, overwrite_existing=True)
+        # full hashes are computed while downloading, then cached so
+        # that validating the downloaded file does not need to re-read it
+        hash = retrieve_file(src_uri=self._uri, dst_path=out_file, overwrite_existing=True, hash_type=self._hash_type if (self._hash_mode == 'full') else None)
+        if hash is not None:
+            cache_file_hash(out_file, hash=hash, hash_type=self._hash_type, hash_mode=self._hash_mode)
 
     def __repr__(self):
         return f'{self.__class__.__name__}(uri={repr(self._uri)}, out_name={repr(self.out_name)})'
@@ -191,9 +225,11 @@ class DataFileHashedDlH5(DataFileHashedDlGen):
         hdf5_chunk_size: Tuple[int, ...],
         hdf5_compression: Optional[str] = 'gzip',
         hdf5_compression_lvl: Optional[int] = 4,
+        hdf5_shuffle: bool = False,
         hdf5_dtype: Optional[Union[np.dtype, str]] = None,
         hdf5_mutator: Optional[Callable[[np.ndarray], np.ndarray]] = None,
         hdf5_obs_shape: Optional[Sequence[int]] = None,
+        hdf5_num_workers: Optional[int] = None,  # compress chunks in parallel, falls back to serial if not byte-identical to h5py's, see `get_hdf5_num_workers`
         # save paths
         uri_name: Optional[str] = None,
         file_name: Optional[str] = None,
@@ -216,10 +252,12 @@ class DataFileHashedDlH5(DataFileHashedDlGen):
             chunk_size=hdf5_chunk_size,
             compression=hdf5_compression,
             compression_lvl=hdf5_compression_lvl,
+            shuffle=hdf5_shuffle,
             out_dtype=hdf5_dtype,
             out_mutator=hdf5_mutator,
             obs_shape=hdf5_obs_shape,
         )
+        self._hdf5_num_workers = hdf5_num_workers
         # save the dataset name
         self._dataset_name = hdf5_dataset_name
 
@@ -228,7 +266,65 @@ class DataFileHashedDlH5(DataFileHashedDlGen):
         return self._dataset_name
 
     def _generate(self, inp_file: str, out_file: str):
-        self._hdf5_resave_file(inp_path=inp_file, out_path=out_file)
+        self._hdf5_resave_file(inp_path=inp_file, out_path=out_file, num_workers=get_hdf5_num_workers(self._hdf5_num_workers))
+
+
+class DataFileHashedDlNpzH5(DataFileHashedDlH5):
+    """
+    Downloads a numpy `.npz` or `.npy` file and converts it into an hdf5 file with the specified chunk_size.
+    - The array is streamed from the downloaded file in batches, so that
+      the full array is never loaded into memory during the conversion.
+    """
+
+    def __init__(
+        self,
+        # download & save files
+        uri: str,
+        uri_hash: Optional[Union[str, Dict[str, str]]],
+        file_hash: Optional[Union[str, Dict[str, str]]],
+        # h5 re-save settings
+        npz_key: Optional[str],
+        hdf5_dataset_name: str,
+        hdf5_chunk_size: Tuple[int, ...],
+        hdf5_compression: Optional[str] = 'gzip',
+        hdf5_compression_lvl: Optional[int] = 4,
+        hdf5_shuffle: bool = False,
+        hdf5_dtype: Optional[Union[np.dtype, str]] = None,
+        hdf5_mutator: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+        hdf5_obs_shape: Optional[Sequence[int]] = None,
+        hdf5_batch_size: Optional[int] = 1024,
+        hdf5_num_workers: Optional[int] = None,  # compress chunks in parallel, falls back to serial if not byte-identical to h5py's, see `get_hdf5_num_workers`
+        # save paths
+        uri_name: Optional[str] = None,
+        file_name: Optional[str] = None,
+        # hash settings
+        hash_type: str = 'md5',
+        hash_mode: str = 'fast',
+    ):
+        super().__init__(
+            uri=uri,
+            uri_hash=uri_hash,
+            file_hash=file_hash,
+            hdf5_dataset_name=hdf5_dataset_name,
+            hdf5_chunk_size=hdf5_chunk_size,
+            hdf5_compression=hdf5_compression,
+            hdf5_compression_lvl=hdf5_compression_lvl,
+            hdf5_shuffle=hdf5_shuffle,
+            hdf5_dtype=hdf5_dtype,
+            hdf5_mutator=hdf5_mutator,
+            hdf5_obs_shape=hdf5_obs_shape,
+            hdf5_num_workers=hdf5_num_workers,
+            uri_name=uri_name,
+            file_name=modify_file_name(filename_from_url(uri) if (uri_name is None) else uri_name, prefix='gen', suffix='h5') if (file_name is None) else file_name,
+            hash_type=hash_type,
+            hash_mode=hash_mode,
+        )
+        self._npz_key = npz_key
+        self._hdf5_batch_size = hdf5_batch_size
+
+    def _generate(self, inp_file: str, out_file: str):
+        with NpzArrayReader(inp_file, key=self._npz_key) as inp_data:
+            self._hdf5_resave_file(inp_path=inp_data, out_path=out_file, batch_size=self._hdf5_batch_size, num_workers=get_hdf5_num_workers(self._hdf5_num_workers))
 
 
 # ========================================================================= #
@@ -29,10 +29,15 @@ Utilities for converting and testing different chunk sizes of hdf5 files
 import contextlib
 import logging
 import os
+import pickle
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Any
 from typing import Callable
 from typing import Dict
+from typing import List
 from typing import Literal
 from typing import Optional
 from typing import Sequence
@@ -507,6 +512,126 @@ def _normalize_out_array(array: Union[torch.Tensor, np.ndarray]) -> np.ndarray:
     return np.array(array)
 
 
+def _h5_supports_direct_chunks(out_data: h5py.Dataset) -> bool:
+    # we can only compress chunks ourselves if the output is identical to the
+    # gzip filter from hdf5, and if each chunk spans entire observations.
+    return (
+        (out_data.chunks is not None)
+        and (out_data.compression == 'gzip')
+        and (tuple(out_data.chunks[1:]) == tuple(out_data.shape[1:]))
+        and (not out_data.shuffle)
+        and (not out_data.fletcher32)
+        and (out_data.scaleoffset is None)
+    )
+
+
+def _h5_direct_chunks_are_identical(
+    inp_data: Union[h5py.Dataset, np.ndarray, 'torch.Tensor'],
+    out_data: h5py.Dataset,
+    out_mutator: Optional[Callable[[np.ndarray], np.ndarray]],
+) -> bool:
+    # python's zlib may be a different build to the one used by the hdf5 gzip filter, eg. zlib-ng,
+    # so check that the first chunk compressed by both is byte-identical before relying on this.
+    chunk_len = out_data.chunks[0]
+    obs_shape = tuple(out_data.shape[1:])
+    compression_lvl = 4 if (out_data.compression_opts is None) else out_data.compression_opts
+    batch = _normalize_out_array(inp_data[:chunk_len])
+    if out_mutator is not None:
+        batch = _normalize_out_array(out_mutator(batch))
+    # the workers only support lossless type conversions
+    if (batch.shape[1:] != obs_shape) or (not np.can_cast(batch.dtype, out_data.dtype, casting='safe')):
+        return False
+    # edge chunks are padded with the fill value
+    chunk = np.zeros((chunk_len, *obs_shape), dtype=out_data.dtype)
+    chunk[:len(batch)] = batch
+    # compress the chunk with the hdf5 filter, using an in-memory file
+    with h5py.File(f'probe_{id(chunk)}.h5', 'w', driver='core', backing_store=False, libver='earliest') as h5_file:
+        probe = h5_file.create_dataset('probe', data=chunk, chunks=out_data.chunks, compression='gzip', compression_opts=compression_lvl, track_times=False)
+        _, h5_chunk = probe.id.read_direct_chunk((0, *(0 for _ in obs_shape)))
+    return bytes(h5_chunk) == zlib.compress(chunk.tobytes(), compression_lvl)
+
+
+def _h5_is_picklable(obj) -> bool:
+    try:
+        pickle.dumps(obj)
+    except Exception:
+        return False
+    return True
+
+
+def _h5_compress_batch(
+    batch: np.ndarray,
+    chunk_len: int,
+    obs_shape: Tuple[int, ...],
+    out_dtype: np.dtype,
+    out_mutator: Optional[Callable[[np.ndarray], np.ndarray]],
+    compression_lvl: int,
+) -> List[bytes]:
+    # modify the batch
+    if out_mutator is not None:
+        batch = _normalize_out_array(out_mutator(batch))
+    assert batch.shape[1:] == obs_shape, f'obs shape: {tuple(batch.shape[1:])} from processed input data does not match required obs shape: {tuple(obs_shape)}, try changing the `obs_shape` or resizing the batch in the `out_mutator`.'
+    # hdf5 performs its own type conversions, only allow those that are lossless
+    if batch.dtype != out_dtype:
+        if not np.can_cast(batch.dtype, out_dtype, casting='safe'):
+            raise TypeError(f'cannot safely cast batch dtype: {batch.dtype} to the output dtype: {out_dtype}, convert the batch in the `out_mutator` or set `num_workers=0`')
+        batch = batch.astype(out_dtype)
+    # edge chunks are always stored in full, padded with the fill value
+    if len(batch) % chunk_len != 0:
+        pad = chunk_len - (len(batch) % chunk_len)
+        batch = np.concatenate([batch, np.zeros((pad, *batch.shape[1:]), dtype=batch.dtype)], axis=0)
+    # compress each chunk, this is the same as the hdf5 deflate filter
+    batch = np.ascontiguousarray(batch)
+    return [zlib.compress(batch[i:i+chunk_len].tobytes(), compression_lvl) for i in range(0, len(batch), chunk_len)]
+
+
+def _hdf5_save_array_parallel(
+    inp_data: Union[h5py.Dataset, np.ndarray, 'torch.Tensor'],
+    out_data: h5py.Dataset,
+    batch_size: int,
+    out_mutator: Optional[Callable[[np.ndarray], np.ndarray]],
+    num_workers: int,
+    max_in_flight: Optional[int],
+    progress: tqdm,
+):
+    """
+    Read batches in the main process, but apply the mutator & compress the chunks
+    on a process pool. The pre-compressed chunks are written to the output dataset in
+    order using `write_direct_chunk`, so the output file is byte-identical to the
+    result of writing the batches directly with h5py.
+    - At most `max_in_flight` batches are kept in memory at any point in time.
+    """
+    chunk_len = out_data.chunks[0]
+    obs_shape = tuple(out_data.shape[1:])
+    compression_lvl = 4 if (out_data.compression_opts is None) else out_data.compression_opts
+    # batches should contain whole chunks
+    batch_size = max(batch_size // chunk_len, 1) * chunk_len
+    if max_in_flight is None:
+        max_in_flight = num_workers * 2
+    # the mutator can only be applied in the workers if it can be pickled
+    main_mutator, worker_mutator = (None, out_mutator) if _h5_is_picklable(out_mutator) else (out_mutator, None)
+    # write the chunks to the dataset
+    def write_next(futures: deque):
+        i, future = futures.popleft()
+        chunks = future.result()
+        for j, chunk in enumerate(chunks):
+            out_data.id.write_direct_chunk((i + j * chunk_len, *(0 for _ in obs_shape)), chunk)
+        progress.update(min(len(chunks) * chunk_len, len(out_data) - i))
+    # compress the chunks
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = deque()
+        for i in range(0, len(inp_data), batch_size):
+            batch = _normalize_out_array(inp_data[i:i + batch_size])
+            if main_mutator is not None:
+                batch = _normalize_out_array(main_mutator(batch))
+            futures.append((i, executor.submit(_h5_compress_batch, batch, chunk_len, obs_shape, out_data.dtype, worker_mutator, compression_lvl)))
+            # bound the memory usage
+            while len(futures) >= max_in_flight:
+                write_next(futures)
+        while futures:
+            write_next(futures)
+
+
 def hdf5_save_array(
     inp_data: Union[h5py.Dataset, np.ndarray, 'torch.Tensor'],
     out_h5: h5py.File,
@@ -514,10 +639,13 @@ def hdf5_save_array(
     chunk_size: Optional[Union[Tuple[int, ...], Literal[True]]] = None,  # True: auto determine, Tuple: specific chunk size, None: disable chunking
     compression: Optional[Union[Literal['gzip'], Literal['lzf']]] = None,  # compression type, only works if chunks is specified
     compression_lvl: Optional[int] = None,  # 0 through 9
+    shuffle: bool = False,  # reorder chunk values before compression to possibly help compression, only works if chunks is specified
     batch_size: Optional[int] = None,  # batch size to process / save at a time
     out_dtype: Optional[Union[np.dtype, str]] = None,  # output dtype of the dataset
     out_mutator: Optional[Callable[[np.ndarray], np.ndarray]] = None,  # mutate batches before saving
     obs_shape: Optional[Tuple[int, ...]] = None,  # resize batches to this shape
+    num_workers: int = 0,  # compress chunks in parallel using this many processes, only supported for gzip compression & chunks spanning entire observations
+    max_in_flight: Optional[int] = None,  # maximum number of batches being processed at once when num_workers > 0, defaults to `2 * num_workers`
 ):
     # TODO: this should take in an array object and output the file!
     # check out_h5 version compatibility
@@ -534,6 +662,7 @@ def hdf5_save_array(
         chunks=chunk_size,
         compression=compression,
         compression_opts=compression_lvl,
+        shuffle=shuffle,
         # non-deterministic time stamps are added to the file if this is not
         # disabled, resulting in different hash sums when the file is re-generated!
         # - https://github.com/h5py/h5py/issues/225
@@ -543,7 +672,6 @@ def hdf5_save_array(
         track_times=False,
         # track_order=False,
         # fletcher32=True,  # checksum for each chunk
-        # shuffle=True,     # reorder chunk values to possibly help compression
         # scaleoffset=<int> # enable lossy compression, ints: number of bits to keep (0 is automatic lossless), floats: number of digits after decimal
     )
     # print stats
@@ -554,6 +682,16 @@ def hdf5_save_array(
     if batch_size is None:
         batch_size = inp_data.chunks[0] if (hasattr(inp_data, 'chunks') and inp_data.chunks) else 32
         log.debug(f'saving h5 dataset using automatic batch size of: {batch_size}')
+    # save data in parallel
+    if num_workers > 0:
+        if not _h5_supports_direct_chunks(out_data):
+            log.warning(f'parallel chunk compression is not supported for chunks: {out_data.chunks} and compression: {repr(out_data.compression)}, falling back to serial saving.')
+        elif not _h5_direct_chunks_are_identical(inp_data, out_data, out_mutator):
+            log.warning(f'parallel chunk compression would not be byte-identical to the hdf5 gzip filter for dataset: {repr(dataset_name)}, falling back to serial saving.')
+        else:
+            with tqdm(total=len(inp_data)) as progress:
+                _hdf5_save_array_parallel(inp_data=inp_data, out_data=out_data, batch_size=batch_size, out_mutator=out_mutator, num_workers=num_workers, max_in_flight=max_in_flight, progress=progress)
+            return
     # get default
     if out_mutator is None:
         out_mutator = lambda x: x
@@ -577,11 +715,14 @@ def hdf5_resave_file(
     chunk_size: Optional[Union[Tuple[int, ...], Literal[True]]] = None,  # True: auto determine, Tuple: specific chunk size, None: disable chunking
     compression: Optional[Union[Literal['gzip'], Literal['lzf']]] = None,  # compression type, only works if chunks is specified
     compression_lvl: Optional[int] = None,  # 0 through 9
+    shuffle: bool = False,  # reorder chunk values before compression to possibly help compression, only works if chunks is specified
     batch_size: Optional[int] = None,  # batch size to process / save at a time
     out_dtype: Optional[Union[np.dtype, str]] = None,  # output dtype of the dataset
     out_mutator: Optional[Callable[[np.ndarray], np.ndarray]] = None,  # mutate batches before saving
     obs_shape: Optional[Tuple[int, ...]] = None,  # resize batches to this shape
     write_mode: Union[Literal['atomic_w'], Literal['w'], Literal['a']] = 'atomic_w',
+    num_workers: int = 0,  # compress chunks in parallel using this many processes
+    max_in_flight: Optional[int] = None,  # maximum number of batches being processed at once when num_workers > 0
 ):
     if isinstance(inp_path, str):
         inp_context = h5py.File(inp_path, 'r')
@@ -610,10 +751,13 @@ def hdf5_resave_file(
                     chunk_size=chunk_size,
                     compression=compression,
                     compression_lvl=compression_lvl,
+                    shuffle=shuffle,
                     batch_size=batch_size,
                     out_dtype=out_dtype,
                     out_mutator=out_mutator,
                     obs_shape=obs_shape,
+                    num_workers=num_workers,
+                    max_in_flight=max_in_flight,
                 )
     # file size:
     log.info(f'[FILE SIZES] IN: {bytes_to_human(os.path.getsize(inp_path)) if isinstance(inp_path, str) else "N/A"} OUT: {bytes_to_human(os.path.getsize(out_path))}')
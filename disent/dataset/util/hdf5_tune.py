@@ -0,0 +1,317 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Benchmark different chunk shapes & filters of hdf5 datasets for
+a specific access pattern, and recommend the fastest configuration.
+
+The recommended config can be passed directly to `DataFileHashedDlH5`,
+for example: `DataFileHashedDlH5(..., **result.config.datafile_kwargs())`
+"""
+
+import itertools
+import logging
+import os
+import time
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from typing import Dict
+from typing import List
+from typing import Literal
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import h5py
+import numpy as np
+
+from disent.dataset.util.state_space import StateSpace
+from disent.util.seeds import as_rng
+from disent.util.seeds import RngLike
+from disent.util.strings.fmt import bytes_to_human
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Config                                                                    #
+# ========================================================================= #
+
+
+AccessPattern = Union[Literal['random'], Literal['random_batch'], Literal['sequential'], Literal['traversal']]
+
+ACCESS_PATTERNS = ('random', 'random_batch', 'sequential', 'traversal')
+
+DEFAULT_COMPRESSIONS = (
+    (None, None),
+    ('gzip', 1),
+    ('gzip', 4),
+    ('gzip', 9),
+    ('lzf', None),
+)
+
+
+@dataclass(frozen=True)
+class H5TuneConfig(object):
+    chunk_size: Tuple[int, ...]
+    compression: Optional[str] = None
+    compression_lvl: Optional[int] = None
+    shuffle: bool = False
+
+    def datafile_kwargs(self) -> Dict[str, object]:
+        # arguments for `DataFileHashedDlH5`
+        return dict(
+            hdf5_chunk_size=self.chunk_size,
+            hdf5_compression=self.compression,
+            hdf5_compression_lvl=self.compression_lvl,
+            hdf5_shuffle=self.shuffle,
+        )
+
+    def __str__(self):
+        compression = 'none' if (self.compression is None) else (self.compression if (self.compression_lvl is None) else f'{self.compression}:{self.compression_lvl}')
+        return f'chunks={list(self.chunk_size)} compression={compression} shuffle={self.shuffle}'
+
+
+@dataclass(frozen=True)
+class H5TuneResult(object):
+    config: H5TuneConfig
+    entries_per_sec: float
+    bytes_per_entry: float
+    write_sec: float
+
+
+# ========================================================================= #
+# Access Patterns                                                           #
+# ========================================================================= #
+
+
+def _truncated_factor_sizes(factor_sizes: Sequence[int], max_len: int) -> Tuple[int, ...]:
+    # get the factor sizes of the first `max_len` or fewer entries in the
+    # dataset such that they still form a valid (smaller) state space.
+    truncated, size = [], 1
+    for s in reversed(factor_sizes):
+        s = int(np.clip(max_len // size, 1, s))
+        truncated.append(s)
+        size *= s
+    return tuple(reversed(truncated))
+
+
+def _make_access_batches(
+    access_pattern: AccessPattern,
+    length: int,
+    num_entries: int,
+    batch_size: int,
+    factor_sizes: Optional[Sequence[int]],
+    rng: np.random.Generator,
+) -> List[Union[int, slice, np.ndarray]]:
+    # generate the indices that are read for each access pattern, these are generated
+    # ahead of time so that all configs are benchmarked on the same accesses
+    batches = []
+    if access_pattern == 'random':
+        batches = [int(i) for i in rng.integers(0, length, size=num_entries)]
+    elif access_pattern == 'random_batch':
+        while len(batches) * batch_size < num_entries:
+            # h5py requires fancy indices to be increasing and unique
+            batches.append(np.sort(rng.choice(length, size=min(batch_size, length), replace=False)))
+    elif access_pattern == 'sequential':
+        batches = [slice(i, i + batch_size) for i in range(0, min(num_entries, length), batch_size)]
+    elif access_pattern == 'traversal':
+        if factor_sizes is None:
+            raise ValueError('factor_sizes must be specified for the "traversal" access pattern')
+        state_space = StateSpace(factor_sizes=_truncated_factor_sizes(factor_sizes, max_len=length))
+        assert len(state_space) <= length
+        n = 0
+        while n < num_entries:
+            idxs = np.unique(state_space.pos_to_idx(state_space.sample_random_factor_traversal(rng=rng)))
+            batches.append(idxs)
+            n += len(idxs)
+    else:
+        raise KeyError(f'invalid access pattern: {repr(access_pattern)}, must be one of: {ACCESS_PATTERNS}')
+    return batches
+
+
+def _count_entries(batch: Union[int, slice, np.ndarray]) -> int:
+    if isinstance(batch, int):
+        return 1
+    elif isinstance(batch, slice):
+        return batch.stop - batch.start
+    return len(batch)
+
+
+# ========================================================================= #
+# Benchmark                                                                 #
+# ========================================================================= #
+
+
+def _write_candidate(path: str, inp_data, num: int, config: H5TuneConfig, batch_size: int = 1024) -> float:
+    t = time.perf_counter()
+    with h5py.File(path, 'w', libver='earliest') as out_h5:
+        out_data = out_h5.create_dataset(
+            name='data',
+            shape=(num, *inp_data.shape[1:]),
+            dtype=inp_data.dtype,
+            chunks=config.chunk_size,
+            compression=config.compression,
+            compression_opts=config.compression_lvl,
+            shuffle=config.shuffle,
+            track_times=False,
+        )
+        for i in range(0, num, batch_size):
+            out_data[i:min(i + batch_size, num)] = inp_data[i:min(i + batch_size, num)]
+    return time.perf_counter() - t
+
+
+def _read_candidate(path: str, batches: List[Union[int, slice, np.ndarray]], timeout: float) -> float:
+    n, t = 0, 0.
+    with h5py.File(path, 'r') as inp_h5:
+        data = inp_h5['data']
+        for batch in batches:
+            t0 = time.perf_counter()
+            data[batch]
+            t += time.perf_counter() - t0
+            n += _count_entries(batch)
+            if t > timeout:
+                break
+    return n / max(t, 1e-9)
+
+
+def default_chunk_sizes(obs_shape: Sequence[int], max_len: int, batch_lengths: Sequence[int] = (1, 4, 16, 64)) -> List[Tuple[int, ...]]:
+    """
+    Default chunk shapes, including chunks that span multiple observations,
+    and chunks that split observations along the channel dimension.
+    """
+    obs_shape = tuple(obs_shape)
+    chunk_sizes = [(b, *obs_shape) for b in batch_lengths if b <= max_len]
+    if (len(obs_shape) == 3) and (obs_shape[-1] > 1):
+        chunk_sizes.append((1, *obs_shape[:-1], 1))
+    return chunk_sizes
+
+
+def hdf5_autotune_chunks(
+    inp_data: Union[h5py.Dataset, np.ndarray],
+    access_pattern: AccessPattern = 'random',
+    factor_sizes: Optional[Sequence[int]] = None,
+    chunk_sizes: Optional[Sequence[Tuple[int, ...]]] = None,
+    compressions: Sequence[Tuple[Optional[str], Optional[int]]] = DEFAULT_COMPRESSIONS,
+    shuffles: Sequence[bool] = (False, True),
+    batch_size: int = 64,
+    max_entries: int = 10_000,
+    num_reads: int = 5_000,
+    timeout: float = 2.0,
+    temp_dir: Optional[str] = None,
+    show_report: bool = True,
+    rng: RngLike = None,
+) -> Tuple[H5TuneResult, List[H5TuneResult]]:
+    """
+    Benchmark the read throughput of all combinations of the candidate chunk shapes, compression
+    filters and shuffle filters, for the given access pattern. Only the first `max_entries`
+    observations of the dataset are re-saved for each config to keep benchmarking fast.
+
+    Access Patterns:
+    - 'random': single observations are read in a random order
+    - 'random_batch': sorted batches of `batch_size` random observations are read
+    - 'sequential': contiguous slices of `batch_size` observations are read in order
+    - 'traversal': all observations along a random factor traversal are read,
+                   requires the `factor_sizes` of the dataset to be given.
+
+    :return: the recommended config (the fastest, with ties broken by the smallest
+             size on disk) along with the results for all the configs.
+    """
+    rng = as_rng(rng)
+    # get the benchmark entries
+    num = min(len(inp_data), max_entries)
+    if chunk_sizes is None:
+        chunk_sizes = default_chunk_sizes(inp_data.shape[1:], max_len=num)
+    batches = _make_access_batches(access_pattern, length=num, num_entries=num_reads, batch_size=batch_size, factor_sizes=factor_sizes, rng=rng)
+    # check the configs, shuffle has no effect without compression
+    configs = []
+    for chunk_size, (compression, compression_lvl), shuffle in itertools.product(chunk_sizes, compressions, shuffles):
+        if (compression is None) and shuffle:
+            continue
+        assert len(chunk_size) == inp_data.ndim, f'chunk size: {chunk_size} does not match the number of dimensions of the data: {inp_data.ndim}'
+        configs.append(H5TuneConfig(chunk_size=tuple(int(c) for c in chunk_size), compression=compression, compression_lvl=compression_lvl, shuffle=bool(shuffle)))
+    # benchmark each config
+    results = []
+    with TemporaryDirectory(dir=temp_dir, prefix='disent_h5_tune_') as tmp_dir:
+        for i, config in enumerate(configs):
+            path = os.path.join(tmp_dir, f'candidate_{i}.h5')
+            write_sec = _write_candidate(path, inp_data, num=num, config=config)
+            entries_per_sec = _read_candidate(path, batches, timeout=timeout)
+            results.append(H5TuneResult(config=config, entries_per_sec=entries_per_sec, bytes_per_entry=os.path.getsize(path) / num, write_sec=write_sec))
+            os.remove(path)
+            log.debug(f'[{i+1}/{len(configs)}] {config}: {entries_per_sec:.1f} entries/s')
+    # sort the results from best to worst
+    results = sorted(results, key=lambda r: (-r.entries_per_sec, r.bytes_per_entry))
+    if show_report:
+        print(hdf5_autotune_report(results, access_pattern=access_pattern))
+    return results[0], results
+
+
+def hdf5_autotune_report(results: Sequence[H5TuneResult], access_pattern: Optional[str] = None) -> str:
+    rows = [('rank', 'chunks', 'compression', 'shuffle', 'entries/s', 'relative', 'size/entry', 'write (s)')]
+    best = max(r.entries_per_sec for r in results)
+    for i, r in enumerate(results):
+        c = r.config
+        rows.append((
+            f'{i+1}',
+            str(list(c.chunk_size)),
+            'none' if (c.compression is None) else (c.compression if (c.compression_lvl is None) else f'{c.compression}:{c.compression_lvl}'),
+            'yes' if c.shuffle else 'no',
+            f'{r.entries_per_sec:.1f}',
+            f'{r.entries_per_sec / best:.3f}',
+            bytes_to_human(r.bytes_per_entry, color=False),
+            f'{r.write_sec:.3f}',
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = [' | '.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+    lines.insert(1, '-+-'.join('-' * w for w in widths))
+    if access_pattern is not None:
+        lines.insert(0, f'[HDF5 AUTOTUNE] access pattern: {repr(access_pattern)}, recommended: {results[0].config}')
+    return '\n'.join(lines)
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
+
+
+if __name__ == '__main__':
+
+    def main():
+        from disent.dataset.data import XYObjectData
+        logging.basicConfig(level=logging.INFO)
+        gt_data = XYObjectData()
+        data = gt_data.get_observations(np.arange(len(gt_data)))
+        for access_pattern in ACCESS_PATTERNS:
+            hdf5_autotune_chunks(data, access_pattern=access_pattern, factor_sizes=gt_data.factor_sizes, timeout=0.5)
+
+    main()
+
+    # RESULTS: (XYObjectData, single core, top 3 per access pattern)
+    # 'random':
+    #   [1, 64, 64, 3]  | none   | 65978.4 entries/s | 12.064 KiB
+    #   [4, 64, 64, 3]  | none   | 45644.1 entries/s | 12.016 KiB
+    #   [1, 64, 64, 3]  | gzip:1 | 32988.3 entries/s | 172.599 B
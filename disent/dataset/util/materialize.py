@@ -0,0 +1,196 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+"""
+Run deterministic transforms (eg. `ToImgTensorF32(size=64)`) over an entire
+dataset once, saving the results as a memory-mappable file that is re-used on
+subsequent runs instead of re-running the transform every epoch.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any
+from typing import Callable
+from typing import List
+from typing import Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.data import Dataset
+
+from disent.dataset.util.mmap import mmap_save_batches
+from disent.util.inout.hashing import normalise_hash
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Hashing                                                                   #
+# ========================================================================= #
+
+
+def _datafile_hashes(gt_data) -> List[Any]:
+    # the hashes of the files that disk datasets are loaded from
+    hashes = []
+    for datafile in getattr(gt_data, 'datafiles', []):
+        file_hash = getattr(datafile, '_file_hash', None)
+        hash_mode = getattr(datafile, '_hash_mode', 'fast')
+        if isinstance(file_hash, dict):
+            file_hash = normalise_hash(file_hash, hash_mode=hash_mode)
+        hashes.append([datafile.out_name, file_hash])
+    return hashes
+
+
+def _fingerprint_observations(gt_data, num: int = 16) -> str:
+    # synthetic datasets have no datafiles, and datafiles may have unknown hashes,
+    # so we also hash a few of the raw observations spread over the dataset
+    idxs = np.unique(np.linspace(0, len(gt_data) - 1, num=min(num, len(gt_data))).astype('int64'))
+    return hashlib.md5(np.ascontiguousarray(gt_data.get_observations(idxs)).tobytes()).hexdigest()
+
+
+def transformed_data_key(gt_data, transform: Callable) -> str:
+    """
+    Get the key used to identify the transformed version of a dataset.
+    - depends on the `repr` of the transform, so transforms
+      should include all their parameters in their `repr`.
+    """
+    info = dict(
+        transform=repr(transform),
+        dataset_name=gt_data.name,
+        dataset_cls_name=gt_data.__class__.__name__,
+        factor_sizes=[int(s) for s in gt_data.factor_sizes],
+        img_shape=[int(s) for s in gt_data.img_shape],
+        datafiles=_datafile_hashes(gt_data),
+        fingerprint=_fingerprint_observations(gt_data),
+    )
+    return hashlib.md5(json.dumps(info, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# ========================================================================= #
+# Materialize                                                               #
+# ========================================================================= #
+
+
+class _TransformedView(Dataset):
+
+    def __init__(self, gt_data, transform: Callable):
+        self._gt_data = gt_data
+        self._transform = transform
+
+    def __len__(self):
+        return len(self._gt_data)
+
+    def __getitem__(self, idx):
+        return self.__getitems__([idx])[0]
+
+    def __getitems__(self, idxs: Sequence[int]) -> List[Any]:
+        return [self._transform(obs) for obs in self._gt_data.get_observations(idxs)]
+
+
+def _to_numpy(obs) -> np.ndarray:
+    if isinstance(obs, torch.Tensor):
+        return obs.detach().cpu().numpy()
+    return np.asarray(obs)
+
+
+def materialize_transformed(
+    gt_data,
+    transform: Callable,
+    path: str,
+    batch_size: int = 256,
+    num_workers: int = min(os.cpu_count() or 1, 16),
+    overwrite: bool = False,
+    show_progress: bool = True,
+):
+    """
+    Apply a deterministic transform to every observation of a `GroundTruthData`,
+    storing the results in a memory-mappable file inside the directory `path`.
+    - The file name is keyed by the dataset name and a hash of the transform `repr`,
+      the hashes of the dataset's datafiles and a fingerprint of the raw observations.
+      If the file already exists it is loaded instead of being re-generated.
+    - The transform is applied in parallel using a `DataLoader` with `num_workers`.
+    - The transform of `gt_data` itself is ignored, observations are read raw.
+
+    :return: a `MmapGroundTruthData` with no transform, returning the transformed
+             observations. Tensors are returned if the transform returns tensors.
+    """
+    from disent.dataset.data import GroundTruthData
+    from disent.dataset.data import MmapGroundTruthData
+    assert isinstance(gt_data, GroundTruthData), f'gt_data must be an instance of {repr(GroundTruthData.__name__)}, got: {repr(gt_data)}'
+    # get the file path
+    key = transformed_data_key(gt_data, transform)
+    out_path = os.path.join(path, f'{gt_data.name}_{key}.dmmap')
+    # load the existing file
+    if os.path.exists(out_path) and not overwrite:
+        log.info(f'loading materialized transformed dataset: {repr(gt_data.name)} with transform: {repr(transform)} from: {repr(out_path)}')
+        return MmapGroundTruthData(out_path)
+    # check the first observation, all transformed observations must have the same shape
+    example = transform(gt_data.get_observations([0])[0])
+    obs_type = 'torch' if isinstance(example, torch.Tensor) else 'numpy'
+    example = _to_numpy(example)
+    # get the image shape of transformed observations
+    img_shape = gt_data.img_shape
+    if (obs_type == 'torch') and (example.ndim == 3):
+        C, H, W = example.shape
+        img_shape = (H, W, C)
+    # generate all the batches in order
+    loader = DataLoader(_TransformedView(gt_data, transform), batch_size=batch_size, shuffle=False, num_workers=num_workers, drop_last=False)
+    batches = iter(loader)
+    def get_batch_fn(i: int, j: int) -> np.ndarray:
+        batch = _to_numpy(next(batches))
+        assert batch.shape == (j - i, *example.shape), f'transformed batch has shape: {batch.shape}, expected: {(j - i, *example.shape)}. The transform must return observations with the same shape.'
+        return batch
+    # save the file
+    os.makedirs(path, exist_ok=True)
+    log.info(f'materializing transformed dataset: {repr(gt_data.name)} with transform: {repr(transform)} to: {repr(out_path)}')
+    mmap_save_batches(
+        out_path=out_path,
+        get_batch_fn=get_batch_fn,
+        shape=(len(gt_data), *example.shape),
+        dtype=example.dtype,
+        # THESE ATTRIBUTES SHOULD MATCH: MmapGroundTruthData
+        attrs=dict(
+            dataset_name=gt_data.name,
+            dataset_cls_name=gt_data.__class__.__name__,
+            factor_sizes=[int(s) for s in gt_data.factor_sizes],
+            factor_names=list(gt_data.factor_names),
+            img_shape=[int(s) for s in img_shape],
+            obs_type=obs_type,
+            transform=repr(transform),
+            transform_key=key,
+        ),
+        batch_size=batch_size,
+        overwrite=overwrite,
+        show_progress=show_progress,
+    )
+    return MmapGroundTruthData(out_path)
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
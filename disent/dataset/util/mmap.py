@@ -0,0 +1,227 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2022 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+
+"""
+Utilities for saving and loading datasets in a simple memory-mappable format.
+
+Unlike compressed `.npz` or chunked `.h5` files, observations can be read
+directly from the page cache using `np.memmap` without any decompression.
+All the processes (eg. DataLoader workers) that open the same file thus
+share a single copy of the data in memory.
+
+File Layout:
+    1. magic string: `b'\x93DMMAP'` (6 bytes)
+    2. format version: major, minor (2 bytes)
+    3. length of the header: little endian uint32 (4 bytes)
+    4. utf-8 encoded json header, containing the dtype, shape & dataset attributes
+    5. padding up to the next multiple of `MMAP_ALIGN` bytes
+    6. contiguous C-order array data
+"""
+
+import json
+import logging
+import struct
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+from tqdm import tqdm
+
+from disent.util.inout.files import AtomicSaveFile
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Format                                                                    #
+# ========================================================================= #
+
+
+MMAP_MAGIC = b'\x93DMMAP'
+MMAP_VERSION = (1, 0)
+MMAP_ALIGN = 4096
+
+_PREFIX_FMT = '<6sBBI'
+_PREFIX_SIZE = struct.calcsize(_PREFIX_FMT)
+
+
+class MmapFormatError(Exception):
+    """
+    This error is thrown if a file is not a valid memory-mappable dataset file.
+    """
+
+
+def _make_header(header: Dict[str, Any]) -> bytes:
+    header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    prefix = struct.pack(_PREFIX_FMT, MMAP_MAGIC, *MMAP_VERSION, len(header_bytes))
+    # pad the header so that the data is page aligned
+    size = _PREFIX_SIZE + len(header_bytes)
+    padding = (MMAP_ALIGN - size % MMAP_ALIGN) % MMAP_ALIGN
+    return prefix + header_bytes + b'\x00' * padding
+
+
+def mmap_read_header(path: Union[str, Path]) -> Tuple[Dict[str, Any], int]:
+    """
+    Read the json header of a memory-mappable dataset file.
+    :return: the header and the offset of the data in the file
+    """
+    with open(path, 'rb') as fp:
+        prefix = fp.read(_PREFIX_SIZE)
+        if len(prefix) != _PREFIX_SIZE:
+            raise MmapFormatError(f'file is too small to be a memory-mappable dataset: {repr(str(path))}')
+        magic, major, minor, header_len = struct.unpack(_PREFIX_FMT, prefix)
+        if magic != MMAP_MAGIC:
+            raise MmapFormatError(f'file is not a memory-mappable dataset, invalid magic string: {repr(magic)} in file: {repr(str(path))}')
+        if major != MMAP_VERSION[0]:
+            raise MmapFormatError(f'unsupported memory-mappable dataset version: {major}.{minor}, expected: {MMAP_VERSION[0]}.x in file: {repr(str(path))}')
+        header = json.loads(fp.read(header_len).decode('utf-8'))
+    # get the offset of the data
+    size = _PREFIX_SIZE + header_len
+    offset = size + (MMAP_ALIGN - size % MMAP_ALIGN) % MMAP_ALIGN
+    return header, offset
+
+
+def mmap_open(path: Union[str, Path], mode: str = 'r') -> Tuple[np.memmap, Dict[str, Any]]:
+    """
+    Open the array contained in a memory-mappable dataset file.
+    - no data is read until the array is accessed
+    :return: the memory mapped array and the header
+    """
+    header, offset = mmap_read_header(path)
+    data = np.memmap(path, dtype=np.dtype(header['dtype']), mode=mode, offset=offset, shape=tuple(header['shape']), order='C')
+    return data, header
+
+
+# ========================================================================= #
+# Save                                                                      #
+# ========================================================================= #
+
+
+def mmap_save_batches(
+    out_path: Union[str, Path],
+    get_batch_fn,
+    shape: Tuple[int, ...],
+    dtype: Union[np.dtype, str] = 'uint8',
+    attrs: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1024,
+    overwrite: bool = False,
+    show_progress: bool = False,
+):
+    """
+    Save a memory-mappable dataset file, filling it with batches of data.
+    - `get_batch_fn(i, j)` should return an array of shape (j-i, *shape[1:])
+    - the file is written atomically
+    """
+    dtype = np.dtype(dtype)
+    header = _make_header(dict(
+        dtype=dtype.str,
+        shape=[int(s) for s in shape],
+        attrs=attrs if (attrs is not None) else {},
+    ))
+    # write the file
+    with AtomicSaveFile(out_path, overwrite=overwrite) as tmp_path:
+        with open(tmp_path, 'wb') as fp:
+            fp.write(header)
+            fp.truncate(len(header) + int(np.prod(shape)) * dtype.itemsize)
+        # fill the data
+        if shape[0] > 0:
+            data = np.memmap(tmp_path, dtype=dtype, mode='r+', offset=len(header), shape=tuple(shape), order='C')
+            with tqdm(total=shape[0], disable=not show_progress, desc=f'saving {Path(out_path).name}') as progress:
+                for i in range(0, shape[0], batch_size):
+                    j = min(i + batch_size, shape[0])
+                    data[i:j] = get_batch_fn(i, j)
+                    progress.update(j - i)
+            data.flush()
+            del data
+
+
+def mmap_save_array(
+    array: np.ndarray,
+    out_path: Union[str, Path],
+    attrs: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1024,
+    overwrite: bool = False,
+    show_progress: bool = False,
+):
+    """
+    Save any array-like object, eg. a numpy array or an h5py dataset, as a memory-mappable dataset file.
+    """
+    mmap_save_batches(
+        out_path=out_path,
+        get_batch_fn=lambda i, j: array[i:j],
+        shape=array.shape,
+        dtype=array.dtype,
+        attrs=attrs,
+        batch_size=batch_size,
+        overwrite=overwrite,
+        show_progress=show_progress,
+    )
+
+
+def mmap_save_gt_data(
+    gt_data,
+    out_path: Union[str, Path],
+    batch_size: int = 1024,
+    overwrite: bool = False,
+    show_progress: bool = True,
+):
+    """
+    Convert any `GroundTruthData` into a memory-mappable dataset file that can be loaded with `MmapGroundTruthData`.
+    - untransformed observations are saved, they should have the shape (H, W, C) and the dtype uint8
+    """
+    from disent.dataset.data import GroundTruthData
+    assert isinstance(gt_data, GroundTruthData), f'gt_data must be an instance of {repr(GroundTruthData.__name__)}, got: {repr(gt_data)}'
+    # check the first observation
+    obs = gt_data.get_observations([0])
+    assert obs.shape[1:] == tuple(gt_data.img_shape), f'observation shape: {obs.shape[1:]} does not match the img_shape: {tuple(gt_data.img_shape)} of: {repr(gt_data.name)}'
+    assert obs.dtype == 'uint8', f'observations must have the dtype uint8, got: {obs.dtype} from: {repr(gt_data.name)}'
+    # save the observations
+    mmap_save_batches(
+        out_path=out_path,
+        get_batch_fn=lambda i, j: gt_data.get_observations(np.arange(i, j)),
+        shape=(len(gt_data), *gt_data.img_shape),
+        dtype='uint8',
+        # THESE ATTRIBUTES SHOULD MATCH: MmapGroundTruthData
+        attrs=dict(
+            dataset_name=gt_data.name,
+            dataset_cls_name=gt_data.__class__.__name__,
+            factor_sizes=[int(s) for s in gt_data.factor_sizes],
+            factor_names=list(gt_data.factor_names),
+        ),
+        batch_size=batch_size,
+        overwrite=overwrite,
+        show_progress=show_progress,
+    )
+    log.debug(f'saved memory-mappable version of: {repr(gt_data.name)} to: {repr(str(out_path))}')
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
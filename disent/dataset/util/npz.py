@@ -22,6 +22,10 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import zipfile
+from typing import Optional
+from typing import Tuple
+
 import numpy as np
 from tqdm import tqdm
 from disent.util.inout.files import AtomicSaveFile
@@ -72,6 +76,112 @@ def save_resized_dataset_array(array: np.ndarray, out_file: str, size: int = 64,
         np.savez_compressed(temp_file, **{save_key: converted})
 
 
+# ========================================================================= #
+# Stream Numpy Files                                                        #
+# ========================================================================= #
+
+
+class NpzArrayReader(object):
+    """
+    Read-only array-like that streams an array from a `.npy` file, or from
+    an entry in a (possibly compressed) `.npz` archive, without ever loading
+    the full array into memory. For example this can be passed to
+    `hdf5_resave_file` to convert very large datasets to chunked hdf5 files.
+
+    - only contiguous slices along the first dimension are supported
+    - sequential reads are fast, other reads need to seek within the file,
+      which is very slow for compressed archives as the stream needs to be
+      decompressed from the start again.
+    """
+
+    def __init__(self, path: str, key: Optional[str] = None):
+        self._path = path
+        self._key = key
+        # open the file, .npz files are zip archives
+        if zipfile.is_zipfile(path):
+            if key is None:
+                raise ValueError(f'a key must be specified to read an array from the .npz file: {repr(path)}')
+            self._zip = zipfile.ZipFile(path, 'r')
+            self._file = self._zip.open(f'{key}.npy', 'r')
+        else:
+            if key is not None:
+                raise ValueError(f'a key cannot be specified when reading a .npy file: {repr(path)}')
+            self._zip = None
+            self._file = open(path, 'rb')
+        # read the header
+        try:
+            self._shape, self._dtype = self._read_header()
+        except Exception:
+            self.close()
+            raise
+        self._offset = self._pos = self._file.tell()
+        self._obs_nbytes = int(np.prod(self._shape[1:], dtype='int64')) * self._dtype.itemsize
+
+    def _read_header(self) -> Tuple[Tuple[int, ...], np.dtype]:
+        version = np.lib.format.read_magic(self._file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self._file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(self._file)
+        if fortran_order:
+            raise ValueError(f'fortran ordered arrays are not supported: {repr(self._path)}')
+        if dtype.hasobject:
+            raise ValueError(f'arrays containing python objects are not supported: {repr(self._path)}')
+        if len(shape) < 1:
+            raise ValueError(f'scalar arrays are not supported: {repr(self._path)}')
+        return tuple(shape), dtype
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    def __len__(self):
+        return self._shape[0]
+
+    def __getitem__(self, item) -> np.ndarray:
+        # normalise the index
+        if isinstance(item, (int, np.integer)):
+            return self[item:item+1 if (item != -1) else None][0]
+        if not isinstance(item, slice):
+            raise TypeError(f'{self.__class__.__name__} only supports integer and slice indices, got: {type(item)}')
+        start, stop, step = item.indices(len(self))
+        if step != 1:
+            raise ValueError(f'{self.__class__.__name__} only supports contiguous slices, got step: {step}')
+        stop = max(start, stop)
+        # seek if this is not a sequential read
+        if start != self._pos:
+            self._file.seek(self._offset + start * self._obs_nbytes)
+        # read the data, zip files can return fewer bytes than requested
+        nbytes = (stop - start) * self._obs_nbytes
+        buffer = bytearray(nbytes)
+        view, n = memoryview(buffer), 0
+        while n < nbytes:
+            read = self._file.readinto(view[n:])
+            if not read:
+                raise EOFError(f'unexpected end of file: {repr(self._path)}')
+            n += read
+        self._pos = stop
+        return np.frombuffer(buffer, dtype=self._dtype).reshape(stop - start, *self._shape[1:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
@@ -0,0 +1,154 @@
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+#  MIT License
+#
+#  Copyright (c) 2021 Nathan Juraj Michlo
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+
+
+"""
+Prepare datafiles and datasets concurrently.
+
+Preparing a datafile usually involves hashing, retrieving (downloading or copying)
+and generating files. Each datafile holds a file lock while it is prepared, see
+`DataFileHashed.prepare`, so that multiple threads, processes or nodes that share
+the same data directory never prepare the same file at the same time.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from functools import partial
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+from disent.dataset.util.datafile import DataFile
+from disent.util.inout.paths import ensure_dir_exists
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================================= #
+# Scheduler                                                                 #
+# ========================================================================= #
+
+
+def _run_jobs(executor: Executor, jobs: Dict[str, Callable[[], Any]], desc: str, show_progress: bool) -> Dict[str, Any]:
+    # submit all the jobs
+    t = time.time()
+    futures: Dict[Future, str] = {executor.submit(fn): name for name, fn in jobs.items()}
+    # wait for the jobs to complete
+    results, errors = {}, {}
+    progress = None
+    if show_progress:
+        from tqdm import tqdm
+        progress = tqdm(total=len(futures), desc=desc)
+    try:
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                log.info(f'[{desc}] finished: {name} after {time.time() - t:.1f}s')
+            except Exception as e:
+                errors[name] = e
+                log.error(f'[{desc}] failed: {name} after {time.time() - t:.1f}s with error: {repr(e)}')
+            if progress is not None:
+                progress.update()
+    finally:
+        if progress is not None:
+            progress.close()
+    # raise the first error
+    if errors:
+        name, error = next(iter(errors.items()))
+        raise RuntimeError(f'[{desc}] {len(errors)} of {len(futures)} jobs failed, the first failed job was: {name}') from error
+    # return in the same order as the jobs
+    return {name: results[name] for name in jobs}
+
+
+def prepare_datafiles(
+    datafiles: Sequence[DataFile],
+    out_dir: str,
+    num_workers: int = 4,
+    show_progress: bool = False,
+) -> List[str]:
+    """
+    Prepare multiple datafiles into the same directory concurrently.
+    - A thread pool is used, the work is mostly IO bound or is performed by
+      libraries that release the GIL, and datafiles do not need to be picklable.
+    - Datafiles that depend on the same files are safe to prepare concurrently,
+      the shared files are locked while they are prepared.
+
+    :return: the paths to the prepared files, in the same order as the datafiles
+    """
+    ensure_dir_exists(out_dir)
+    # prepare sequentially
+    if (num_workers <= 1) or (len(datafiles) <= 1):
+        return [datafile.prepare(out_dir) for datafile in datafiles]
+    # prepare concurrently
+    jobs = {f'{i}: {datafile}': (lambda d=datafile: d.prepare(out_dir)) for i, datafile in enumerate(datafiles)}
+    with ThreadPoolExecutor(max_workers=min(num_workers, len(jobs))) as executor:
+        results = _run_jobs(executor, jobs, desc='preparing datafiles', show_progress=show_progress)
+    return list(results.values())
+
+
+def _prepare_dataset(make_data: Callable[[], Any]) -> str:
+    data = make_data()
+    return getattr(data, 'data_dir', None)
+
+
+def prepare_datasets(
+    make_data_fns: Sequence[Callable[[], Any]],
+    num_workers: int = min(os.cpu_count() or 1, 4),
+    show_progress: bool = True,
+) -> List[Optional[str]]:
+    """
+    Prepare multiple datasets concurrently, each in its own process from a
+    bounded process pool. Each function should instantiate a dataset that prepares
+    its own datafiles, for example `functools.partial(Shapes3dData, prepare=True)`.
+    Functions must be picklable, and the datasets are discarded after preparation.
+    - The datafiles of each dataset are also prepared concurrently, see `prepare_datafiles`.
+    - Datasets that share datafiles, or that are prepared by other processes or nodes
+      at the same time are safe, the datafiles are locked while they are prepared.
+
+    :return: the data directories of the prepared datasets, in the same order as the functions
+    """
+    # prepare sequentially
+    if (num_workers <= 1) or (len(make_data_fns) <= 1):
+        return [_prepare_dataset(fn) for fn in make_data_fns]
+    # prepare concurrently
+    jobs = {f'{i}: {fn}': partial(_prepare_dataset, fn) for i, fn in enumerate(make_data_fns)}
+    with ProcessPoolExecutor(max_workers=min(num_workers, len(jobs))) as executor:
+        results = _run_jobs(executor, jobs, desc='preparing datasets', show_progress=show_progress)
+    return list(results.values())
+
+
+# ========================================================================= #
+# END                                                                       #
+# ========================================================================= #
@@ -23,6 +23,12 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import logging
+from typing import Any
+from typing import List
+from typing import Sequence
+
+import numpy as np
+import torch
 from torch.utils.data import Dataset
 from disent.dataset.data import GroundTruthData
 
@@ -53,6 +59,51 @@ class WrappedDataset(Dataset):
         return self.data
 
 
+# ========================================================================= #
+# Indexed Dataset                                                           #
+# ========================================================================= #
+
+
+def compact_indices(indices, length: int) -> np.ndarray:
+    """
+    Store the indices of a dataset with the given length using
+    uint32 if possible, halving the memory usage compared to int64.
+    """
+    dtype = np.uint32 if (length <= 2**32) else np.int64
+    return np.asarray(indices).astype(dtype, copy=False)
+
+
+class _IndexedWrappedDataset(WrappedDataset):
+    """
+    Base class for wrappers that select observations from the wrapped dataset,
+    the subclass should set `self._indices` to the indices of the selected observations.
+    - batches of indices are translated at once, and read from the
+      wrapped dataset with `__getitems__` if it is supported.
+    """
+
+    _indices: np.ndarray
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, idx):
+        return self.data[int(self._indices[idx])]
+
+    def translate_indices(self, idxs) -> np.ndarray:
+        """
+        Convert indices into this dataset to the indices of the wrapped dataset.
+        """
+        return self._indices[np.asarray(idxs)].astype(np.int64)
+
+    def __getitems__(self, idxs: Sequence[int]) -> List[Any]:
+        data, idxs = self.data, self.translate_indices(idxs)
+        if hasattr(data, '__getitems__'):
+            return data.__getitems__(idxs)
+        if isinstance(data, (np.ndarray, torch.Tensor)):
+            return list(data[idxs])
+        return [data[idx] for idx in idxs.tolist()]
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
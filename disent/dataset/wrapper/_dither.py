@@ -28,7 +28,8 @@ from torch.utils.data import Dataset
 
 from disent.dataset.data import GroundTruthData
 from disent.dataset.util.state_space import StateSpace
-from disent.dataset.wrapper._base import WrappedDataset
+from disent.dataset.wrapper._base import _IndexedWrappedDataset
+from disent.dataset.wrapper._base import compact_indices
 from disent.util.math.dither import nd_dither_matrix
 
 
@@ -40,39 +41,29 @@ log = logging.getLogger(__name__)
 # ========================================================================= #
 
 
-class DitheredDataset(WrappedDataset):
+class DitheredDataset(_IndexedWrappedDataset):
 
-    def __init__(self, gt_data: GroundTruthData, dither_n: int = 2, keep_ratio: float = 1):
+    def __init__(self, gt_data: GroundTruthData, dither_n: int = 2, keep_ratio: float = 1, block_size: int = 2**16):
         assert 0 < keep_ratio <= 1.0
         assert isinstance(gt_data, GroundTruthData)
         # -~-~-~-~-~-~-~-~-~-~-~-~-~-~- #
         self._gt_data = gt_data
-        # data space
-        data_idx = np.arange(len(gt_data))
-        data_pos = gt_data.idx_to_pos(data_idx)
         # dmat space
         d_mat = nd_dither_matrix(n=dither_n, d=self._gt_data.num_factors, norm=True) < keep_ratio
         d_states = StateSpace(d_mat.shape)
-        # data space to dmat space
-        dmat_pos = data_pos % dither_n
-        dmat_idx = d_states.pos_to_idx(dmat_pos)
-        mask = d_mat.flatten()[dmat_idx]
-        # convert mask to indices
-        self._indices = np.arange(len(gt_data))[mask]
+        d_mask = d_mat.flatten()
+        # convert mask to indices, the positions of the data are computed
+        # in blocks so that they are never all held in memory at once
+        blocks = []
+        for i in range(0, len(gt_data), block_size):
+            data_idx = np.arange(i, min(i + block_size, len(gt_data)))
+            # data space to dmat space
+            dmat_idx = d_states.pos_to_idx(gt_data.idx_to_pos(data_idx) % dither_n)
+            blocks.append(compact_indices(data_idx[d_mask[dmat_idx]], len(gt_data)))
+        self._indices = np.concatenate(blocks)
         # -~-~-~-~-~-~-~-~-~-~-~-~-~-~- #
         assert len(self._indices) > 0
-        # check values & count compared to ratio
-        unique_count_map = {False: 0, True: 0, **{u: c for u, c in zip(*np.unique(mask, return_counts=True))}}
-        assert len(unique_count_map) == 2
-        assert unique_count_map[True] > 0
-        assert sum(unique_count_map.values()) == len(gt_data)
-        log.info(f'[n={dither_n}] keep ratio: {keep_ratio:.2f} actual ratio: {unique_count_map[True] / sum(unique_count_map.values()):.2f}')
-
-    def __len__(self):
-        return len(self._indices)
-
-    def __getitem__(self, item):
-        return self._gt_data[self._indices[item]]
+        log.info(f'[n={dither_n}] keep ratio: {keep_ratio:.2f} actual ratio: {len(self._indices) / len(gt_data):.2f}')
 
     @property
     def data(self) -> Dataset:
@@ -30,7 +30,8 @@ import torch
 from torch.utils.data import Dataset
 
 from disent.dataset.data import GroundTruthData
-from disent.dataset.wrapper._base import WrappedDataset
+from disent.dataset.wrapper._base import _IndexedWrappedDataset
+from disent.dataset.wrapper._base import compact_indices
 from disent.util.math.random import random_choice_prng
 
 
@@ -56,7 +57,7 @@ def load_mask_indices(length: int, mask_or_indices: MaskTypeHint):
     if mask_or_indices.dtype == 'bool':
         # boolean values
         assert length == len(mask_or_indices)
-        indices = np.arange(length)[mask_or_indices]
+        indices = np.flatnonzero(mask_or_indices)
     else:
         # integer values
         assert len(np.unique(mask_or_indices)) == len(mask_or_indices)
@@ -67,10 +68,10 @@ def load_mask_indices(length: int, mask_or_indices: MaskTypeHint):
     assert len(indices) > 0
     assert len(indices) <= length
     # return values
-    return indices
+    return compact_indices(indices, length)
 
 
-class MaskedDataset(WrappedDataset):
+class MaskedDataset(_IndexedWrappedDataset):
 
     def __init__(self, data: DataTypeHint, mask: MaskTypeHint, randomize: bool = False):
         assert isinstance(data, (GroundTruthData, torch.Tensor, np.ndarray))
@@ -85,12 +86,6 @@ class MaskedDataset(WrappedDataset):
             assert len(self._indices) == l
             log.info(f'replaced mask: {l}/{n} ({l/n:.3f}) with randomized mask!')
 
-    def __len__(self):
-        return len(self._indices)
-
-    def __getitem__(self, idx):
-        return self._data[self._indices[idx]]
-
     @property
     def data(self) -> Dataset:
         return self._data
@@ -157,6 +157,8 @@ class DisentFramework(DisentConfigurable, DisentLightningModule):
     def _compute_loss_step(self, batch, batch_idx, update_schedules: bool):
         try:
             # augment batch with GPU support
+            # - this may also convert uint8 observations to float32 on the device, which
+            #   reduces dataloader transfers, see: `DisentDatasetTransform(normalize=...)`
             if self._batch_augment is not None:
                 batch = self._batch_augment(batch)
             # update the config values based on registered schedules
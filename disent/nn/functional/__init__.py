@@ -24,6 +24,8 @@
 
 from disent.nn.functional._conv2d import torch_conv2d_channel_wise
 from disent.nn.functional._conv2d import torch_conv2d_channel_wise_fft
+from disent.nn.functional._conv2d import torch_conv2d_channel_wise_fft_spectrum
+from disent.nn.functional._conv2d import torch_fft_kernel_spectrum
 
 from disent.nn.functional._conv2d_kernels import get_kernel_size
 from disent.nn.functional._conv2d_kernels import torch_gaussian_kernel
@@ -59,23 +59,39 @@ def torch_conv2d_channel_wise(signal, kernel):
     return out.reshape(-1, signal.shape[1], *out.shape[2:])
 
 
-def torch_conv2d_channel_wise_fft(signal, kernel):
+def _fft_padded_shape(sig_hw, ker_hw):
+    return tuple(int(s + k - 1) for s, k in zip(sig_hw, ker_hw))
+
+
+def torch_fft_kernel_spectrum(kernel, signal_shape):
     """
-    The same as torch_conv2d_channel_wise, but apply the kernel using fft.
-    This is much more efficient for large filter sizes.
+    Compute the spectrum of the kernel used by `torch_conv2d_channel_wise_fft`
+    for signals with the given shape. Kernels that are re-used many times can
+    have their spectrum cached, and applied with `torch_conv2d_channel_wise_fft_spectrum`
+    """
+    if kernel.ndim == 2:
+        kernel = kernel[None, None, ...]
+    return torch.fft.rfft2(kernel, s=_fft_padded_shape(signal_shape[-2:], kernel.shape[-2:]))
 
-    Reference implementation is from: https://github.com/pyro-ppl/pyro/blob/ae55140acfdc6d4eade08b434195234e5ae8c261/pyro/ops/tensor_utils.py#L187
+
+def torch_conv2d_channel_wise_fft_spectrum(signal, kernel_spectrum, kernel_hw):
     """
-    signal, kernel = _check_conv2d_inputs(signal, kernel)
+    The same as `torch_conv2d_channel_wise_fft`, but the spectrum of the
+    kernel is given instead, see: `torch_fft_kernel_spectrum`
+    - kernel_hw is the (height, width) of the original kernel, which must be odd.
+    """
+    assert signal.ndim == 4, f'signal has {repr(signal.ndim)} dimensions, must have 4 dimensions instead: BxCxHxW'
+    kh, kw = kernel_hw
+    assert kh % 2 != 0 and kw % 2 != 0, f'kernel dimension sizes must be odd: ({kh}, {kw})'
     # get last dimension sizes
     sig_shape = np.array(signal.shape[-2:])
-    ker_shape = np.array(kernel.shape[-2:])
+    ker_shape = np.array(kernel_hw)
     # compute padding
     padded_shape = sig_shape + ker_shape - 1
+    assert tuple(kernel_spectrum.shape[-2:]) == (padded_shape[0], padded_shape[1] // 2 + 1), f'kernel spectrum has incorrect shape: {tuple(kernel_spectrum.shape)} for signal: {tuple(signal.shape)} and kernel size: {tuple(kernel_hw)}'
     # Compute convolution using fft.
     f_signal = torch.fft.rfft2(signal, s=tuple(padded_shape))
-    f_kernel = torch.fft.rfft2(kernel, s=tuple(padded_shape))
-    result = torch.fft.irfft2(f_signal * f_kernel, s=tuple(padded_shape))
+    result = torch.fft.irfft2(f_signal * kernel_spectrum, s=tuple(padded_shape))
     # crop final result
     s = (padded_shape - sig_shape) // 2
     f = s + sig_shape
@@ -84,6 +100,19 @@ def torch_conv2d_channel_wise_fft(signal, kernel):
     return crop
 
 
+def torch_conv2d_channel_wise_fft(signal, kernel):
+    """
+    The same as torch_conv2d_channel_wise, but apply the kernel using fft.
+    This is much more efficient for large filter sizes.
+
+    Reference implementation is from: https://github.com/pyro-ppl/pyro/blob/ae55140acfdc6d4eade08b434195234e5ae8c261/pyro/ops/tensor_utils.py#L187
+    """
+    signal, kernel = _check_conv2d_inputs(signal, kernel)
+    # Compute convolution using fft.
+    f_kernel = torch_fft_kernel_spectrum(kernel, signal.shape)
+    return torch_conv2d_channel_wise_fft_spectrum(signal, f_kernel, kernel.shape[-2:])
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
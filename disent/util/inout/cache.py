@@ -23,6 +23,7 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import logging
+import os
 from functools import wraps
 from typing import Callable
 from typing import Dict
@@ -47,6 +48,10 @@ class stalefile(object):
     """
     decorator that only runs the wrapped function if a
     file does not exist, or its hash does not match.
+    - if the hash is `None`, then only the existence of the file is checked,
+      this is useful for generated files whose hashes are not yet known.
+    - if `cache=True`, computed hashes are stored in a sidecar file and re-used
+      until the file changes, see `hash_file`. Set `force=True` to ignore the cache.
     """
 
     def __init__(
@@ -55,11 +60,15 @@ class stalefile(object):
         hash: Optional[Union[str, Dict[str, str]]],
         hash_type: str = 'md5',
         hash_mode: str = 'fast',
+        cache: bool = True,
+        force: bool = False,
     ):
         self.file = file
         self.hash = normalise_hash(hash=hash, hash_mode=hash_mode)
         self.hash_type = hash_type
         self.hash_mode = hash_mode
+        self.cache = cache
+        self.force = force
 
     def __call__(self, func: Callable[[str], NoReturn]) -> Callable[[], str]:
         @wraps(func)
@@ -67,14 +76,23 @@ class stalefile(object):
             if self.is_stale():
                 log.debug(f'calling wrapped function: {func} because the file is stale: {repr(self.file)}')
                 func(self.file)
-                validate_file_hash(self.file, hash=self.hash, hash_type=self.hash_type, hash_mode=self.hash_mode)
+                if self.hash is not None:
+                    validate_file_hash(self.file, hash=self.hash, hash_type=self.hash_type, hash_mode=self.hash_mode, cache=self.cache)
+                elif not os.path.exists(self.file):
+                    raise FileNotFoundError(f'wrapped function: {func} did not generate the file: {repr(self.file)}')
             else:
                 log.debug(f'skipped wrapped function: {func} because the file is fresh: {repr(self.file)}')
             return self.file
         return wrapper
 
     def is_stale(self):
-        fhash = hash_file(file=self.file, hash_type=self.hash_type, hash_mode=self.hash_mode, missing_ok=True)
+        if self.hash is None:
+            if not os.path.exists(self.file):
+                log.info(f'file is stale because it does not exist: {repr(self.file)}')
+                return True
+            log.debug(f'file is fresh because it exists and no target hash was given: {repr(self.file)}')
+            return False
+        fhash = hash_file(file=self.file, hash_type=self.hash_type, hash_mode=self.hash_mode, missing_ok=True, cache=self.cache, force=self.force)
         if not fhash:
             log.info(f'file is stale because it does not exist: {repr(self.file)}')
             return True
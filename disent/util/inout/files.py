@@ -24,8 +24,14 @@
 
 import logging
 import os
+import threading
+import time
 from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 from uuid import uuid4
 
@@ -136,27 +142,410 @@ class AtomicSaveFile(object):
         os.rename(self.tmp_file, self.trg_file)
 
 
+# ========================================================================= #
+# File locking                                                              #
+# ========================================================================= #
+
+
+_THREAD_LOCKS: Dict[str, threading.Lock] = {}
+_THREAD_LOCKS_LOCK = threading.Lock()
+
+
+def _get_thread_lock(path: str) -> threading.Lock:
+    with _THREAD_LOCKS_LOCK:
+        if path not in _THREAD_LOCKS:
+            _THREAD_LOCKS[path] = threading.Lock()
+        return _THREAD_LOCKS[path]
+
+
+class FileLock(object):
+    """
+    Exclusive lock over a file, shared between threads, processes, and nodes
+    that share the same file system. A hidden lock file is created next to the
+    target file, and locked with `fcntl.lockf`, which is also supported by
+    network file systems like NFS. The lock file is not deleted afterwards.
+
+    ```
+    with FileLock('data/file.h5'):
+        if not os.path.exists('data/file.h5'):
+            generate('data/file.h5')
+    ```
+    """
+
+    def __init__(
+        self,
+        file: Union[str, Path],
+        timeout: Optional[float] = None,
+        poll_interval: float = 0.5,
+    ):
+        file = Path(file).absolute()
+        self.lock_file = str(file.parent.joinpath(f'.{file.name}.lock'))
+        self._timeout = timeout
+        self._poll_interval = poll_interval
+        self._fd = None
+        self._thread_lock = None
+
+    def __enter__(self):
+        t = time.time()
+        # fcntl locks are held by processes, threads need their own lock
+        thread_lock = _get_thread_lock(self.lock_file)
+        if not thread_lock.acquire(timeout=-1 if (self._timeout is None) else self._timeout):
+            raise TimeoutError(f'could not acquire lock: {repr(self.lock_file)} within {self._timeout} seconds')
+        self._thread_lock = thread_lock
+        try:
+            self._fd = self._acquire_file_lock(timeout=None if (self._timeout is None) else max(0., self._timeout - (time.time() - t)))
+        except:
+            self._thread_lock.release()
+            self._thread_lock = None
+            raise
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if self._fd is not None:
+            try:
+                import fcntl
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            except ImportError:  # pragma: no cover
+                pass
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+        self._thread_lock = None
+
+    def _acquire_file_lock(self, timeout: Optional[float]) -> Optional[int]:
+        try:
+            import fcntl
+        except ImportError:  # pragma: no cover
+            log.warning(f'file locks are not supported on this platform, only threads are excluded from: {repr(self.lock_file)}')
+            return None
+        os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o666)
+        t, waiting = time.time(), False
+        while True:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if waiting:
+                    log.info(f'acquired lock: {repr(self.lock_file)} after waiting {time.time() - t:.1f} seconds')
+                return fd
+            except OSError:
+                pass
+            if (timeout is not None) and (time.time() - t >= timeout):
+                os.close(fd)
+                raise TimeoutError(f'could not acquire lock: {repr(self.lock_file)} within {timeout} seconds')
+            if not waiting:
+                log.info(f'waiting for lock held by another process: {repr(self.lock_file)}')
+                waiting = True
+            time.sleep(self._poll_interval)
+
+
 # ========================================================================= #
 # files/dirs exist                                                          #
 # ========================================================================= #
 
 
-def download_file(url: str, save_path: str, overwrite_existing: bool = False, chunk_size: int = 16384):
+class _DownloadError(IOError):
+    """
+    Raised if a server response is incomplete or invalid, downloads are retried.
+    """
+
+
+class _RangesUnsupportedError(_DownloadError):
+    """
+    Raised if a server ignores range requests even though it advertised
+    support for them, eg. after a redirect. Downloads fall back to streaming.
+    """
+
+
+class _WrittenFileHasher(object):
+    """
+    Incrementally hash a file while it is written out of order by multiple threads.
+    - A background thread follows the contiguous prefix of written bytes,
+      reading them back while they are still in the page cache, so that the
+      file does not need to be re-read from disk to be validated afterwards.
+    """
+
+    def __init__(self, file: str, hash_type: str, chunk_size: int = 2**20):
+        import hashlib
+        self._file = file
+        self._hash = hashlib.new(hash_type)
+        self._chunk_size = chunk_size
+        self._pos = 0
+        self._ranges: Dict[int, int] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def written(self, start: int, end: int):
+        if end > start:
+            with self._cond:
+                self._ranges[start] = end
+                self._cond.notify()
+
+    def _run(self):
+        try:
+            # unbuffered, otherwise stale read-ahead bytes could be returned
+            with open(self._file, 'rb', buffering=0) as f:
+                while True:
+                    with self._cond:
+                        self._cond.wait_for(lambda: self._closed or (self._pos in self._ranges))
+                        if self._pos not in self._ranges:
+                            return
+                        start, end = self._pos, self._ranges.pop(self._pos)
+                    # read back the written bytes outside the lock
+                    f.seek(start)
+                    while start < end:
+                        data = f.read(min(self._chunk_size, end - start))
+                        if not data:
+                            raise EOFError(f'could not read back written bytes from: {repr(self._file)}')
+                        self._hash.update(data)
+                        start += len(data)
+                    with self._cond:
+                        self._pos = end
+        except BaseException as e:
+            self._error = e
+
+    def close(self, size: Optional[int] = None) -> Optional[str]:
+        """
+        Stop hashing, if the `size` is given, the hash of the
+        first `size` bytes is returned, otherwise `None`.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if size is None:
+            return None
+        if self._error is not None:
+            raise self._error
+        if self._pos != size:
+            raise _DownloadError(f'only hashed {self._pos} of {size} bytes from: {repr(self._file)}')
+        return self._hash.hexdigest()
+
+
+def _get_download_info(url: str, timeout: float) -> Tuple[Optional[int], Optional[str]]:
+    # returns the size and version of the file, or `None` if range requests are not supported
     import requests
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=timeout, headers={'Accept-Encoding': 'identity'})
+    except requests.RequestException as e:
+        log.warning(f'could not get download information for: {url}, reason: {e}')
+        return None, None
+    if (not response.ok) or (response.headers.get('Accept-Ranges', '').lower() != 'bytes') or ('Content-Length' not in response.headers):
+        return None, None
+    return int(response.headers['Content-Length']), response.headers.get('ETag', response.headers.get('Last-Modified', None))
+
+
+def _write_all(f, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[f.write(view):]
+
+
+def _download_segment(
+    url: str,
+    file: str,
+    segment: List[int],
+    on_write: Callable[[int, int], None],
+    chunk_size: int,
+    timeout: float,
+    max_retries: int,
+    retry_delay: float,
+):
+    """
+    Download the bytes of the segment `[start, end, pos]` to the same location
+    in the file, starting from `pos`. The `pos` is updated in-place as bytes are
+    written, so that failed downloads can be resumed from where they stopped.
+    """
+    import requests
+    start, end = segment[0], segment[1]
+    retries = 0
+    with open(file, 'r+b', buffering=0) as f:
+        while segment[2] < end:
+            try:
+                headers = {'Range': f'bytes={segment[2]}-{end - 1}', 'Accept-Encoding': 'identity'}
+                with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                    if response.status_code == 200:
+                        raise _RangesUnsupportedError(f'server ignored the range request for bytes {segment[2]}-{end - 1}')
+                    if response.status_code != 206:
+                        raise _DownloadError(f'expected partial content, got status code: {response.status_code}')
+                    for data in response.iter_content(chunk_size=chunk_size):
+                        data = data[:end - segment[2]]
+                        f.seek(segment[2])
+                        _write_all(f, data)
+                        on_write(segment[2], segment[2] + len(data))
+                        segment[2] += len(data)
+                        retries = 0
+                        if segment[2] >= end:
+                            break
+                if segment[2] < end:
+                    raise _DownloadError(f'connection closed after receiving {segment[2] - start} of {end - start} bytes')
+            except _RangesUnsupportedError:
+                raise
+            except (requests.RequestException, _DownloadError) as e:
+                retries += 1
+                if retries > max_retries:
+                    raise
+                log.warning(f'retrying download of bytes {segment[2]}-{end - 1} from: {url} ({retries}/{max_retries}), reason: {e}')
+                time.sleep(retry_delay * 2 ** (retries - 1))
+
+
+def _download_stream(
+    url: str,
+    file: str,
+    on_write: Callable[[int, int], None],
+    on_restart: Callable[[], None],
+    chunk_size: int,
+    timeout: float,
+    max_retries: int,
+    retry_delay: float,
+) -> int:
+    # fallback if the server does not support range requests, failed downloads restart from zero
+    import requests
+    retries = 0
+    while True:
+        try:
+            with open(file, 'wb', buffering=0) as f, requests.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                total = response.headers.get('content-length')
+                pos = 0
+                for data in response.iter_content(chunk_size=chunk_size):
+                    _write_all(f, data)
+                    on_write(pos, pos + len(data))
+                    pos += len(data)
+            if (total is not None) and (response.headers.get('content-encoding') is None) and (pos != int(total)):
+                raise _DownloadError(f'connection closed after receiving {pos} of {total} bytes')
+            return pos
+        except (requests.RequestException, _DownloadError) as e:
+            retries += 1
+            if retries > max_retries:
+                raise
+            log.warning(f'restarting download from: {url} ({retries}/{max_retries}), reason: {e}')
+            time.sleep(retry_delay * 2 ** (retries - 1))
+            on_restart()
+
+
+def download_file(
+    url: str,
+    save_path: str,
+    overwrite_existing: bool = False,
+    chunk_size: int = 2**20,
+    num_segments: int = 4,
+    min_segment_size: int = 2**23,
+    max_retries: int = 5,
+    retry_delay: float = 1.0,
+    timeout: float = 60,
+    hash_type: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Download a file from a url.
+    - If the server supports range requests, the file is split into `num_segments`
+      segments that are downloaded in parallel, each segment is retried up to
+      `max_retries` times from the last byte received.
+    - Progress is saved next to the output file in a `.part.{name}` file and its
+      `.json` state file, so that a failed download can be resumed by calling this
+      function again. Otherwise downloads restart from zero.
+    - If `hash_type` is given, the full hash of the file is computed while it is
+      being downloaded and returned, see `hash_file(..., hash_mode='full')`.
+    """
+    import json
+    from concurrent.futures import ThreadPoolExecutor
     from tqdm import tqdm
-    # write the file
-    with AtomicSaveFile(file=save_path, open_mode='wb', overwrite=overwrite_existing) as (_, file):
-        response = requests.get(url, stream=True)
-        total_length = response.headers.get('content-length')
-        # cast to integer if content-length exists on response
-        if total_length is not None:
-            total_length = int(total_length)
-        # download with progress bar
-        log.info(f'Downloading: {url} to: {save_path}')
-        with tqdm(total=total_length, desc=f'Downloading', unit='B', unit_scale=True, unit_divisor=1024) as progress:
-            for data in response.iter_content(chunk_size=chunk_size):
-                file.write(data)
-                progress.update(chunk_size)
+    # check the output file
+    save_path = os.path.abspath(save_path)
+    if os.path.exists(save_path) and not overwrite_existing:
+        raise FileExistsError(f'the target file already exists: {save_path}, set overwrite_existing=True to ignore this error.')
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    part_path = modify_file_name(save_path, prefix='.part')
+    state_path = modify_file_name(part_path, suffix='json')
+    # get the file information
+    size, version = _get_download_info(url, timeout=timeout)
+    info = dict(url=url, size=size, version=version)
+    # load the previous state of the download
+    segments = None
+    if (size is not None) and os.path.isfile(state_path) and os.path.isfile(part_path) and (os.path.getsize(part_path) == size):
+        try:
+            with open(state_path, 'r') as fp:
+                state = json.load(fp)
+            if state['info'] == info:
+                segments = [[int(s), int(e), int(p)] for s, e, p in state['segments']]
+                log.info(f'Resuming download: {url} to: {save_path}')
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning(f'could not load previous download state from: {repr(state_path)}, reason: {e}')
+    # initialise a new download
+    if (size is not None) and (segments is None):
+        num = max(1, min(num_segments, size // max(1, min_segment_size)))
+        bounds = [(i * size) // num for i in range(num + 1)]
+        segments = [[s, e, s] for s, e in zip(bounds[:-1], bounds[1:])]
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+    elif size is None:
+        open(part_path, 'wb').close()
+    # save the state periodically so that failed downloads can be resumed
+    state_lock, state_time = threading.Lock(), [time.time()]
+    def save_state(force: bool = False):
+        if size is None:
+            return
+        with state_lock:
+            if force or (time.time() - state_time[0] > 1):
+                # write atomically so that interrupted writes do not lose the previous progress
+                temp_path = f'{state_path}.tmp'
+                with open(temp_path, 'w') as fp:
+                    json.dump(dict(info=info, segments=segments), fp)
+                os.replace(temp_path, state_path)
+                state_time[0] = time.time()
+    save_state(force=True)
+    # download the file
+    hasher = _WrittenFileHasher(part_path, hash_type=hash_type) if hash_type else None
+    log.info(f'Downloading: {url} to: {save_path}')
+    try:
+        with tqdm(total=size, desc=f'Downloading', unit='B', unit_scale=True, unit_divisor=1024) as progress:
+            def on_write(start: int, end: int):
+                if hasher is not None:
+                    hasher.written(start, end)
+                progress.update(end - start)
+                save_state()
+            def on_restart():
+                nonlocal hasher
+                if hasher is not None:
+                    hasher.close()
+                    hasher = _WrittenFileHasher(part_path, hash_type=hash_type)
+                progress.reset()
+            if size is not None:
+                try:
+                    # resumed bytes still need to be hashed
+                    for start, _, pos in segments:
+                        on_write(start, pos)
+                    with ThreadPoolExecutor(max_workers=len(segments) or 1) as executor:
+                        futures = [
+                            executor.submit(_download_segment, url, part_path, segment, on_write=on_write, chunk_size=chunk_size, timeout=timeout, max_retries=max_retries, retry_delay=retry_delay)
+                            for segment in segments
+                        ]
+                        for future in futures:
+                            future.result()
+                    num_bytes = size
+                except _RangesUnsupportedError as e:
+                    log.warning(f'falling back to a single stream for download: {url}, reason: {e}')
+                    # the progress can no longer be resumed
+                    size = None
+                    if os.path.exists(state_path):
+                        os.remove(state_path)
+                    on_restart()
+            if size is None:
+                num_bytes = _download_stream(url, part_path, on_write=on_write, on_restart=on_restart, chunk_size=chunk_size, timeout=timeout, max_retries=max_retries, retry_delay=retry_delay)
+    except BaseException:
+        if hasher is not None:
+            hasher.close()
+        save_state(force=True)
+        log.error(f'Download failed, progress was saved to: {repr(part_path)}')
+        raise
+    # get the hash & move the file into place
+    hash = hasher.close(size=num_bytes) if (hasher is not None) else None
+    os.replace(part_path, save_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return hash
 
 
 def copy_file(src: str, dst: str, overwrite_existing: bool = False):
@@ -169,12 +558,18 @@ def copy_file(src: str, dst: str, overwrite_existing: bool = False):
             shutil.copyfile(src, path)
 
 
-def retrieve_file(src_uri: str, dst_path: str, overwrite_existing: bool = False):
+def retrieve_file(src_uri: str, dst_path: str, overwrite_existing: bool = False, hash_type: Optional[str] = None, **download_kwargs) -> Optional[str]:
+    """
+    Download or copy a file, see `download_file` for the `download_kwargs`.
+    - If `hash_type` is given and the file was downloaded, the full hash
+      computed during the download is returned, otherwise `None`.
+    """
     uri, is_url = uri_parse_file_or_url(src_uri)
     if is_url:
-        download_file(url=uri, save_path=dst_path, overwrite_existing=overwrite_existing)
+        return download_file(url=uri, save_path=dst_path, overwrite_existing=overwrite_existing, hash_type=hash_type, **download_kwargs)
     else:
         copy_file(src=uri, dst=dst_path, overwrite_existing=overwrite_existing)
+        return None
 
 
 # ========================================================================= #
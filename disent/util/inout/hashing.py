@@ -22,22 +22,56 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+import json
+import logging
 import os
+import threading
 from typing import Dict
+from typing import Optional
+from typing import Tuple
 from typing import Union
 
 
+log = logging.getLogger(__name__)
+
+
 # ========================================================================= #
 # file hashing                                                              #
 # ========================================================================= #
 
 
-def _yield_file_bytes(file: str, chunk_size=16384):
-    with open(file, 'rb') as f:
-        bytes = True
-        while bytes:
-            bytes = f.read(chunk_size)
-            yield bytes
+def _yield_file_range_bytes(file: str, start: int, end: int, chunk_size: int = 2**20, use_mmap: bool = False):
+    # yielded chunks are views into a re-used buffer or the memory-map,
+    # so they must be consumed before the next chunk is requested!
+    if end <= start:
+        return
+    with open(file, 'rb', buffering=0) as f:
+        if use_mmap:
+            import mmap
+            # the offset must be a multiple of mmap.ALLOCATIONGRANULARITY
+            offset = start - (start % mmap.ALLOCATIONGRANULARITY)
+            with mmap.mmap(f.fileno(), end - offset, offset=offset, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                try:
+                    for i in range(start - offset, end - offset, chunk_size):
+                        with view[i:min(i + chunk_size, end - offset)] as chunk:
+                            yield chunk
+                finally:
+                    view.release()
+        else:
+            f.seek(start)
+            view = memoryview(bytearray(chunk_size))
+            remaining = end - start
+            while remaining > 0:
+                n = f.readinto(view[:min(chunk_size, remaining)])
+                if not n:
+                    break
+                remaining -= n
+                yield view[:n]
+
+
+def _yield_file_bytes(file: str, chunk_size=2**20, use_mmap: bool = False):
+    yield from _yield_file_range_bytes(file, start=0, end=os.path.getsize(file), chunk_size=chunk_size, use_mmap=use_mmap)
 
 
 def _yield_fast_hash_bytes(file: str, chunk_size=16384, num_chunks=3):
@@ -58,17 +92,142 @@ def _yield_fast_hash_bytes(file: str, chunk_size=16384, num_chunks=3):
                 yield f.read(chunk_size)
 
 
+# ========================================================================= #
+# file tree hashing                                                         #
+# ========================================================================= #
+
+
+# WARNING: changing this changes all the "tree" hashes
+_TREE_BLOCK_SIZE = 2**24
+
+
+def _hash_file_block(file: str, hash_type: str, start: int, end: int, chunk_size: int, use_mmap: bool) -> bytes:
+    import hashlib
+    hash = hashlib.new(hash_type)
+    for bytes in _yield_file_range_bytes(file, start=start, end=end, chunk_size=chunk_size, use_mmap=use_mmap):
+        hash.update(bytes)
+    return hash.digest()
+
+
+def _hash_file_tree(file: str, hash_type: str, chunk_size: int, use_mmap: bool, num_workers: int) -> str:
+    """
+    Each 16MiB block of the file is hashed independently and in parallel, the final
+    hash is then computed over the size of the file followed by the block digests.
+    - hashlib releases the GIL when updating large buffers, so threads scale well.
+    - the result does not depend on `chunk_size`, `use_mmap` or `num_workers`.
+    """
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
+    size = os.path.getsize(file)
+    blocks = [(i, min(i + _TREE_BLOCK_SIZE, size)) for i in range(0, size, _TREE_BLOCK_SIZE)]
+    # hash the blocks, map returns results in order
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        digests = list(executor.map(lambda block: _hash_file_block(file, hash_type, *block, chunk_size=chunk_size, use_mmap=use_mmap), blocks))
+    # combine the digests
+    hash = hashlib.new(hash_type)
+    hash.update(size.to_bytes(length=64//8, byteorder='big', signed=False))
+    for digest in digests:
+        hash.update(digest)
+    return hash.hexdigest()
+
+
+# ========================================================================= #
+# file hash cache                                                           #
+# ========================================================================= #
+
+
+# setting this environment variable forces all cached hashes to be recomputed
+_ENV_FORCE_REHASH = 'DISENT_FORCE_REHASH'
+
+
+def _is_force_rehash() -> bool:
+    return os.environ.get(_ENV_FORCE_REHASH, '').lower() in ('1', 'true', 'yes')
+
+
+def get_hash_cache_path(file: str) -> str:
+    """
+    Get the path to the sidecar file that stores the cached hashes of `file`.
+    """
+    dir, name = os.path.split(os.path.abspath(file))
+    return os.path.join(dir, f'.{name}.hashes.json')
+
+
+def _get_file_stat_key(file: str) -> Tuple[str, int, int, int]:
+    # if any of these change, the file is assumed to have changed
+    stat = os.stat(file)
+    return os.path.abspath(file), int(stat.st_size), int(stat.st_mtime_ns), int(stat.st_ino)
+
+
+def _load_cached_hash(file: str, stat_key: Tuple[str, int, int, int], hash_type: str, hash_mode: str) -> Optional[str]:
+    try:
+        with open(get_hash_cache_path(file), 'r') as fp:
+            cache = json.load(fp)
+        if tuple(cache['stat']) != stat_key:
+            return None
+        return cache['hashes'].get(f'{hash_type}:{hash_mode}', None)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_cached_hash(file: str, stat_key: Tuple[str, int, int, int], hash_type: str, hash_mode: str, hash: str):
+    cache_path = get_hash_cache_path(file)
+    # keep the existing hashes of other types and modes if the file is unchanged
+    try:
+        with open(cache_path, 'r') as fp:
+            cache = json.load(fp)
+        hashes = cache['hashes'] if (tuple(cache['stat']) == stat_key) else {}
+    except (OSError, ValueError, KeyError, TypeError):
+        hashes = {}
+    hashes[f'{hash_type}:{hash_mode}'] = hash
+    # write atomically so that concurrent readers never see partial files,
+    # failures are not fatal, eg. the directory may be read-only
+    temp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'w') as fp:
+            json.dump(dict(stat=list(stat_key), hashes=hashes), fp)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        log.debug(f'could not save cached hash for file: {repr(file)} to: {repr(cache_path)}, reason: {e}')
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def cache_file_hash(file: str, hash: str, hash_type: str = 'md5', hash_mode: str = 'full'):
+    """
+    Store a hash that was already computed, eg. while the file was downloaded,
+    so that `hash_file(..., cache=True)` does not need to re-read the file.
+    """
+    _save_cached_hash(file, stat_key=_get_file_stat_key(file), hash_type=hash_type, hash_mode=hash_mode, hash=hash)
+
+
 # ========================================================================= #
 # file hashing                                                              #
 # ========================================================================= #
 
 
-def hash_file(file: str, hash_type='md5', hash_mode='full', missing_ok=True) -> str:
+def hash_file(
+    file: str,
+    hash_type='md5',
+    hash_mode='full',
+    missing_ok=True,
+    cache: bool = False,
+    force: bool = False,
+    chunk_size: int = 2**20,
+    use_mmap: bool = False,
+    num_workers: int = min(os.cpu_count() or 1, 8),
+) -> str:
     """
     :param file: the path to the file
-    :param hash_type: the kind of hash to compute, default is "md5"
+    :param hash_type: the kind of hash to compute, default is "md5". "blake2b" is recommended for the "tree" mode.
     :param hash_mode: "full" uses all the bytes in the file to compute the hash, "fast" uses the start, middle, end bytes as well as the size of the file in the hash.
-    :param chunk_size: number of bytes to read at a time
+                      "tree" uses all the bytes in the file, but hashes 16MiB blocks in parallel using `num_workers` threads and then hashes the block digests. "tree" hashes differ from "full" hashes.
+    :param cache: if enabled, the hash is stored in a sidecar file next to `file` and re-used while
+                  the path, size, mtime and inode of the file are unchanged. See `get_hash_cache_path`.
+    :param force: if enabled, ignore previously cached hashes and recompute the hash. This can also
+                  be enabled globally by setting the `DISENT_FORCE_REHASH` environment variable.
+    :param chunk_size: number of bytes to read at a time, does not affect the computed hash
+    :param use_mmap: read the file using a memory-map instead of buffered reads, does not affect the computed hash
+    :param num_workers: number of threads used to compute "tree" hashes, does not affect the computed hash
     :return: the hexdigest of the hash
     :raises FileNotFoundError
     """
@@ -78,18 +237,33 @@ def hash_file(file: str, hash_type='md5', hash_mode='full', missing_ok=True) ->
         if missing_ok:
             return ''
         raise FileNotFoundError(f'could not compute hash for missing file: {repr(file)}')
-    # get file bytes iterator
-    if hash_mode == 'full':
-        byte_iter = _yield_file_bytes(file=file)
-    elif hash_mode == 'fast':
-        byte_iter = _yield_fast_hash_bytes(file=file)
-    else:
-        raise KeyError(f'invalid hash_mode: {repr(hash_mode)}')
+    # check the cache
+    if cache:
+        stat_key = _get_file_stat_key(file)
+        if not (force or _is_force_rehash()):
+            hash = _load_cached_hash(file, stat_key=stat_key, hash_type=hash_type, hash_mode=hash_mode)
+            if hash is not None:
+                log.debug(f'loaded cached {hash_mode} {hash_type} hash: {hash} for file: {repr(file)}')
+                return hash
     # generate hash
-    hash = hashlib.new(hash_type)
-    for bytes in byte_iter:
-        hash.update(bytes)
-    hash = hash.hexdigest()
+    if hash_mode == 'tree':
+        hash = _hash_file_tree(file=file, hash_type=hash_type, chunk_size=chunk_size, use_mmap=use_mmap, num_workers=num_workers)
+    else:
+        # get file bytes iterator
+        if hash_mode == 'full':
+            byte_iter = _yield_file_bytes(file=file, chunk_size=chunk_size, use_mmap=use_mmap)
+        elif hash_mode == 'fast':
+            byte_iter = _yield_fast_hash_bytes(file=file)
+        else:
+            raise KeyError(f'invalid hash_mode: {repr(hash_mode)}')
+        # compute hash
+        hash = hashlib.new(hash_type)
+        for bytes in byte_iter:
+            hash.update(bytes)
+        hash = hash.hexdigest()
+    # update the cache, only if the file was not modified while hashing
+    if cache and (_get_file_stat_key(file) == stat_key):
+        _save_cached_hash(file, stat_key=stat_key, hash_type=hash_type, hash_mode=hash_mode, hash=hash)
     # done
     return hash
 
@@ -118,21 +292,21 @@ def normalise_hash(hash: Union[str, Dict[str, str]], hash_mode: str) -> str:
     return hash
 
 
-def validate_file_hash(file: str, hash: Union[str, Dict[str, str]], hash_type: str = 'md5', hash_mode: str = 'full', missing_ok=True):
+def validate_file_hash(file: str, hash: Union[str, Dict[str, str]], hash_type: str = 'md5', hash_mode: str = 'full', missing_ok=True, cache: bool = False, force: bool = False):
     """
     :raises FileNotFoundError, HashError
     """
     hash = normalise_hash(hash=hash, hash_mode=hash_mode)
     # compute the hash
-    fhash = hash_file(file=file, hash_type=hash_type, hash_mode=hash_mode, missing_ok=missing_ok)
+    fhash = hash_file(file=file, hash_type=hash_type, hash_mode=hash_mode, missing_ok=missing_ok, cache=cache, force=force)
     # check the hash
     if fhash != hash:
         raise HashError(f'computed {hash_mode} {hash_type} hash: {repr(fhash)} does not match expected hash: {repr(hash)} for file: {repr(file)}')
 
 
-def is_valid_file_hash(file: str, hash: Union[str, Dict[str, str]], hash_type: str = 'md5', hash_mode: str = 'full', missing_ok=True):
+def is_valid_file_hash(file: str, hash: Union[str, Dict[str, str]], hash_type: str = 'md5', hash_mode: str = 'full', missing_ok=True, cache: bool = False, force: bool = False):
     try:
-        validate_file_hash(file=file, hash=hash, hash_type=hash_type, hash_mode=hash_mode, missing_ok=missing_ok)
+        validate_file_hash(file=file, hash=hash, hash_type=hash_type, hash_mode=hash_mode, missing_ok=missing_ok, cache=cache, force=force)
     except HashError:
         return False
     return True
@@ -141,3 +315,39 @@ def is_valid_file_hash(file: str, hash: Union[str, Dict[str, str]], hash_type: s
 # ========================================================================= #
 # file hashing                                                              #
 # ========================================================================= #
+
+
+if __name__ == '__main__':
+
+    def main(size: int = 2**30):
+        import time
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as temp_dir:
+            file = os.path.join(temp_dir, 'data.bin')
+            with open(file, 'wb') as f:
+                for _ in range(size // 2**24):
+                    f.write(os.urandom(2**24))
+            for hash_type, hash_mode, kwargs in [
+                ('md5', 'full', dict(chunk_size=16384)),
+                ('md5', 'full', dict()),
+                ('md5', 'full', dict(use_mmap=True)),
+                ('md5', 'tree', dict()),
+                ('blake2b', 'full', dict()),
+                ('blake2b', 'tree', dict()),
+                ('blake2b', 'tree', dict(use_mmap=True)),
+            ]:
+                t = time.time()
+                hash = hash_file(file, hash_type=hash_type, hash_mode=hash_mode, **kwargs)
+                print(f'{hash_type:7s} {hash_mode:4s} {str(kwargs):22s}: {size / 2**20 / (time.time() - t):7.1f} MiB/s')
+
+    main()
+
+    # RESULTS: 1GiB file in the page cache, single core machine. The "tree"
+    #          mode scales with `num_workers` when more cores are available.
+    # md5     full {'chunk_size': 16384} :   431.4 MiB/s
+    # md5     full {}                    :   454.6 MiB/s
+    # md5     full {'use_mmap': True}    :   500.7 MiB/s
+    # md5     tree {}                    :   469.8 MiB/s
+    # blake2b full {}                    :   379.9 MiB/s
+    # blake2b tree {}                    :   415.2 MiB/s
+    # blake2b tree {'use_mmap': True}    :   493.5 MiB/s
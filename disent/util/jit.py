@@ -28,6 +28,18 @@
 # ========================================================================= #
 
 
+def is_numba_available() -> bool:
+    """
+    Check if numba is installed, useful for only enabling
+    JIT compiled kernels if they will actually be compiled.
+    """
+    try:
+        import numba
+    except ImportError:
+        return False
+    return True
+
+
 def try_njit(*args, **kwargs):
     """
     Wrapper around numba.njit
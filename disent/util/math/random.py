@@ -25,6 +25,9 @@
 
 import numpy as np
 
+from disent.util.seeds import as_rng
+from disent.util.seeds import RngLike
+
 
 # ========================================================================= #
 # Better Choice                                                             #
@@ -46,12 +49,22 @@ def random_choice_prng(a, size=None, replace=True, seed: int = None):
     return choices
 
 
+def random_permutations(num: int, n: int, rng: RngLike = None) -> np.ndarray:
+    """
+    Generate `num` independent random permutations of `range(n)`, returning an
+    array of shape (num, n). Comparing each row against some value `k` gives a
+    mask of exactly `k` randomly chosen elements, this is the vectorized
+    equivalent of calling `np.random.choice(n, size=k, replace=False)` per row.
+    """
+    return np.argsort(as_rng(rng).random((num, n)), axis=-1)
+
+
 # ========================================================================= #
 # Random Ranges                                                             #
 # ========================================================================= #
 
 
-def randint2(a_low, a_high, b_low, b_high, size=None):
+def randint2(a_low, a_high, b_low, b_high, size=None, rng: RngLike = None):
     """
     Like np.random.randint, but supports two ranges of values.
     Samples with equal probability from both ranges.
@@ -71,12 +84,12 @@ def randint2(a_low, a_high, b_low, b_high, size=None):
     d = da + db
     assert np.all(d > 0), f'(a_high - a_low) + (b_high - b_low) > 0 | {d} = ({a_high} - {a_low}) + ({b_high} - {b_low}) > 0'
     # sampled
-    offset = np.random.randint(0, d, size=size)
+    offset = as_rng(rng).integers(0, d, size=size)
     offset += (da <= offset) * (b_low - a_high)
     return a_low + offset
 
 
-def sample_radius(value, low, high, r_low, r_high):
+def sample_radius(value, low, high, r_low, r_high, rng: RngLike = None):
     """
     Sample around the given value (low <= value < high),
     the resampled value will lie in th same range.
@@ -93,6 +106,7 @@ def sample_radius(value, low, high, r_low, r_high):
         # if r_min == 0, then the ranges overlap, so we must shift one of them.
         b_low=np.minimum(value + r_low + (r_low == 0), high),
         b_high=np.minimum(value + r_high, high),
+        rng=rng,
     )
 
 
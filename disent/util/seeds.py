@@ -25,6 +25,9 @@
 import contextlib
 import logging
 import random
+from typing import Optional
+from typing import Union
+
 import numpy as np
 
 
@@ -88,6 +91,77 @@ class TempNumpySeed(contextlib.ContextDecorator):
         # TODO: do we need to override this?
         return self
 
+# ========================================================================= #
+# numpy generators                                                          #
+# ========================================================================= #
+
+
+RngLike = Optional[Union[int, np.random.SeedSequence, np.random.Generator]]
+
+
+_GLOBAL_RNG: Optional[np.random.Generator] = None
+
+
+def get_global_rng() -> np.random.Generator:
+    """
+    Get a `np.random.Generator` that shares its bit generator with the legacy
+    global `np.random` state. This generator is thus still affected by
+    `np.random.seed`, `seed` and `TempNumpySeed`, and is used as the
+    default generator when no other generator is specified.
+    """
+    global _GLOBAL_RNG
+    # `np.random.get_bit_generator` was only added in numpy 1.25
+    if hasattr(np.random, 'get_bit_generator'):
+        bit_generator = np.random.get_bit_generator()
+    else:
+        bit_generator = np.random.mtrand._rand._bit_generator
+    # the global bit generator can be replaced
+    if (_GLOBAL_RNG is None) or (_GLOBAL_RNG.bit_generator is not bit_generator):
+        _GLOBAL_RNG = np.random.Generator(bit_generator)
+    return _GLOBAL_RNG
+
+
+def as_rng(rng: RngLike = None) -> np.random.Generator:
+    """
+    Normalise a seed or generator into a `np.random.Generator`
+    - None: returns the generator that shares the global `np.random` state, see `get_global_rng`
+    - int or SeedSequence: returns a new PCG64 generator seeded with the value
+    - Generator: returned as is
+    """
+    if rng is None:
+        return get_global_rng()
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.Generator(np.random.PCG64(rng))
+
+
+def worker_init_fn(worker_id: int):
+    """
+    Pass this to a `torch.utils.data.DataLoader` as the `worker_init_fn`.
+
+    Each forked worker receives an identical copy of the dataset, which means
+    that samplers that own a generator would produce duplicate batches across
+    workers. This function derives independent seeds from the unique per-worker
+    seed given by torch:
+    1. the global `np.random` state is re-seeded, older versions of torch do not do this
+    2. if the dataset has a `set_rng` method, eg. `DisentDataset`, it is given
+       its own PCG64 generator which is faster than the global state.
+
+    The generated streams are reproducible if torch is seeded, and are different
+    for every worker and every epoch.
+    """
+    import torch
+    info = torch.utils.data.get_worker_info()
+    if info is None:
+        return
+    # derive independent seeds from the torch worker seed
+    np_seq, rng_seq = np.random.SeedSequence(info.seed).spawn(2)
+    np.random.seed(np_seq.generate_state(1)[0])
+    # give the dataset its own generator
+    if hasattr(info.dataset, 'set_rng'):
+        info.dataset.set_rng(np.random.Generator(np.random.PCG64(rng_seq)))
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
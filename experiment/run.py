@@ -25,7 +25,9 @@
 import logging
 import os
 from datetime import datetime
+from functools import partial
 from typing import Callable
+from typing import List
 from typing import Optional
 
 import hydra
@@ -33,6 +35,7 @@ import pytorch_lightning as pl
 import torch
 import torch.utils.data
 import wandb
+from hydra.core.hydra_config import HydraConfig
 from omegaconf import DictConfig
 from omegaconf import ListConfig
 from omegaconf import OmegaConf
@@ -41,6 +44,7 @@ from pytorch_lightning.callbacks import ModelSummary
 from pytorch_lightning.loggers import LightningLoggerBase
 
 import disent.registry as R
+from disent.dataset.util.prepare import prepare_datasets
 from disent.frameworks import DisentFramework
 from disent.util.lightning.callbacks import VaeMetricLoggingCallback
 from disent.util.seeds import seed
@@ -127,6 +131,27 @@ def hydra_check_data_meta(cfg):
         log.info(f'* dataset.meta.vis_std:  {cfg.dataset.meta.vis_std}')
 
 
+def hydra_get_prepare_data_cfgs(cfg) -> List[dict]:
+    """
+    Get the data configs of all the datasets that should be prepared. This is the
+    dataset of the current config, as well as any other datasets listed in
+    `prepare_data.datasets`, eg. all the datasets that are part of a sweep.
+    """
+    data_cfgs = [cfg.dataset.data]
+    # compose the configs of the other datasets, keeping the other overrides
+    extra_datasets = cfg.get('prepare_data', {}).get('datasets', None) or []
+    if extra_datasets:
+        hydra_cfg = HydraConfig.get()
+        overrides = [o for o in hydra_cfg.overrides.task if not o.lstrip('+~').startswith('dataset=')]
+        for name in extra_datasets:
+            data_cfgs.append(hydra.compose(config_name=hydra_cfg.job.config_name, overrides=[*overrides, f'dataset={name}']).dataset.data)
+    # convert to dictionaries, we do not need to load the data into memory
+    data_cfgs = [OmegaConf.to_container(data_cfg, resolve=True) for data_cfg in data_cfgs]
+    for data_cfg in data_cfgs:
+        data_cfg.pop('in_memory', None)
+    return data_cfgs
+
+
 def hydra_make_logger(cfg) -> Optional[LightningLoggerBase]:
     logger = hydra.utils.instantiate(cfg.logging.logger)
     if logger:
@@ -221,6 +246,9 @@ def hydra_make_datamodule(cfg):
         using_cuda            = cfg.dsettings.trainer.cuda,
         dataloader_kwargs     = cfg.datamodule.dataloader,
         augment_on_gpu        = cfg.datamodule.gpu_augment,
+        uint8_on_gpu          = cfg.datamodule.get('gpu_uint8', False),
+        render_on_gpu         = cfg.datamodule.get('gpu_render', False),
+        materialize_dir       = cfg.dsettings.dataset.get('materialize_dir', None),
         prepare_data_per_node = cfg.datamodule.prepare_data_per_node,
         # from: framework.meta
         return_indices        = cfg.framework.meta.get('requires_indices', False),
@@ -248,9 +276,20 @@ def action_prepare_data(cfg: DictConfig):
     hydra_check_data_meta(cfg)
     # print the config
     log.info(f'Dataset Config Is:\n{make_box_str(OmegaConf.to_yaml({"dataset": cfg.dataset}))}')
-    # prepare data
-    datamodule = hydra_make_datamodule(cfg)
-    datamodule.prepare_data()
+    # prepare all the datasets concurrently
+    # - datafiles are locked while they are prepared, so other jobs
+    #   or nodes sharing the same data root will not duplicate work
+    data_cfgs = hydra_get_prepare_data_cfgs(cfg)
+    # the datafiles of datasets are defined on their classes, so the number of processes used to
+    # compress generated hdf5 files is passed to the dataset preparation processes via the environment
+    hdf5_num_workers = cfg.get('prepare_data', {}).get('hdf5_num_workers', None)
+    if hdf5_num_workers is not None:
+        os.environ['DISENT_HDF5_NUM_WORKERS'] = str(hdf5_num_workers)
+    log.info(f'Preparing {len(data_cfgs)} datasets: {[data_cfg["_target_"] for data_cfg in data_cfgs]}')
+    prepare_datasets(
+        [partial(hydra.utils.instantiate, data_cfg) for data_cfg in data_cfgs],
+        num_workers=cfg.get('prepare_data', {}).get('num_workers', 4),
+    )
 
 
 def action_train(cfg: DictConfig):
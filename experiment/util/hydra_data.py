@@ -34,7 +34,15 @@ import pytorch_lightning as pl
 from omegaconf import DictConfig
 
 from disent.dataset import DisentDataset
+from disent.dataset.data import IndicesGroundTruthData
 from disent.dataset.transform import DisentDatasetTransform
+from disent.dataset.transform import ImgTensorU8ToF32
+from disent.dataset.transform import RenderImgTensorF32
+from disent.dataset.transform import ToImgTensorF32
+from disent.dataset.transform import ToImgTensorU8
+from disent.dataset.transform import is_per_observation_random
+from disent.dataset.util.materialize import materialize_transformed
+from disent.util.seeds import worker_init_fn
 
 
 log = logging.getLogger(__name__)
@@ -92,6 +100,9 @@ class HydraDataModule(pl.LightningDataModule):
         augment: Optional[Dict[str, Any]] = None,            # = augment.augment_cls
         dataloader_kwargs: Optional[Dict[str, Any]] = None,  # = dataloader
         augment_on_gpu: bool = False,                        # = dsettings.dataset.gpu_augment
+        uint8_on_gpu: bool = False,                          # = datamodule.gpu_uint8
+        render_on_gpu: bool = False,                         # = datamodule.gpu_render
+        materialize_dir: Optional[str] = None,               # = dsettings.dataset.materialize_dir
         using_cuda: Optional[bool] = False,                  # = self.hparams.dsettings.trainer.cuda
         prepare_data_per_node: bool = True,                  # DataHooks.prepare_data_per_node
         return_indices: bool = False,                        # = framework.meta.requires_indices
@@ -113,15 +124,53 @@ class HydraDataModule(pl.LightningDataModule):
         # batch_augment: augments transformed data for inputs, should be applied across a batch
         # which version of the dataset we need to use if GPU augmentation is enabled or not.
         # - corresponds to below in train_dataloader()
-        if augment_on_gpu:
-            self._gpu_batch_augment = DisentDatasetTransform(transform=self.input_transform)
-            warnings.warn('`augment_on_gpu=True` is outdated and may no longer be equivalent to `augment_on_gpu=False`')
+        # - if uint8_on_gpu is enabled, the dataset returns uint8 observations which are
+        #   4x smaller to transfer from the workers, these are then converted to float32
+        #   and normalized on the GPU, followed by the augment.
+        # - if render_on_gpu is enabled, the dataset returns only the indices of synthetic
+        #   observations, these are then rendered, converted to float32 and normalized on
+        #   the GPU, followed by the augment.
+        self._render_data = None
+        self._uint8_transform = None
+        if uint8_on_gpu and render_on_gpu:
+            raise ValueError('`uint8_on_gpu=True` and `render_on_gpu=True` cannot be enabled at the same time.')
+        if materialize_dir and (self.data_transform is None):
+            raise ValueError('`materialize_dir` requires a dataset transform to materialize.')
+        if materialize_dir and (uint8_on_gpu or render_on_gpu):
+            raise ValueError('`materialize_dir` cannot be set if `uint8_on_gpu=True` or `render_on_gpu=True`, these already avoid transforming observations in the dataloader.')
+        if uint8_on_gpu:
+            if not isinstance(self.data_transform, ToImgTensorF32):
+                raise TypeError(f'`uint8_on_gpu=True` requires the dataset transform to be an instance of {ToImgTensorF32.__name__}, got: {repr(self.data_transform)}')
+            gpu_normalize = ImgTensorU8ToF32(mean=self.data_transform.mean, std=self.data_transform.std)
+            # only the training dataset uses this, callbacks and metrics still need float32 observations
+            self._uint8_transform = ToImgTensorU8(size=self.data_transform.size)
+        elif render_on_gpu:
+            # the renderer needs the data before setup() is called, this is cheap for synthetic data
+            self._render_data = hydra.utils.instantiate(data)
+            if not callable(getattr(self._render_data, 'render_batch_torch', None)):
+                raise TypeError(f'`render_on_gpu=True` requires the data to support rendering with `render_batch_torch`, got: {repr(self._render_data)}')
+            if not isinstance(self.data_transform, ToImgTensorF32):
+                raise TypeError(f'`render_on_gpu=True` requires the dataset transform to be an instance of {ToImgTensorF32.__name__}, got: {repr(self.data_transform)}')
+            if self.data_transform.size not in (None, self._render_data.img_shape[0], tuple(self._render_data.img_shape[:2])):
+                raise ValueError(f'`render_on_gpu=True` cannot resize observations, the dataset transform size: {repr(self.data_transform.size)} must be `None` or match the image shape: {tuple(self._render_data.img_shape)}')
+            gpu_normalize = RenderImgTensorF32(self._render_data, mean=self.data_transform.mean, std=self.data_transform.std)
+        else:
+            gpu_normalize = None
+        # - the augment is applied on the GPU if any mode is enabled, unless the augment was explicitly
+        #   moved to the GPU, augments that do not generate random values for each observation in
+        #   a batch are applied to each observation so that their random values are unchanged.
+        if augment_on_gpu or uint8_on_gpu or render_on_gpu:
+            self._gpu_batch_augment = DisentDatasetTransform(transform=self.input_transform, normalize=gpu_normalize, per_observation=not augment_on_gpu)
         else:
             self._gpu_batch_augment = None
+        if augment_on_gpu and (self.input_transform is not None) and not is_per_observation_random(self.input_transform):
+            warnings.warn(f'`augment_on_gpu=True` is not equivalent to `augment_on_gpu=False` for augments that do not generate random values for each observation in a batch, got: {repr(self.input_transform)}')
         # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
         # datasets initialised in setup()
         self.dataset_train_noaug: DisentDataset = None
         self.dataset_train_aug: DisentDataset = None
+        self.dataset_train_uint8: Optional[DisentDataset] = None
+        self.dataset_train_render: Optional[DisentDataset] = None
 
     @property
     def gpu_batch_augment(self) -> Optional[DisentDatasetTransform]:
@@ -139,16 +188,32 @@ class HydraDataModule(pl.LightningDataModule):
         #   things could go wrong. We try be efficient about it by removing the
         #   in_memory argument if it exists.
         log.info(f'Data - Preparation & Downloading')
-        hydra.utils.instantiate(data)
+        data = hydra.utils.instantiate(data)
+        # materialize the transformed data once, so that setup() can load it
+        if self.hparams.materialize_dir:
+            log.info(f'Data - Materializing Transform')
+            materialize_transformed(data, self.data_transform, self.hparams.materialize_dir)
 
     def setup(self, stage=None) -> None:
         # ground truth data
         log.info(f'Data - Instance')
         data = hydra.utils.instantiate(self.hparams.data)
+        # The deterministic transform is applied once and the results are cached and
+        # memory-mapped, these are then used instead of transforming the data each epoch.
+        data_transform = self.data_transform
+        if self.hparams.materialize_dir:
+            data, data_transform = materialize_transformed(data, self.data_transform, self.hparams.materialize_dir), None
         # Wrap the data for the framework some datasets need triplets, pairs, etc.
         # Augmentation is done inside the frameworks so that it can be done on the GPU, otherwise things are very slow.
-        self.dataset_train_noaug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self.data_transform, augment=None,               return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
-        self.dataset_train_aug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self.data_transform, augment=self.input_transform, return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
+        self.dataset_train_noaug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=data_transform, augment=None,               return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
+        self.dataset_train_aug = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=data_transform, augment=self.input_transform, return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
+        # The training dataset only returns uint8 observations or indices if observations are converted or
+        # rendered on the GPU, the other datasets are still used by callbacks and metrics that need the
+        # actual float32 observations.
+        if self._uint8_transform is not None:
+            self.dataset_train_uint8 = DisentDataset(data, hydra.utils.instantiate(self.hparams.sampler), transform=self._uint8_transform, augment=None, return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
+        if self._render_data is not None:
+            self.dataset_train_render = DisentDataset(IndicesGroundTruthData(data), hydra.utils.instantiate(self.hparams.sampler), transform=None, augment=None, return_indices=self.hparams.return_indices, return_factors=self.hparams.return_factors)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # Training Dataset:
@@ -169,7 +234,11 @@ class HydraDataModule(pl.LightningDataModule):
         """
         # Select which version of the dataset we need to use if GPU augmentation is enabled or not.
         # - corresponds to above in __init__()
-        if self.hparams.augment_on_gpu:
+        if self.dataset_train_render is not None:
+            dataset = self.dataset_train_render
+        elif self.dataset_train_uint8 is not None:
+            dataset = self.dataset_train_uint8
+        elif self._gpu_batch_augment is not None:
             dataset = self.dataset_train_noaug
         else:
             dataset = self.dataset_train_aug
@@ -180,6 +249,9 @@ class HydraDataModule(pl.LightningDataModule):
             # This should usually be TRUE if cuda is enabled.
             # About 20% faster with the xysquares dataset, RTX 2060 Rev. A, and Intel i7-3930K
             'pin_memory': self.hparams.using_cuda,
+            # each worker needs its own random state, otherwise
+            # the samplers in the forked workers produce duplicate batches
+            'worker_init_fn': worker_init_fn,
         }
         # get config kwargs
         kwargs = self.hparams.dataloader_kwargs
@@ -22,10 +22,14 @@
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
+from typing import Optional
+from typing import Sequence
 from typing import Tuple
 
 import numpy as np
+import torch
 
+from disent.dataset.data._groundtruth__xyobject import _torch_idx_to_pos
 from research.code.dataset.data._groundtruth__xysquares import XYSquaresData
 
 
@@ -60,6 +64,16 @@ class XColumnsData(XYSquaresData):
                 obs[:, x:x+size, :] = self._fill_value
         return obs
 
+    def render_batch(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        # get factors, (B, N), columns cover the full height of the image
+        factors = self.idx_to_pos(np.asarray(idxs).reshape(-1))
+        xs = self._offset + self._spacing * factors
+        return self._render_squares(xs, np.zeros_like(xs), self._square_size, self.img_shape[0], out=out)
+
+    def render_batch_torch(self, idxs: torch.Tensor) -> torch.Tensor:
+        xs = self._offset + self._spacing * _torch_idx_to_pos(idxs, self.factor_sizes)
+        return self._render_squares_torch(xs, torch.zeros_like(xs), self._square_size, self.img_shape[0])
+
 
 # ========================================================================= #
 # END                                                                       #
@@ -23,11 +23,14 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import logging
+from typing import Optional
+from typing import Sequence
 from typing import Tuple
 
 import numpy as np
 
 from disent.dataset.data._groundtruth import GroundTruthData
+from disent.dataset.data._groundtruth__xyobject import _render_boxes
 
 
 log = logging.getLogger(__name__)
@@ -154,6 +157,32 @@ class XYBlocksData(GroundTruthData):
         # RETURN
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self.render_batch(idxs)
+
+    def render_batch(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Vectorized version of `_get_observation`, returns an array of shape (B, H, W, C)
+        - the colors of the xor'd blocks are resolved for the whole batch before drawing
+        """
+        positions = self.idx_to_pos(np.asarray(idxs).reshape(-1))
+        cs, xs, ys = positions[:, :self._grid_dims*1], positions[:, self._grid_dims*1:self._grid_dims*2], positions[:, self._grid_dims*2:]
+        sizes = self._axis_division_sizes[None, :]
+        xs, ys, colors = xs * sizes, ys * sizes, self._colors[cs]
+        # xor each block with the previous levels, the color of a block is
+        # the background if it matches the existing color at its top-left
+        fills = np.empty_like(colors)
+        for i in range(self._grid_dims):
+            existing = np.full_like(colors[:, i], self._bg_color)
+            for j in range(i):
+                covers = (xs[:, j] <= xs[:, i]) & (xs[:, i] < xs[:, j] + sizes[:, j]) & (ys[:, j] <= ys[:, i]) & (ys[:, i] < ys[:, j] + sizes[:, j])
+                existing = np.where(covers[:, None], fills[:, j], existing)
+            fills[:, i] = np.where(np.any(existing != colors[:, i], axis=-1)[:, None], colors[:, i], self._bg_color)
+        # GENERATE
+        out = _render_boxes(xs, ys, sizes, sizes, colors=fills, img_shape=self.img_shape, dtype=np.uint8, bg=self._bg_color, out=out)
+        # RETURN
+        return out
+
 
 # ========================================================================= #
 # END                                                                       #
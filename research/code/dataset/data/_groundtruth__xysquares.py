@@ -24,12 +24,17 @@
 
 import logging
 from typing import Optional
+from typing import Sequence
 from typing import Tuple
 from typing import Union
 
 import numpy as np
+import torch
 
 from disent.dataset.data._groundtruth import GroundTruthData
+from disent.dataset.data._groundtruth__xyobject import _render_boxes
+from disent.dataset.data._groundtruth__xyobject import _render_boxes_torch
+from disent.dataset.data._groundtruth__xyobject import _torch_idx_to_pos
 from disent.util.iters import iter_chunks
 
 
@@ -74,7 +79,7 @@ class XYSquaresMinimalData(GroundTruthData):
 
     def _get_observation(self, idx):
         # get factors
-        factors = np.reshape(np.unravel_index(idx, self.factor_sizes), (-1, 2))
+        factors = np.reshape(self.idx_to_pos(idx), (-1, 2))
         # GENERATE
         obs = np.zeros(self.img_shape, dtype=np.uint8)
         for i, (fx, fy) in enumerate(factors):
@@ -82,6 +87,23 @@ class XYSquaresMinimalData(GroundTruthData):
             obs[y:y+8, x:x+8, i] = 255
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self.render_batch(idxs)
+
+    def render_batch(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        # get factors, (B, 6) -> (B, 3)
+        factors = self.idx_to_pos(np.asarray(idxs).reshape(-1))
+        xs, ys = 8 * factors[:, 0::2], 8 * factors[:, 1::2]
+        # GENERATE: each square is drawn in its own channel
+        colors = np.full((*xs.shape, 3), 255, dtype=np.uint8)
+        return _render_boxes(xs, ys, 8, 8, colors=colors, img_shape=self.img_shape, dtype=np.uint8, channel_masks=np.eye(3, dtype=bool), out=out)
+
+    def render_batch_torch(self, idxs: torch.Tensor) -> torch.Tensor:
+        factors = _torch_idx_to_pos(idxs, self.factor_sizes)
+        xs, ys = 8 * factors[:, 0::2], 8 * factors[:, 1::2]
+        colors = torch.full((*xs.shape, 3), 255, dtype=torch.uint8, device=idxs.device)
+        return _render_boxes_torch(xs, ys, 8, 8, colors=colors, img_shape=self.img_shape, channel_masks=np.eye(3, dtype=bool))
+
 
 # ========================================================================= #
 # xy multi grid data                                                        #
@@ -196,6 +218,43 @@ class XYSquaresData(GroundTruthData):
                 obs[y:y+size, x:x+size, :] = self._fill_value
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self.render_batch(idxs)
+
+    def render_batch(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Vectorized version of `_get_observation`, returns an array of shape (B, H, W, C)
+        - the output can be written into a preallocated array by specifying `out`
+        """
+        # get factors, (B, 2*N) -> (B, N)
+        factors = self.idx_to_pos(np.asarray(idxs).reshape(-1))
+        offset, space, size = self._offset, self._spacing, self._square_size
+        xs, ys = offset + space * factors[:, 0::2], offset + space * factors[:, 1::2]
+        return self._render_squares(xs, ys, size, size, out=out)
+
+    def _render_squares(self, xs: np.ndarray, ys: np.ndarray, ws, hs, out: Optional[np.ndarray] = None) -> np.ndarray:
+        colors = np.full((*xs.shape, self.img_shape[-1]), self._fill_value, dtype=self._dtype)
+        # each square is drawn in its own channel if rgb
+        channel_masks = np.eye(3, dtype=bool)[:self._num_squares] if self._rgb else None
+        return _render_boxes(xs, ys, ws, hs, colors=colors, img_shape=self.img_shape, dtype=self._dtype, channel_masks=channel_masks, out=out)
+
+    def render_batch_torch(self, idxs: torch.Tensor) -> torch.Tensor:
+        """
+        Torch version of `render_batch`, observations are rendered
+        on the same device as the indices.
+        """
+        factors = _torch_idx_to_pos(idxs, self.factor_sizes)
+        offset, space, size = self._offset, self._spacing, self._square_size
+        xs, ys = offset + space * factors[:, 0::2], offset + space * factors[:, 1::2]
+        return self._render_squares_torch(xs, ys, size, size)
+
+    def _render_squares_torch(self, xs: torch.Tensor, ys: torch.Tensor, ws, hs) -> torch.Tensor:
+        # the fill value is converted with numpy so that the dtype matches `render_batch`
+        fill = torch.as_tensor(np.full(self.img_shape[-1], self._fill_value, dtype=self._dtype), device=xs.device)
+        colors = fill.expand(*xs.shape, -1)
+        channel_masks = np.eye(3, dtype=bool)[:self._num_squares] if self._rgb else None
+        return _render_boxes_torch(xs, ys, ws, hs, colors=colors, img_shape=self.img_shape, channel_masks=channel_masks)
+
 
 # ========================================================================= #
 # xy minimal single square dataset                                          #
@@ -254,6 +313,22 @@ class XYSingleSquareData(GroundTruthData):
         obs[y:y+size, x:x+size, :] = 255
         return obs
 
+    def _get_observations(self, idxs: np.ndarray) -> np.ndarray:
+        return self.render_batch(idxs)
+
+    def render_batch(self, idxs: Sequence[int], out: Optional[np.ndarray] = None) -> np.ndarray:
+        fx, fy = self.idx_to_pos(np.asarray(idxs).reshape(-1)).T
+        offset, space, size = self._offset, self._spacing, self._square_size
+        # draw squares onto images
+        colors = np.full((len(fx), 1, 1), 255, dtype=np.uint8)
+        return _render_boxes(offset + space * fx[:, None], offset + space * fy[:, None], size, size, colors=colors, img_shape=self.img_shape, dtype=np.uint8, out=out)
+
+    def render_batch_torch(self, idxs: torch.Tensor) -> torch.Tensor:
+        fx, fy = _torch_idx_to_pos(idxs, self.factor_sizes).T
+        offset, space, size = self._offset, self._spacing, self._square_size
+        colors = torch.full((len(fx), 1, 1), 255, dtype=torch.uint8, device=idxs.device)
+        return _render_boxes_torch(offset + space * fx[:, None], offset + space * fy[:, None], size, size, colors=colors, img_shape=self.img_shape)
+
 
 # ========================================================================= #
 # END                                                                       #
@@ -23,20 +23,58 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import contextlib
+import os
+import threading
+import pickle
 import time
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 from tempfile import NamedTemporaryFile
+from types import SimpleNamespace
+from tempfile import TemporaryDirectory
 
 import h5py
 import numpy as np
 import pytest
+import torch
 
+from disent.dataset import DisentDataset
+from disent.dataset.data import ArrayGroundTruthData
+from disent.dataset.data import CachedGroundTruthData
+from disent.dataset.data import EpisodesPackedData
+from disent.dataset.data import EpisodesPickledData
 from disent.dataset.data import Hdf5Dataset
+from disent.dataset.data import MmapGroundTruthData
+from disent.dataset.data import SelfContainedHdf5GroundTruthData
+from disent.dataset.data import SharedArray
 from disent.dataset.data import XYObjectData
+from disent.dataset.data import save_pickled_episodes_packed
+from disent.dataset.transform import ToImgTensorF32
+from disent.dataset.util.datafile import DataFileHashedDl
+from disent.dataset.util.datafile import DataFileHashedDlNpzH5
+from disent.dataset.util.datafile import get_hdf5_num_workers
+from disent.dataset.util.hdf5 import H5Builder
 from disent.dataset.util.hdf5 import hdf5_resave_file
 from disent.dataset.util.hdf5 import hdf5_test_speed
+from disent.dataset.util.hdf5_tune import ACCESS_PATTERNS
+from disent.dataset.util.hdf5_tune import hdf5_autotune_chunks
+from disent.dataset.util.materialize import materialize_transformed
+from disent.dataset.util.mmap import mmap_read_header
+from disent.dataset.util.mmap import mmap_save_gt_data
+from disent.dataset.util.mmap import MMAP_ALIGN
+from disent.dataset.util.npz import NpzArrayReader
+from disent.dataset.wrapper import DitheredDataset
+from disent.dataset.wrapper import MaskedDataset
+from disent.dataset.util.prepare import prepare_datafiles
+from disent.util.inout.files import FileLock
+from disent.util.inout.files import retrieve_file
+from disent.util.inout.cache import stalefile
+from disent.util.inout.hashing import get_hash_cache_path
 from disent.util.inout.hashing import hash_file
 from disent.util.function import wrapped_partial
+from disent.util.math.dither import nd_dither_matrix
 
 from tests.util import no_stderr
 from tests.util import no_stdout
@@ -149,6 +187,87 @@ def test_hdf5_resave_dataset():
                 assert out['data'].chunks == (1, 4, 4, 3)
 
 
+def _invert_obs(batch):
+    return 255 - batch
+
+
+@pytest.mark.parametrize(['chunk_size', 'batch_size', 'out_mutator', 'max_in_flight'], [
+    ((1, 4, 4, 3), None, None, None),
+    ((4, 4, 4, 3), 7, None, 1),       # the last chunk is padded
+    ((5, 4, 4, 3), 12, _invert_obs, 3),
+    ((5, 4, 4, 3), 12, lambda x: 255 - x, 3),  # not picklable, applied in the main process
+    ((1, 2, 4, 3), None, None, None),  # chunks do not span observations, falls back to serial
+])
+def test_hdf5_resave_dataset_parallel(chunk_size, batch_size, out_mutator, max_in_flight):
+    def resave(out_path, num_workers: int):
+        hdf5_resave_file(
+            inp_path=inp_path,
+            out_path=out_path,
+            dataset_name='data',
+            chunk_size=chunk_size,
+            compression='gzip',
+            compression_lvl=4,
+            batch_size=batch_size,
+            out_mutator=out_mutator,
+            write_mode='w',
+            num_workers=num_workers,
+            max_in_flight=max_in_flight,
+        )
+    with no_stdout(), no_stderr():
+        with create_temp_h5data() as (inp_path, raw_data), create_temp_h5data() as (out_path_a, _), create_temp_h5data() as (out_path_b, _):
+            resave(out_path_a, num_workers=0)
+            resave(out_path_b, num_workers=2)
+            # the files should be byte-identical
+            assert hash_file(out_path_a, hash_mode='full') == hash_file(out_path_b, hash_mode='full')
+            with h5py.File(out_path_b, 'r') as out:
+                assert np.all(out['data'][...] == (raw_data if (out_mutator is None) else 255 - raw_data))
+                assert out['data'].chunks == chunk_size
+
+
+def test_hdf5_resave_dataset_parallel_not_identical(monkeypatch):
+    import disent.dataset.util.hdf5 as hdf5_module
+    # simulate a different zlib build, the chunks are then compressed by the hdf5 filter instead
+    compress = hdf5_module.zlib.compress
+    monkeypatch.setattr(hdf5_module, 'zlib', SimpleNamespace(compress=lambda data, level: compress(data, level) + b'\0'))
+    with no_stdout(), no_stderr():
+        with create_temp_h5data() as (inp_path, raw_data), create_temp_h5data() as (out_path_a, _), create_temp_h5data() as (out_path_b, _):
+            for out_path, num_workers in [(out_path_a, 0), (out_path_b, 2)]:
+                hdf5_resave_file(inp_path=inp_path, out_path=out_path, dataset_name='data', chunk_size=(1, 4, 4, 3), compression='gzip', compression_lvl=4, write_mode='w', num_workers=num_workers)
+            assert hash_file(out_path_a, hash_mode='full') == hash_file(out_path_b, hash_mode='full')
+
+
+def test_get_hdf5_num_workers(monkeypatch):
+    monkeypatch.delenv('DISENT_HDF5_NUM_WORKERS', raising=False)
+    assert get_hdf5_num_workers() == min(os.cpu_count() or 1, 16)
+    assert get_hdf5_num_workers(3) == 3
+    monkeypatch.setenv('DISENT_HDF5_NUM_WORKERS', '0')
+    assert get_hdf5_num_workers() == 0
+    assert get_hdf5_num_workers(3) == 3
+
+
+@pytest.mark.parametrize('access_pattern', ACCESS_PATTERNS)
+def test_hdf5_autotune_chunks(access_pattern):
+    gt_data = TestXYObjectData()
+    with create_temp_h5data() as (path, raw_data), h5py.File(path, 'r') as file:
+        best, results = hdf5_autotune_chunks(
+            file['data'],
+            access_pattern=access_pattern,
+            factor_sizes=gt_data.factor_sizes,
+            chunk_sizes=[(1, 4, 4, 3), (4, 4, 4, 3)],
+            compressions=[(None, None), ('gzip', 4), ('lzf', None)],
+            max_entries=40,
+            num_reads=100,
+            timeout=0.1,
+            show_report=False,
+            rng=7,
+        )
+        # shuffle is skipped without compression
+        assert len(results) == 2 * (1 + 2 + 2)
+        assert best == results[0]
+        assert all(a.entries_per_sec >= b.entries_per_sec for a, b in zip(results[:-1], results[1:]))
+        assert set(best.config.datafile_kwargs().keys()) == {'hdf5_chunk_size', 'hdf5_compression', 'hdf5_compression_lvl', 'hdf5_shuffle'}
+
+
 def test_hdf5_speed_test():
     with create_temp_h5data(chunks=(_TEST_LEN, 4, 4, 3)) as (path, _):
         hdf5_test_speed(path, dataset_name='data', access_method='random')
@@ -158,6 +277,506 @@ def test_hdf5_speed_test():
         hdf5_test_speed(path, dataset_name='data', access_method='sequential')
 
 
+def test_dataset_bulk_get():
+    with create_temp_h5data() as (tmp_path, raw_data):
+        gt_data = TestXYObjectData()
+        arr_data = ArrayGroundTruthData.new_like(raw_data, gt_data=gt_data)
+        h5_data = ArrayGroundTruthData.new_like(Hdf5Dataset(tmp_path, 'data'), gt_data=gt_data)
+        # unsorted indices with duplicates
+        indices = np.array([7, 3, 3, 53, 0, 7, 12])
+        for data in [gt_data, arr_data, h5_data]:
+            assert np.all(data.get_observations(indices) == raw_data[indices])
+            assert all(np.all(a == b) for a, b in zip(data.__getitems__(indices), raw_data[indices]))
+            # check that the bulk version matches the normal version
+            dataset = DisentDataset(data, transform=torch.from_numpy, augment=lambda x: x * 2)
+            for mode in ['raw', 'target', 'input']:
+                assert torch.equal(dataset.dataset_batch_from_indices(indices, mode=mode, bulk=False), dataset.dataset_batch_from_indices(indices, mode=mode, bulk=True))
+            (x0, t0), (x1, t1) = dataset.dataset_batch_from_indices(indices, mode='pair', bulk=False), dataset.dataset_batch_from_indices(indices, mode='pair', bulk=True)
+            assert torch.equal(x0, x1) and torch.equal(t0, t1)
+            assert len(dataset.dataset_batch_from_indices(indices, mode='target', bulk=True, collate=False)) == len(indices)
+
+
+def test_dataset_bulk_getitems_not_stackable():
+    data = TestXYObjectData()
+    # count the number of observations read in bulk
+    num_read, get_observations = [0], data._get_observations
+    def _counted_get_observations(idxs):
+        num_read[0] += len(idxs)
+        return get_observations(idxs)
+    data._get_observations = _counted_get_observations
+    # the observations have different shapes and cannot be stacked
+    dataset = DisentDataset(data, transform=lambda x: torch.from_numpy(x[:1 + int(x.sum()) % 2]), augment=lambda x: x * 2)
+    indices = [7, 3, 3, 53, 0, 7, 12]
+    batch = dataset.__getitems__(indices)
+    # the fallback re-uses the unique observations that were already read
+    assert num_read[0] == 5
+    for obs, idx in zip(batch, indices):
+        assert torch.equal(obs['x_targ'][0], dataset[idx]['x_targ'][0])
+        assert torch.equal(obs['x'][0], dataset[idx]['x'][0])
+
+
+def test_mmap_gt_data():
+    gt_data = TestXYObjectData()
+    with NamedTemporaryFile('r') as tmp_file:
+        mmap_save_gt_data(gt_data, tmp_file.name, batch_size=7, overwrite=True, show_progress=False)
+        # check the header
+        header, offset = mmap_read_header(tmp_file.name)
+        assert offset % MMAP_ALIGN == 0
+        assert header['shape'] == [_TEST_LEN, 4, 4, 3]
+        # check the data
+        data = MmapGroundTruthData(tmp_file.name)
+        assert data.name == gt_data.name
+        assert data.factor_names == gt_data.factor_names
+        assert data.factor_sizes == gt_data.factor_sizes
+        assert data.img_shape == gt_data.img_shape
+        assert len(data) == len(gt_data)
+        assert all(np.all(data[i] == gt_data[i]) for i in range(len(gt_data)))
+        assert np.all(data.get_observations([5, 1, 5]) == gt_data.get_observations([5, 1, 5]))
+        # check multiprocessing, the memory mapped array should not be pickled
+        with ProcessPoolExecutor(2) as executor:
+            assert executor.submit(_iterate_over_data, data=data, indices=range(len(data))).result() == _TEST_LEN
+
+
+def _make_raw_episodes(lengths):
+    # episodes are lists of options: (option_name, option_id, ground_truth_states, observed_states)
+    rng = np.random.default_rng(42)
+    return [
+        [(f'opt{k % 2}', k % 2, [{'x': 0}] * n, list(rng.integers(0, 256, size=(n, 4, 4, 3), dtype='uint8'))) for k, n in enumerate(ep)]
+        for ep in lengths
+    ]
+
+
+def test_episodes_packed_data():
+    with TemporaryDirectory() as tmp_dir:
+        inp_file, out_file = os.path.join(tmp_dir, 'episodes.pkl'), os.path.join(tmp_dir, 'episodes.dmmap')
+        with open(inp_file, 'wb') as fp:
+            pickle.dump(_make_raw_episodes([[3, 2], [4], [1, 1, 5]]), fp)
+        save_pickled_episodes_packed(inp_file, out_file, batch_size=4, show_progress=False)
+        # check the packed data matches the pickled data
+        pickled = EpisodesPickledData(inp_file)
+        packed = EpisodesPackedData(out_file)
+        assert len(packed) == len(pickled) == 16
+        assert [len(ep) for ep in packed._episodes] == [len(ep) for ep in pickled._episodes] == [5, 4, 7]
+        assert all(np.all(packed[i] == pickled[i]) for i in range(len(pickled)))
+        assert all(np.all(a == b) for a, b in zip(packed._episodes, pickled._episodes))
+        # episodes are views into the packed observations
+        assert all(np.shares_memory(ep, packed._data) for ep in packed._episodes)
+        # check multiprocessing, the memory mapped array should not be pickled
+        with ProcessPoolExecutor(2) as executor:
+            assert executor.submit(_iterate_over_data, data=packed, indices=range(len(packed))).result() == 16
+
+
+def test_wrapped_data_indices():
+    gt_data = TestXYObjectData()
+    mask = np.arange(len(gt_data)) % 3 == 0
+    for data in [gt_data, gt_data.get_observations(np.arange(len(gt_data))), torch.arange(len(gt_data))]:
+        for wrapped in [MaskedDataset(data, mask=mask), MaskedDataset(data, mask=np.flatnonzero(mask)[::-1].copy())]:
+            assert wrapped._indices.dtype == 'uint32'
+            assert len(wrapped) == np.sum(mask)
+            # batches of indices are translated at once
+            idxs = np.array([4, 0, 4, len(wrapped) - 1])
+            assert np.all(wrapped.translate_indices(idxs) == wrapped._indices[idxs])
+            for obs, idx in zip(wrapped.__getitems__(idxs), idxs):
+                assert np.all(np.asarray(obs) == np.asarray(wrapped[idx]))
+                assert np.all(np.asarray(obs) == np.asarray(data[int(wrapped._indices[idx])]))
+    # the dither mask is computed in blocks
+    full = DitheredDataset(gt_data, dither_n=2, keep_ratio=0.5)
+    blocked = DitheredDataset(gt_data, dither_n=2, keep_ratio=0.5, block_size=7)
+    assert full._indices.dtype == 'uint32'
+    assert np.all(full._indices == blocked._indices)
+    d_mat = nd_dither_matrix(n=2, d=gt_data.num_factors, norm=True) < 0.5
+    assert np.all(full._indices == np.flatnonzero(d_mat[tuple((gt_data.idx_to_pos(np.arange(len(gt_data))) % 2).T)]))
+
+
+def test_hdf5_chunk_cache():
+    with create_temp_h5data(chunks=(4, 4, 4, 3)) as (tmp_path, raw_data):
+        obs_nbytes = raw_data[0].nbytes
+        # cache at most 2 chunks
+        with Hdf5Dataset(tmp_path, 'data', rdcc_nbytes=1024**2, rdcc_nslots=521, rdcc_w0=1.0, chunk_cache_nbytes=obs_nbytes * 4 * 2) as data:
+            assert data.cache_info().max_nbytes == obs_nbytes * 8
+            assert np.all(data[0] == raw_data[0])  # miss, chunk 0
+            assert np.all(data[3] == raw_data[3])  # hit
+            assert np.all(data[-1] == raw_data[-1])  # miss, last partial chunk
+            assert data.cache_info()[:3] == (1, 2, 2)
+            assert np.all(data[[9, 1, 9, 2]] == raw_data[[9, 1, 9, 2]])  # miss chunk 2, hit chunk 0, evicts last chunk
+            assert data.cache_info()[:3] == (2, 3, 2)
+            assert np.all(data[-1] == raw_data[-1])  # miss, evicts chunk 2
+            assert data.cache_info()[:3] == (2, 4, 2)
+            # returned observations are copies
+            data[0][...] = 0
+            assert np.all(data[0] == raw_data[0])
+            # slices are not cached
+            assert np.all(data[5:20] == raw_data[5:20])
+            with pytest.raises(IndexError):
+                data[_TEST_LEN]
+            # the cache is not pickled
+            assert pickle.loads(pickle.dumps(data)).cache_info() == (0, 0, 0, 0, obs_nbytes * 8)
+            data.cache_clear()
+            assert data.cache_info() == (0, 0, 0, 0, obs_nbytes * 8)
+
+
+def _get_shared_name(data) -> str:
+    return data._data.name
+
+
+def test_hdf5_shared_memory_gt_data():
+    gt_data = TestXYObjectData()
+    with NamedTemporaryFile('r', suffix='.h5') as tmp_file:
+        with H5Builder(tmp_file.name, mode='w') as builder:
+            builder.add_dataset_from_gt_data(gt_data, batch_size=7, num_workers=0, show_progress=False)
+        # check the data
+        data = SelfContainedHdf5GroundTruthData(tmp_file.name, in_memory='shared')
+        assert isinstance(data._data, SharedArray)
+        assert data.cache_info() is None
+        assert len(data) == len(gt_data)
+        assert all(np.all(data[i] == gt_data[i]) for i in range(len(gt_data)))
+        assert np.all(data.get_observations([5, 1, 5]) == gt_data.get_observations([5, 1, 5]))
+        # pickling should only store the name of the shared memory block
+        assert len(pickle.dumps(data._data)) < data._data.array.nbytes
+        # check multiprocessing, all processes should attach to the same block
+        with ProcessPoolExecutor(2) as executor:
+            assert executor.submit(_iterate_over_data, data=data, indices=range(len(data))).result() == _TEST_LEN
+            assert executor.submit(_get_shared_name, data).result() == data._data.name
+        # disk data with a chunk cache
+        disk = SelfContainedHdf5GroundTruthData(tmp_file.name, in_memory=False, chunk_cache_nbytes=1024**2)
+        assert np.all(disk.get_observations([5, 1, 5]) == gt_data.get_observations([5, 1, 5]))
+        assert np.all(disk[1] == gt_data[1])
+        assert disk.cache_info().hits == 1
+        # invalid modes
+        with pytest.raises(KeyError):
+            SelfContainedHdf5GroundTruthData(tmp_file.name, in_memory='invalid')
+
+
+def test_shared_array():
+    array = np.arange(2*3*5, dtype='float32').reshape(2, 3, 5)
+    shared = SharedArray.from_array(array, batch_size=1)
+    assert shared.shape == array.shape
+    assert shared.dtype == array.dtype
+    assert np.all(np.asarray(shared) == array)
+    assert not shared.array.flags.writeable
+    # unpickled copies attach to the same block
+    copy = pickle.loads(pickle.dumps(shared))
+    assert copy.name == shared.name
+    assert np.all(copy[1] == array[1])
+    assert not copy.array.flags.writeable
+    copy.close()
+    # the owner unlinks the block
+    name = shared.name
+    shared.close()
+    with pytest.raises(FileNotFoundError):
+        SharedArray((2, 3, 5), 'float32', name=name)
+
+
+@pytest.mark.parametrize(['save_fn', 'key'], [
+    (np.save, None),
+    (lambda path, array: np.savez(path, images=array), 'images'),
+    (lambda path, array: np.savez_compressed(path, images=array), 'images'),
+])
+def test_npz_array_reader(save_fn, key):
+    array = np.stack([img for img in TestXYObjectData()], axis=0)
+    with TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'data.npy' if (key is None) else 'data.npz')
+        save_fn(path, array)
+        with NpzArrayReader(path, key=key) as data:
+            assert data.shape == array.shape
+            assert data.dtype == array.dtype
+            assert len(data) == len(array)
+            # sequential reads
+            assert np.all(np.concatenate([data[i:i+5] for i in range(0, len(data), 5)]) == array)
+            # seeking reads
+            assert np.all(data[7] == array[7])
+            assert np.all(data[-3:] == array[-3:])
+            assert np.all(data[2:9] == array[2:9])
+            with pytest.raises(ValueError):
+                data[::2]
+
+
+def test_datafile_npz_to_h5():
+    array = np.stack([img for img in TestXYObjectData()], axis=0)
+    with TemporaryDirectory() as temp_dir:
+        inp_path = os.path.join(temp_dir, 'inp.npz')
+        np.savez_compressed(inp_path, images=array)
+        datafile = DataFileHashedDlNpzH5(
+            uri=inp_path,
+            uri_hash=hash_file(inp_path, hash_type='md5', hash_mode='fast'),
+            file_hash=None,
+            npz_key='images',
+            hdf5_dataset_name='images',
+            hdf5_chunk_size=(1, 4, 4, 3),
+            hdf5_batch_size=7,
+        )
+        assert datafile.out_name == 'gen.inp.npz.h5'
+        with no_stdout():
+            out_path = datafile.prepare(os.path.join(temp_dir, 'out'))
+        with h5py.File(out_path, 'r') as file:
+            assert file['images'].chunks == (1, 4, 4, 3)
+            assert np.all(file['images'][:] == array)
+        # the file is not re-generated if it exists and the hash is unknown
+        mtime = os.stat(out_path).st_mtime_ns
+        assert datafile.prepare(os.path.join(temp_dir, 'out')) == out_path
+        assert os.stat(out_path).st_mtime_ns == mtime
+
+
+class _LoggedDataFile(DataFileHashedDl):
+    # records each time the file is retrieved
+    def _prepare(self, out_dir: str, out_file: str):
+        with open(os.path.join(out_dir, 'log.txt'), 'a') as f:
+            f.write(f'{self.out_name}\n')
+        time.sleep(0.05)
+        super()._prepare(out_dir=out_dir, out_file=out_file)
+
+
+def test_prepare_datafiles():
+    with TemporaryDirectory() as temp_dir:
+        inp_path = os.path.join(temp_dir, 'inp.bin')
+        with open(inp_path, 'wb') as f:
+            f.write(os.urandom(4096))
+        inp_hash = hash_file(inp_path, hash_type='md5', hash_mode='fast')
+        # datafiles with the same names are only prepared once
+        out_dir = os.path.join(temp_dir, 'out')
+        datafiles = [_LoggedDataFile(uri=inp_path, uri_hash=inp_hash, uri_name=f'out_{i % 3}.bin') for i in range(9)]
+        with no_stdout(), no_stderr():
+            paths = prepare_datafiles(datafiles, out_dir, num_workers=4)
+        assert paths == [os.path.join(out_dir, f'out_{i % 3}.bin') for i in range(9)]
+        assert all(hash_file(path, hash_type='md5', hash_mode='fast') == inp_hash for path in paths)
+        with open(os.path.join(out_dir, 'log.txt')) as f:
+            assert sorted(f.read().splitlines()) == ['out_0.bin', 'out_1.bin', 'out_2.bin']
+
+
+def _locked_append(lock_path: str, log_path: str, name: str):
+    with FileLock(lock_path, poll_interval=0.01):
+        with open(log_path, 'a') as f:
+            f.write(f'start {name}\n')
+            f.flush()
+            time.sleep(0.02)
+            f.write(f'end {name}\n')
+
+
+def test_file_lock():
+    with TemporaryDirectory() as temp_dir:
+        lock_path, log_path = os.path.join(temp_dir, 'file'), os.path.join(temp_dir, 'log.txt')
+        # processes are excluded
+        with ProcessPoolExecutor(3) as executor:
+            for future in [executor.submit(_locked_append, lock_path, log_path, str(i)) for i in range(6)]:
+                future.result()
+        with open(log_path) as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 12
+        assert all((a == f'start {n}') and (b == f'end {n}') for a, b, n in zip(lines[0::2], lines[1::2], [l.split()[1] for l in lines[0::2]]))
+        # threads are excluded
+        with FileLock(lock_path):
+            with ThreadPoolExecutor(1) as executor:
+                with pytest.raises(TimeoutError):
+                    executor.submit(lambda: FileLock(lock_path, timeout=0.05).__enter__()).result()
+
+
+def test_hash_file_cache():
+    with TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(100_000))
+        target = hash_file(path, hash_mode='full')
+        # the hash is saved in the sidecar file
+        assert hash_file(path, hash_mode='full', cache=True) == target
+        assert os.path.isfile(get_hash_cache_path(path))
+        # cached hashes are re-used while the file is unchanged, unless forced
+        with open(get_hash_cache_path(path)) as f:
+            cache = f.read()
+        with open(get_hash_cache_path(path), 'w') as f:
+            f.write(cache.replace(target, 'corrupt'))
+        assert hash_file(path, hash_mode='full', cache=True) == 'corrupt'
+        assert stalefile(path, hash=target, hash_mode='full').is_stale()
+        assert not stalefile(path, hash=target, hash_mode='full', force=True).is_stale()
+        assert hash_file(path, hash_mode='full', cache=True) == target
+        # other modes are cached separately
+        assert hash_file(path, hash_mode='fast', cache=True) == hash_file(path, hash_mode='fast')
+        # modified files are rehashed
+        with open(path, 'ab') as f:
+            f.write(b'extra')
+        assert hash_file(path, hash_mode='full', cache=True) == hash_file(path, hash_mode='full') != target
+
+
+def test_hash_file_modes():
+    import hashlib
+    with TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(2**25 + 12345))
+        with open(path, 'rb') as f:
+            target = hashlib.md5(f.read()).hexdigest()
+        # reading the file differently should not change the hash
+        for use_mmap in [False, True]:
+            for chunk_size in [16384, 2**20]:
+                assert hash_file(path, hash_mode='full', chunk_size=chunk_size, use_mmap=use_mmap) == target
+        # tree hashes do not depend on the number of workers
+        tree_hashes = {
+            hash_file(path, hash_type='blake2b', hash_mode='tree', chunk_size=chunk_size, use_mmap=use_mmap, num_workers=num_workers)
+            for use_mmap in [False, True] for chunk_size in [16384, 2**20] for num_workers in [1, 3]
+        }
+        assert len(tree_hashes) == 1
+        assert tree_hashes != {hash_file(path, hash_type='blake2b', hash_mode='full')}
+
+
+class _RangeRequestHandler(BaseHTTPRequestHandler):
+    # overridden by subclasses
+    data: bytes = b''
+    ranges: bool = True
+    ignore_ranges: bool = False  # advertise range support, but always respond with the full content
+    num_failures: int = 0  # number of responses that are closed early
+    # stats
+    num_served: int = 0
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body: bool):
+        cls = self.__class__
+        start, end = 0, len(cls.data)
+        if cls.ranges and ('Range' in self.headers) and not cls.ignore_ranges:
+            start, end = self.headers['Range'].split('=')[1].split('-')
+            start, end = int(start), int(end) + 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end-1}/{len(cls.data)}')
+        else:
+            self.send_response(200)
+        if cls.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        if send_body:
+            if cls.num_failures > 0:
+                cls.num_failures -= 1
+                end = start + (end - start) // 2
+            self.wfile.write(cls.data[start:end])
+            cls.num_served += end - start
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def _serve_data(data: bytes, ranges: bool = True, num_failures: int = 0, ignore_ranges: bool = False):
+    handler = type('Handler', (_RangeRequestHandler,), dict(data=data, ranges=ranges, num_failures=num_failures, ignore_ranges=ignore_ranges))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}/file.bin', handler
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(['ranges', 'num_segments'], [(True, 1), (True, 3), (False, 3)])
+def test_retrieve_file(ranges: bool, num_segments: int):
+    import hashlib
+    data = os.urandom(1_000_000)
+    with TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'file.bin')
+        # failed responses are retried
+        with _serve_data(data, ranges=ranges, num_failures=2) as (url, handler):
+            hash = retrieve_file(url, path, hash_type='md5', chunk_size=4096, num_segments=num_segments, min_segment_size=1, retry_delay=0)
+        assert hash == hashlib.md5(data).hexdigest()
+        with open(path, 'rb') as f:
+            assert f.read() == data
+        assert sorted(os.listdir(temp_dir)) == ['file.bin']
+
+
+def test_retrieve_file_resume():
+    import hashlib
+    data = os.urandom(1_000_000)
+    with TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'file.bin')
+        with _serve_data(data, num_failures=100) as (url, handler):
+            # the download fails, but progress is kept
+            with pytest.raises(IOError):
+                retrieve_file(url, path, hash_type='md5', chunk_size=4096, num_segments=2, min_segment_size=1, max_retries=1, retry_delay=0)
+            assert not os.path.exists(path)
+            # the download is resumed from where it stopped
+            handler.num_failures, handler.num_served = 0, 0
+            hash = retrieve_file(url, path, hash_type='md5', chunk_size=4096, num_segments=2, min_segment_size=1)
+            assert 0 < handler.num_served < len(data) // 2
+        assert hash == hashlib.md5(data).hexdigest()
+        with open(path, 'rb') as f:
+            assert f.read() == data
+        assert sorted(os.listdir(temp_dir)) == ['file.bin']
+
+
+def test_retrieve_file_ignored_ranges():
+    import hashlib
+    data = os.urandom(1_000_000)
+    with TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'file.bin')
+        # range requests that return the full content are not retried, the download falls back to a single stream
+        with _serve_data(data, ignore_ranges=True) as (url, handler):
+            hash = retrieve_file(url, path, hash_type='md5', chunk_size=4096, num_segments=3, min_segment_size=1, max_retries=100, retry_delay=1)
+        assert hash == hashlib.md5(data).hexdigest()
+        with open(path, 'rb') as f:
+            assert f.read() == data
+        assert sorted(os.listdir(temp_dir)) == ['file.bin']
+
+
+def _fill_cache(data, indices):
+    for i in indices:
+        data[i]
+    return data.cache_info()
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_cached_gt_data(shared: bool):
+    gt_data = TestXYObjectData(transform=ToImgTensorF32())
+    obs_nbytes = gt_data[0].nbytes
+    data = CachedGroundTruthData(gt_data, max_nbytes=obs_nbytes * 8, shared=shared)
+    assert data.factor_sizes == gt_data.factor_sizes
+    assert data.factor_names == gt_data.factor_names
+    assert data.name == gt_data.name
+    assert len(data) == len(gt_data)
+    # check values
+    for i in [0, 1, 0, 10, 1, 53]:  # no collisions in direct-mapped shared caches
+        assert torch.allclose(data[i], gt_data[i])
+    assert data.cache_info()[:2] == (2, 4)
+    assert data.cache_info().hit_rate == 2 / 6
+    assert data.cache_info().nbytes <= obs_nbytes * 8
+    # batches
+    batch = data.__getitems__([3, 0, 3, 2])
+    assert all(torch.allclose(a, gt_data[i]) for a, i in zip(batch, [3, 0, 3, 2]))
+    assert np.all(data.get_observations([3, 2]) == gt_data.get_observations([3, 2]))
+    # multiprocessing, only shared caches are filled by other processes
+    data.cache_clear()
+    with ProcessPoolExecutor(1) as executor:
+        info = executor.submit(_fill_cache, data=data, indices=[4, 5]).result()
+    assert info.misses == 2
+    assert data.cache_info().num_items == (2 if shared else 0)
+    assert torch.allclose(data[4], gt_data[4])
+    assert data.cache_info().hits == (1 if shared else 0)
+
+
+def test_materialize_transformed():
+    gt_data = TestXYObjectData(transform=ToImgTensorF32())
+    with TemporaryDirectory() as tmp_dir:
+        data = materialize_transformed(gt_data, ToImgTensorF32(size=8), tmp_dir, batch_size=7, num_workers=0, show_progress=False)
+        assert len(os.listdir(tmp_dir)) == 1
+        assert data.factor_sizes == gt_data.factor_sizes
+        assert data.img_shape == (8, 8, 3)
+        assert len(data) == len(gt_data)
+        # check values, the transform of gt_data is ignored
+        target = ToImgTensorF32(size=8)
+        assert all(torch.allclose(data[i], target(gt_data.get_observations([i])[0])) for i in range(len(gt_data)))
+        assert all(torch.allclose(a, data[i]) for a, i in zip(data.__getitems__([5, 1, 5]), [5, 1, 5]))
+        # re-use the existing file
+        mtime = os.stat(data._path).st_mtime_ns
+        again = materialize_transformed(gt_data, ToImgTensorF32(size=8), tmp_dir, num_workers=0, show_progress=False)
+        assert again._path == data._path and os.stat(again._path).st_mtime_ns == mtime
+        # different transforms give different files
+        other = materialize_transformed(gt_data, ToImgTensorF32(size=4), tmp_dir, num_workers=0, show_progress=False)
+        assert other._path != data._path and other.img_shape == (4, 4, 3)
+        assert len(os.listdir(tmp_dir)) == 2
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
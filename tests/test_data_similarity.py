@@ -23,11 +23,22 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import numpy as np
+import torch
+from torch.utils.data import DataLoader
 
+from disent.dataset import DisentDataset
+from disent.dataset.data import IndicesGroundTruthData
 from disent.dataset.data import XYObjectData
 from disent.dataset.data import XYObjectShadedData
+from disent.dataset.sampling import GroundTruthPairSampler
+from disent.dataset.transform import DisentDatasetTransform
+from disent.dataset.transform import RenderImgTensorF32
+from disent.dataset.transform import ToImgTensorF32
 from research.code.dataset.data import XYSquaresData         # pragma: delete-on-release
 from research.code.dataset.data import XYSquaresMinimalData  # pragma: delete-on-release
+from research.code.dataset.data import XColumnsData          # pragma: delete-on-release
+from research.code.dataset.data import XYBlocksData          # pragma: delete-on-release
+from research.code.dataset.data import XYSingleSquareData    # pragma: delete-on-release
 
 
 # ========================================================================= #
@@ -73,6 +84,61 @@ def test_xyobject_grey_similarity():
             assert np.allclose(data0[i], data1[i])
 
 
+def _check_render_batch(data):
+    indices = np.random.randint(len(data), size=100)
+    expected = np.stack([data._get_observation(i) for i in indices])
+    # check the batch renderer matches the single renderer
+    batch = data.render_batch(indices)
+    assert batch.dtype == expected.dtype
+    assert np.all(batch == expected)
+    # check preallocated outputs & bulk reads
+    out = np.full_like(expected, 7)
+    assert data.render_batch(indices, out=out) is out
+    assert np.all(out == expected)
+    assert np.all(data.get_observations(indices) == expected)
+    # check the on-device renderer, if supported
+    if hasattr(data, 'render_batch_torch'):
+        rendered = data.render_batch_torch(torch.as_tensor(indices))
+        assert rendered.numpy().dtype == expected.dtype
+        assert np.all(rendered.numpy() == expected)
+
+
+def test_xyobject_render_batch():
+    for rgb in [True, False]:
+        _check_render_batch(XYObjectData(rgb=rgb, palette='greys_4'))
+        _check_render_batch(XYObjectShadedData(rgb=rgb, palette='greys_4'))
+    _check_render_batch(XYObjectData(palette='rainbow_4', grid_spacing=1))
+    _check_render_batch(XYObjectShadedData(palette='colors_2', grid_spacing=3))
+
+
+def test_xysquares_render_batch():                                                       # pragma: delete-on-release
+    _check_render_batch(XYSquaresMinimalData())                                          # pragma: delete-on-release
+    for rgb in [True, False]:                                                            # pragma: delete-on-release
+        _check_render_batch(XYSquaresData(rgb=rgb))                                      # pragma: delete-on-release
+        _check_render_batch(XYSquaresData(rgb=rgb, num_squares=2, grid_spacing=5))       # pragma: delete-on-release
+        _check_render_batch(XYSquaresData(rgb=rgb, grid_spacing=4, dtype='float32'))     # pragma: delete-on-release
+        _check_render_batch(XColumnsData(rgb=rgb, grid_spacing=3))                       # pragma: delete-on-release
+        _check_render_batch(XYBlocksData(rgb=rgb, palette='white'))                      # pragma: delete-on-release
+    _check_render_batch(XYBlocksData(palette='rgb', invert_bg=True))                     # pragma: delete-on-release
+    _check_render_batch(XYSingleSquareData(grid_spacing=3))                              # pragma: delete-on-release
+
+
+def test_xyobject_render_on_device():
+    gt_data = XYObjectShadedData(palette='colors_2')
+    transform = ToImgTensorF32(mean=[0.2, 0.3, 0.4], std=[0.5, 0.6, 0.7])
+    # the dataloader only yields indices
+    dataset = DisentDataset(IndicesGroundTruthData(gt_data), GroundTruthPairSampler(), return_indices=True)
+    batch = next(iter(DataLoader(dataset, batch_size=16, shuffle=True)))
+    assert all(x.shape == (16,) for x in batch['x_targ'])
+    # render the batch, this should match the usual transform
+    augment = DisentDatasetTransform(normalize=RenderImgTensorF32(gt_data, mean=transform.mean, std=transform.std))
+    batch = augment(batch)
+    for xs, idxs in zip(batch['x_targ'], batch['idx']):
+        expected = torch.stack([transform(gt_data[int(i)]) for i in idxs])
+        assert xs.shape == (16, 3, 64, 64)
+        assert torch.allclose(xs, expected)
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
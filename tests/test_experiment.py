@@ -27,8 +27,10 @@ import os
 import os.path
 
 import pytest
+import torch
 
 import experiment.run as experiment_run
+from experiment.util.hydra_data import HydraDataModule
 from experiment.util.hydra_main import hydra_main
 from tests.util import temp_environ
 from tests.util import temp_sys_args
@@ -70,6 +72,70 @@ def test_experiment_run(env, args):
 
 
 
+def test_datamodule_uint8_on_gpu():
+    datamodule = HydraDataModule(
+        data=dict(_target_='disent.dataset.data.XYObjectData'),
+        sampler=dict(_target_='disent.dataset.sampling.SingleSampler'),
+        transform=dict(_target_='disent.dataset.transform.ToImgTensorF32', mean=[0.1, 0.2, 0.3], std=[0.4, 0.5, 0.6]),
+        dataloader_kwargs=dict(batch_size=4, num_workers=0, shuffle=False),
+        uint8_on_gpu=True,
+        return_indices=True,
+    )
+    datamodule.setup()
+    # callbacks & metrics read float32 observations from the noaug dataset
+    assert datamodule.dataset_train_noaug[0]['x_targ'][0].dtype == torch.float32
+    assert datamodule.dataset_train_aug[0]['x_targ'][0].dtype == torch.float32
+    # only the training dataloader yields uint8 observations, these are converted on the device
+    batch = next(iter(datamodule.train_dataloader()))
+    assert batch['x_targ'][0].dtype == torch.uint8
+    batch = datamodule.gpu_batch_augment(batch)
+    expected = torch.stack([datamodule.dataset_train_noaug[int(i)]['x_targ'][0] for i in batch['idx'][0]])
+    assert torch.allclose(batch['x_targ'][0], expected)
+
+
+def test_datamodule_uint8_on_gpu_augment():
+    datamodule = HydraDataModule(
+        data=dict(_target_='disent.dataset.data.XYObjectData'),
+        sampler=dict(_target_='disent.dataset.sampling.SingleSampler'),
+        transform=dict(_target_='disent.dataset.transform.ToImgTensorF32'),
+        augment=dict(_target_='torchvision.transforms.ColorJitter', brightness=[0.2, 0.8], _convert_='all'),
+        dataloader_kwargs=dict(batch_size=64, num_workers=0, shuffle=False),
+        uint8_on_gpu=True,
+    )
+    datamodule.setup()
+    batch = datamodule.gpu_batch_augment(next(iter(datamodule.train_dataloader())))
+    x, x_targ = batch['x'][0], batch['x_targ'][0]
+    # the augment is applied to each observation like the per-observation augment of the
+    # dataset, not once for the entire batch, so each observation has its own brightness
+    factors = x.flatten(start_dim=1).sum(dim=1) / x_targ.flatten(start_dim=1).sum(dim=1)
+    assert len(torch.unique(factors.round(decimals=3))) > 32
+
+
+def test_datamodule_materialize_dir():
+    from tempfile import TemporaryDirectory
+    from disent.dataset.data import MmapGroundTruthData
+    from disent.dataset.data import XYObjectData
+    from disent.dataset.transform import ToImgTensorF32
+    with TemporaryDirectory() as temp_dir:
+        datamodule = HydraDataModule(
+            data=dict(_target_='disent.dataset.data.XYObjectData', grid_size=4, grid_spacing=1, min_square_size=1, max_square_size=2, square_size_spacing=1, palette='rgb_1'),
+            sampler=dict(_target_='disent.dataset.sampling.SingleSampler'),
+            transform=dict(_target_='disent.dataset.transform.ToImgTensorF32', size=8),
+            dataloader_kwargs=dict(batch_size=4, num_workers=0),
+            materialize_dir=temp_dir,
+        )
+        datamodule.prepare_data()
+        assert len(os.listdir(temp_dir)) == 1
+        datamodule.setup()
+        assert len(os.listdir(temp_dir)) == 1
+        # the transformed observations are loaded from the cache instead of being transformed
+        for dataset in [datamodule.dataset_train_noaug, datamodule.dataset_train_aug]:
+            assert isinstance(dataset.gt_data, MmapGroundTruthData)
+            assert dataset._transform is None
+        expected = ToImgTensorF32(size=8)(XYObjectData(grid_size=4, grid_spacing=1, min_square_size=1, max_square_size=2, square_size_spacing=1, palette='rgb_1')[5])
+        assert torch.allclose(datamodule.dataset_train_noaug[5]['x_targ'][0], expected)
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #
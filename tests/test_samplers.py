@@ -28,11 +28,15 @@ from typing import Union
 
 import numpy as np
 import pytest
+import torch
+from torch.utils.data import DataLoader
 
 from disent.dataset import DisentDataset
 from disent.dataset.data import BaseEpisodesData
 from disent.dataset.sampling import *
 from disent.dataset.data import XYObjectData
+from disent.util.seeds import TempNumpySeed
+from disent.util.seeds import worker_init_fn
 
 
 class TestEpisodesData(BaseEpisodesData):
@@ -45,7 +49,7 @@ class TestEpisodesData(BaseEpisodesData):
         ]
 
 
-@pytest.mark.parametrize(['dataset', 'num_samples', 'check_mode', 'sampler'], [
+_TEST_SAMPLERS = [
     [XYObjectData(), 1, 'first', SingleSampler()],
     [XYObjectData(), 1, 'first', GroundTruthSingleSampler()],
 
@@ -91,7 +95,10 @@ class TestEpisodesData(BaseEpisodesData):
     [TestEpisodesData(), 3, 'any', RandomEpisodeSampler(num_samples=3, sample_radius=3)],  # sample_radius >= num_samples
     [TestEpisodesData(), 3, 'any', RandomEpisodeSampler(num_samples=3, sample_radius=4)],
     [TestEpisodesData(), 3, 'any', RandomEpisodeSampler(num_samples=3, sample_radius=-1)],
-])
+]
+
+
+@pytest.mark.parametrize(['dataset', 'num_samples', 'check_mode', 'sampler'], _TEST_SAMPLERS)
 def test_samplers(dataset, num_samples: int, check_mode: Union[Literal['first'], Literal['any']], sampler: BaseDisentSampler):
     # check dataset
     wrapper = DisentDataset(dataset, sampler)
@@ -118,3 +125,105 @@ def test_samplers(dataset, num_samples: int, check_mode: Union[Literal['first'],
     check_samples(len(dataset) - 1)
     for i in range(10):
         check_samples(random.randint(0, len(dataset)-1))
+
+
+@pytest.mark.parametrize(['dataset', 'num_samples', 'check_mode', 'sampler'], _TEST_SAMPLERS)
+def test_samplers_batch(dataset, num_samples: int, check_mode: Union[Literal['first'], Literal['any']], sampler: BaseDisentSampler):
+    wrapper = DisentDataset(dataset, sampler)
+    # check batch sampling
+    idxs = np.random.randint(0, len(dataset), size=64)
+    idxs[:2] = [0, len(dataset) - 1]
+    batch = sampler.sample_batch(idxs)
+    assert batch.shape == (64, num_samples)
+    assert np.all(0 <= batch) and np.all(batch < len(dataset))
+    if check_mode == 'first':
+        assert np.all(batch[:, 0] == idxs)
+    elif check_mode == 'any':
+        assert np.all(np.any(batch == idxs[:, None], axis=1))
+    else:  # pragma: no cover
+        raise RuntimeError('test mode is invalid!')
+    # check the batched dataset fetching
+    obs = wrapper.__getitems__(idxs[:4])
+    assert len(obs) == 4
+    assert all(len(o['x_targ']) == num_samples for o in obs)
+
+
+def test_samplers_batch_distances():
+    data = XYObjectData()
+    # random walks should never exceed the maximum distance
+    sampler = GroundTruthRandomWalkSampler(num_samples=3, p_dist_max=2, n_dist_max=3).init(data)
+    a, p, n = np.moveaxis(data.idx_to_pos(sampler.sample_batch(np.arange(len(data)))), 1, 0)
+    assert np.all(np.abs(a - p).sum(axis=-1) <= 2)
+    assert np.all(np.abs(p - n).sum(axis=-1) <= 3)
+    # pairs should differ in at most p_k factors, each within the radius
+    sampler = GroundTruthPairSampler(p_k_range=(1, 1), p_radius_range=(1, 1)).init(data)
+    a, p = np.moveaxis(data.idx_to_pos(sampler.sample_batch(np.arange(len(data)))), 1, 0)
+    assert np.all(np.sum(a != p, axis=-1) == 1)
+    assert np.all(np.abs(a - p) <= 1)
+    # the distance sampler should always order the positive closer than the negative
+    sampler = GroundTruthDistSampler(num_samples=3, triplet_sample_mode='manhattan_scaled').init(data)
+    a, p, n = np.moveaxis(data.idx_to_pos(sampler.sample_batch(np.arange(len(data)))), 1, 0)
+    scale = np.maximum(1, np.array(data.factor_sizes) - 1)
+    assert np.all(np.sum(np.abs(a - p) / scale, axis=-1) <= np.sum(np.abs(a - n) / scale, axis=-1) + 1e-9)
+
+
+def test_episodes_get_episode_and_idx():
+    data = TestEpisodesData()
+    offsets = np.cumsum([0] + [len(episode) for episode in data._episodes])
+    # check against the start and end of each episode
+    for i, episode in enumerate(data._episodes):
+        for idx in [offsets[i], offsets[i+1] - 1]:
+            ep, j, offset = data.get_episode_and_idx(idx)
+            assert ep is episode
+            assert (j, offset) == (idx - offsets[i], offsets[i])
+    # the batched version should match
+    idxs = np.random.randint(0, len(data), size=100)
+    episode_idxs, js, offs = data.get_episode_and_idx_batch(idxs)
+    for idx, e, j, offset in zip(idxs, episode_idxs, js, offs):
+        ep, j_, offset_ = data.get_episode_and_idx(idx)
+        assert ep is data._episodes[e]
+        assert (j, offset) == (j_, offset_)
+    # out of bounds
+    with pytest.raises(IndexError):
+        data.get_episode_and_idx(len(data))
+    with pytest.raises(IndexError):
+        data.get_episode_and_idx_batch([0, len(data)])
+
+
+def test_episode_sampler_radius():
+    data = TestEpisodesData()
+    sampler = RandomEpisodeSampler(num_samples=3, sample_radius=4).init(data)
+    for idx in range(len(data)):
+        indices = sampler(idx)
+        _, _, offset = data.get_episode_and_idx(idx)
+        # indices are unique, ordered, and within the same episode & radius
+        assert len(set(indices)) == 3
+        assert list(indices) == sorted(indices, reverse=True)
+        assert all(data.get_episode_and_idx(i)[2] == offset for i in indices)
+        assert all(abs(i - idx) < 4 for i in indices)
+
+
+@pytest.mark.parametrize(['dataset', 'num_samples', 'check_mode', 'sampler'], _TEST_SAMPLERS)
+def test_samplers_rng(dataset, num_samples: int, check_mode: str, sampler: BaseDisentSampler):
+    idxs = np.random.randint(0, len(dataset), size=16)
+    # samplers with their own generators are reproducible
+    batch_a = sampler.uninit_copy().init(dataset).set_rng(42).sample_batch(idxs)
+    batch_b = sampler.uninit_copy().init(dataset).set_rng(np.random.default_rng(42)).sample_batch(idxs)
+    assert np.all(batch_a == batch_b)
+    # samplers without generators use the global state
+    with TempNumpySeed(42):
+        batch_a = sampler.uninit_copy().init(dataset).sample_batch(idxs)
+    with TempNumpySeed(42):
+        batch_b = sampler.uninit_copy().init(dataset).sample_batch(idxs)
+    assert np.all(batch_a == batch_b)
+
+
+def test_samplers_worker_init_fn():
+    def get_first_batches(worker_init_fn=None):
+        dataset = DisentDataset(XYObjectData(), sampler=RandomSampler(num_samples=2).set_rng(42), return_indices=True)
+        dataloader = iter(DataLoader(dataset, batch_size=32, shuffle=False, num_workers=2, worker_init_fn=worker_init_fn))
+        return next(dataloader)['idx'][1], next(dataloader)['idx'][1]
+    # the first batch of each worker should not sample the same random indices
+    assert torch.equal(*get_first_batches(worker_init_fn=None))
+    assert not torch.equal(*get_first_batches(worker_init_fn=worker_init_fn))
+
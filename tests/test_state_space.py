@@ -23,6 +23,7 @@
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
 
 import numpy as np
+import pytest
 
 from disent.dataset.util.state_space import StateSpace
 
@@ -74,6 +75,37 @@ def test_discrete_state_space_one_to_one():
         assert np.all(pos_0 == pos_1)
 
 
+def test_discrete_state_space_out_and_dtype():
+    for factor_sizes in FACTOR_SIZES:
+        states = StateSpace(factor_sizes=factor_sizes)
+        idxs = np.random.randint(0, len(states), size=(3, 7))
+        pos = np.moveaxis(np.array(np.unravel_index(idxs, states.factor_sizes)), 0, -1)
+        # check against numpy
+        assert np.all(states.idx_to_pos(idxs) == pos)
+        assert np.all(states.pos_to_idx(pos) == idxs)
+        # check dtypes
+        assert states.idx_to_pos(idxs, dtype='int32').dtype == np.int32
+        assert states.pos_to_idx(pos, dtype='int32').dtype == np.int32
+        # check out
+        out_pos, out_idx = np.zeros_like(pos), np.zeros_like(idxs)
+        assert states.idx_to_pos(idxs, out=out_pos) is out_pos
+        assert states.pos_to_idx(pos, out=out_idx) is out_idx
+        assert np.all(out_pos == pos)
+        assert np.all(out_idx == idxs)
+        # check scalars
+        assert np.all(states.idx_to_pos(int(idxs[0, 0])) == pos[0, 0])
+        assert states.pos_to_idx(pos[0, 0].tolist()) == idxs[0, 0]
+        # check bounds
+        with pytest.raises(ValueError):
+            states.idx_to_pos(len(states))
+        with pytest.raises(ValueError):
+            states.idx_to_pos([0, -1])
+        with pytest.raises(ValueError):
+            states.pos_to_idx(states.factor_sizes)
+        with pytest.raises(ValueError):
+            states.pos_to_idx([states.factor_sizes - 1, states.factor_sizes])
+
+
 def test_new_functions():
     # TODO: convert to propper tests
     s = StateSpace([2, 4, 6])
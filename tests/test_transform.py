@@ -21,12 +21,26 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 #  ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~
+import numpy as np
 import pytest
 import torch
 
+import disent.dataset.transform.functional as F_d
+from disent.dataset import DisentDataset
+from disent.dataset.data import XYObjectData
+from disent.dataset.sampling import GroundTruthPairSampler
+from disent.dataset.transform import DisentDatasetTransform
+from disent.dataset.transform import FftBoxBlur
 from disent.dataset.transform import FftGaussianBlur
+from disent.dataset.transform import FftKernel
+from disent.dataset.transform import ImgTensorU8ToF32
+from disent.dataset.transform import ToImgTensorF32
+from disent.dataset.transform import ToImgTensorU8
+from disent.dataset.transform import is_per_observation_random
 from disent.dataset.transform._augment import _expand_to_min_max_tuples
 from disent.nn.functional import torch_gaussian_kernel
+from disent.nn.functional import torch_box_kernel_2d
+from disent.nn.functional import torch_conv2d_channel_wise_fft
 from disent.nn.functional import torch_gaussian_kernel_2d
 
 
@@ -64,6 +78,117 @@ def test_fft_guassian_blur():
     fn(torch.randn(256, 3, 64, 64))
 
 
+def test_fft_blur_cached_spectra():
+    x = torch.rand(32, 3, 24, 20)
+    # fixed kernels match the reference implementation
+    fn = FftGaussianBlur(sigma=1.5, truncate=3.0, p=1.0)
+    assert torch.allclose(fn(x), torch_conv2d_channel_wise_fft(x, torch_gaussian_kernel_2d(sigma=1.5, truncate=3.0)), atol=1e-5)
+    assert torch.allclose(fn(x[0]), torch_conv2d_channel_wise_fft(x[:1], torch_gaussian_kernel_2d(sigma=1.5, truncate=3.0))[0], atol=1e-5)
+    assert len(fn._spectra) == 1
+    fn = FftBoxBlur(radius=2, p=1.0)
+    assert torch.allclose(fn(x), torch_conv2d_channel_wise_fft(x, torch_box_kernel_2d(radius=2)[None]), atol=1e-5)
+    # random kernels per observation, each truncated individually
+    fn = FftGaussianBlur(sigma=(0.5, 1.5), truncate=2.0, p=1.0, num_buckets=3)
+    targets = torch.stack([torch_conv2d_channel_wise_fft(x, torch_gaussian_kernel_2d(sigma=s, truncate=2.0)) for s in [0.5, 1.0, 1.5]])
+    matches = (fn(x)[None] - targets).abs().flatten(start_dim=2).max(dim=-1).values < 1e-5
+    assert torch.all(matches.sum(dim=0) == 1)
+    assert len(torch.unique(matches.to(torch.int64).argmax(dim=0))) > 1
+    # kernels that are modified in-place are updated
+    fn = FftKernel(kernel='box_r2', normalize_mode='sum')
+    y = fn(x)
+    with torch.no_grad():
+        fn._kernel.mul_(2)
+    assert torch.allclose(fn(x), y * 2, atol=1e-5)
+
+
+@pytest.mark.parametrize(['size', 'mean', 'std'], [
+    (None, None, None),
+    (16, None, None),
+    ((12, 20), [0.1, 0.2, 0.3], [0.5, 0.4, 0.3]),
+    (40, [0.5], None),
+])
+def test_to_img_tensor_batch(size, mean, std):
+    rng = np.random.default_rng(42)
+    x = np.clip(rng.normal(128, 48, size=(8, 32, 24, 3)), 0, 255).astype('uint8')
+    # f32, resizing is within one PIL integer level
+    fn = ToImgTensorF32(size=size, mean=mean, std=std)
+    batch, target = fn(x), torch.stack([fn(o) for o in x])
+    assert batch.shape == target.shape and batch.dtype == torch.float32
+    assert torch.allclose(batch, target, atol=(1.01 / 255) / min(std or [1]))
+    assert torch.allclose(fn(torch.from_numpy(x)), batch)
+    # u8
+    fn = ToImgTensorU8(size=size)
+    batch, target = fn(x), torch.stack([fn(o) for o in x])
+    assert batch.shape == target.shape and batch.dtype == torch.uint8
+    assert (batch.to(torch.int16) - target.to(torch.int16)).abs().max() <= 1
+
+
+def test_to_img_tensor_batch_without_antialias(monkeypatch):
+    # older versions of torch cannot antialias, so batches are resized with PIL instead
+    monkeypatch.setattr(F_d, '_INTERPOLATE_ANTIALIAS', False)
+    x = np.random.default_rng(42).integers(0, 256, size=(4, 32, 24, 3), dtype='uint8')
+    for fn in [ToImgTensorF32(size=16, mean=[0.5], std=[0.2]), ToImgTensorU8(size=16)]:
+        assert torch.equal(fn(x), torch.stack([fn(o) for o in x]))
+        assert torch.equal(fn(torch.from_numpy(x)), torch.stack([fn(o) for o in x]))
+
+
+def test_img_tensor_u8_to_f32():
+    mean, std = [0.1, 0.2, 0.3], [0.5, 0.4, 0.3]
+    data = XYObjectData()
+    dataset_f32 = DisentDataset(data, sampler=GroundTruthPairSampler(), transform=ToImgTensorF32(size=32, mean=mean, std=std))
+    dataset_u8 = DisentDataset(data, sampler=GroundTruthPairSampler(), transform=ToImgTensorU8(size=32))
+    # check batches
+    idxs = [0, 5, 100, 5]
+    batch_f32 = dataset_f32.dataset_batch_from_indices(idxs, mode='target')
+    batch_u8 = dataset_u8.dataset_batch_from_indices(idxs, mode='target')
+    assert batch_u8.dtype == torch.uint8
+    assert torch.allclose(ImgTensorU8ToF32(mean=mean, std=std)(batch_u8), batch_f32, atol=1e-6)
+    # check dataset batch transforms, as applied in the frameworks
+    batch = DisentDatasetTransform(normalize=ImgTensorU8ToF32(mean=mean, std=std))({'x_targ': (batch_u8, batch_u8.clone())})
+    assert all(torch.allclose(x, batch_f32, atol=1e-6) for x in batch['x_targ'])
+
+
+@pytest.mark.parametrize('augment', [
+    FftGaussianBlur(sigma=1.5, truncate=3.0, p=1.0),
+    FftBoxBlur(radius=2, p=1.0),
+    FftKernel(kernel='box_r2', normalize_mode='sum'),
+])
+def test_batch_augment_parity(augment):
+    assert is_per_observation_random(augment)
+    data = XYObjectData()
+    dataset = DisentDataset(data, sampler=GroundTruthPairSampler(), transform=ToImgTensorF32(), augment=augment)
+    idxs = [3, 7, 100, 7]
+    # the augment is applied to each observation individually
+    x, x_targ = dataset.dataset_batch_from_indices(idxs, mode='pair')
+    # the augment is applied to all observations at once
+    batch = DisentDatasetTransform(transform=augment)({'x_targ': (x_targ, x_targ.clone())})
+    assert len(batch['x']) == 2
+    assert all(torch.allclose(b, x, atol=1e-5) for b in batch['x'])
+    assert torch.equal(batch['x_targ'][0], x_targ)
+
+
+def test_batch_augment_parity_not_per_obs():
+    from torchvision.transforms import ColorJitter
+    augment = ColorJitter(brightness=(0.2, 0.8))
+    assert not is_per_observation_random(augment)
+    x_targ = (torch.rand(64, 3, 8, 8), torch.rand(64, 3, 8, 8))
+    # each element of the tuple is augmented individually with its own random values
+    torch.manual_seed(42)
+    expected = tuple(augment(x) for x in x_targ)
+    torch.manual_seed(42)
+    batch = DisentDatasetTransform(transform=augment)({'x_targ': x_targ})
+    assert all(torch.equal(b, e) for b, e in zip(batch['x'], expected))
+    assert not torch.allclose(batch['x'][0].sum() / x_targ[0].sum(), batch['x'][1].sum() / x_targ[1].sum())
+
+
+def test_batch_augment_random_per_obs():
+    x_targ = (torch.rand(256, 3, 16, 16), torch.rand(256, 3, 16, 16))
+    batch = DisentDatasetTransform(transform=FftBoxBlur(radius=(1, 2), p=0.5))({'x_targ': x_targ})
+    # each observation in the batch is randomly augmented
+    changed = torch.cat([(x != xt).flatten(start_dim=1).any(dim=1) for x, xt in zip(batch['x'], x_targ)])
+    assert 0.35 < changed.float().mean() < 0.65
+
+
 # ========================================================================= #
 # END                                                                       #
 # ========================================================================= #